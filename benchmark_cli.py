@@ -0,0 +1,95 @@
+'''
+python3
+
+Checks that cli.py stays fast to start. Every subcommand's `--help` is run
+several times in a fresh interpreter; the script fails if the median time is
+over the budget, or if a heavy dependency was imported along the way.
+
+    python benchmark_cli.py [budget in milliseconds (optional)]
+'''
+import cli
+import statistics
+import subprocess
+import sys
+import time
+
+# Startup time allowed for `cli.py <command> --help`, in milliseconds. Most of
+# it is the interpreter's own startup (compare `python -c pass`).
+STARTUP_BUDGET_MS = 100
+
+RUNS = 7
+
+# Modules that must only be imported once a command actually runs
+HEAVY_MODULES = [
+    'census',
+    'dateutil',
+    'numpy',
+    'pandas',
+    'requests',
+    'sodapy',
+    'us',
+]
+
+def time_command(args, runs=RUNS):
+    """Returns the median wall time of running cli.py with `args`, in
+    milliseconds.
+    """
+
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, cli.__file__] + args,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return statistics.median(timings)
+
+def get_imported_modules(args):
+    """Returns the top-level modules imported while running cli.py with
+    `args`, using the interpreter's `-X importtime` report.
+    """
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', cli.__file__] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+
+        name = line.rsplit('|', 1)[1].strip()
+        modules.add(name.split('.')[0])
+
+    return modules
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else STARTUP_BUDGET_MS
+
+    failures = []
+    for args in [['--help']] + [[command.name, '--help'] for command in cli.COMMANDS] + [['score-all']]:
+        elapsed = time_command(args)
+        heavy_modules = sorted(get_imported_modules(args).intersection(HEAVY_MODULES))
+
+        status = 'ok'
+        if elapsed > budget:
+            status = 'over budget'
+        if heavy_modules:
+            status = 'imported ' + ', '.join(heavy_modules)
+        if status != 'ok':
+            failures.append(args)
+
+        print('%-36s %6.1fms  %s' % (' '.join(args), elapsed, status))
+
+    if failures:
+        print('%d of the commands are slower than %.0fms or import heavy dependencies' % (
+            len(failures),
+            budget,
+        ))
+        sys.exit(1)
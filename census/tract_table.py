@@ -0,0 +1,222 @@
+from census import Census
+from census_tract_race_population import CensusTractRacePopulation
+import json
+import numpy as np
+import os
+import sys
+from us import states
+
+# The ACS5 data profile variables for race ("Race alone or in combination
+# with one or more other races") in the same order as
+# CensusTractRacePopulation.get_all_races(), preceded by the total population.
+# Table DP05 was renumbered in 2017.
+# https://api.census.gov/data/2016/acs/acs5/profile/variables.html
+# https://api.census.gov/data/2017/acs/acs5/profile/variables.html
+VARIABLES_2010_TO_2016 = [
+    'DP05_0058',
+    'DP05_0059',
+    'DP05_0060',
+    'DP05_0061',
+    'DP05_0062',
+    'DP05_0063',
+    'DP05_0064',
+]
+VARIABLES_2017_ON = [
+    'DP05_0070',
+    'DP05_0071',
+    'DP05_0072',
+    'DP05_0073',
+    'DP05_0074',
+    'DP05_0075',
+    'DP05_0076',
+]
+
+# The foreclosure period we follow tracts across
+DEFAULT_VINTAGES = list(range(2010, 2021))
+
+CACHE_DIRECTORY = 'data'
+
+def get_vintage_variables(vintage):
+    """Returns the estimate variable names for a vintage: the total population
+    followed by each race.
+    """
+
+    prefixes = VARIABLES_2010_TO_2016 if vintage <= 2016 else VARIABLES_2017_ON
+
+    return [prefix + CensusTractRacePopulation.VARIABLE_SUFFIX_ESTIMATE for prefix in prefixes]
+
+def fetch_vintage(api_key, state, county, vintage, cache_directory=CACHE_DIRECTORY):
+    """Fetches the race population estimates of every tract in a county for
+    one ACS5 vintage, as a list of {'tract', 'total', 'estimates'} dicts. Each
+    vintage is cached in its own file, since published vintages don't change.
+    """
+
+    cache_filename = os.path.join(cache_directory, 'acs5dp_%s_%s_%d.json' % (state, county, vintage))
+    if os.path.exists(cache_filename):
+        with open(cache_filename, 'r') as f:
+            return json.load(f)
+
+    variable_names = get_vintage_variables(vintage)
+    results = Census(api_key).acs5dp.state_county_tract(
+        variable_names,
+        state,
+        county,
+        Census.ALL,
+        year=vintage,
+    )
+
+    rows = []
+    for result in results:
+        values = [result[name] for name in variable_names]
+        rows.append({
+            'tract': result['state'] + result['county'] + result['tract'],
+            'total': values[0],
+            'estimates': values[1:],
+        })
+
+    os.makedirs(cache_directory, exist_ok=True)
+    with open(cache_filename, 'w') as f:
+        json.dump(rows, f)
+
+    return rows
+
+class TractTable:
+    """Race population estimates for many census tracts across several ACS5
+    vintages, stored as NumPy arrays.
+
+    `estimates[v, t, r]` is the population estimate of race r (in the order
+    of CensusTractRacePopulation.get_all_races()) in tract t for vintage v,
+    and `totals[v, t]` the tract's total population. Tracts are identified by
+    their 11 digit GEOID (state + county + tract); tracts that don't exist in
+    a vintage (tract boundaries were redrawn for 2020) are NaN.
+
+    `percentages[v, t, r]` is each race's share of the tract population, in
+    percent, and `majority_races[v, t]` the index of the race with the highest
+    population estimate, or -1 where no race has any population. Both are
+    computed once when the table is built.
+    """
+
+    RACES = CensusTractRacePopulation.get_all_races()
+
+    def __init__(self, vintages, tracts, totals, estimates):
+        self.vintages = list(vintages)
+        self.tracts = list(tracts)
+        self.totals = totals
+        self.estimates = estimates
+
+        self._vintage_index = dict((vintage, idx) for idx, vintage in enumerate(self.vintages))
+        self._tract_index = dict((tract, idx) for idx, tract in enumerate(self.tracts))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.percentages = 100.0 * self.estimates / self.totals[:, :, np.newaxis]
+        self.percentages[~np.isfinite(self.percentages)] = np.nan
+
+        filled = np.nan_to_num(self.estimates, nan=0.0)
+        self.majority_races = np.argmax(filled, axis=2)
+        self.majority_races[filled.max(axis=2) <= 0] = -1
+
+    @staticmethod
+    def from_rows(rows_per_vintage):
+        """Builds a table from {vintage: rows}, with rows as returned by
+        `fetch_vintage`.
+        """
+
+        vintages = sorted(rows_per_vintage)
+        tracts = sorted(set(row['tract'] for rows in rows_per_vintage.values() for row in rows))
+        tract_index = dict((tract, idx) for idx, tract in enumerate(tracts))
+
+        shape = (len(vintages), len(tracts))
+        totals = np.full(shape, np.nan)
+        estimates = np.full(shape + (len(TractTable.RACES),), np.nan)
+
+        for v, vintage in enumerate(vintages):
+            rows = rows_per_vintage[vintage]
+            t = [tract_index[row['tract']] for row in rows]
+            totals[v, t] = [row['total'] for row in rows]
+            estimates[v, t] = [row['estimates'] for row in rows]
+
+        # The Census API uses large negative numbers for annotations such as
+        # "not available"
+        totals[totals < 0] = np.nan
+        estimates[estimates < 0] = np.nan
+
+        return TractTable(vintages, tracts, totals, estimates)
+
+    @staticmethod
+    def fetch(api_key, state, county, vintages=DEFAULT_VINTAGES, cache_directory=CACHE_DIRECTORY):
+        return TractTable.from_rows(dict(
+            (vintage, fetch_vintage(api_key, state, county, vintage, cache_directory))
+            for vintage in vintages
+        ))
+
+    def get_vintage_index(self, vintage):
+        return self._vintage_index[vintage]
+
+    def get_tract_index(self, tract):
+        """Returns the position of a tract (by GEOID) in the arrays, or -1."""
+
+        return self._tract_index.get(tract, -1)
+
+    def get_tract_indexes(self, tracts):
+        """Returns the positions of many tracts at once, for joining other
+        data (such as property scores) against the table.
+        """
+
+        return np.array([self._tract_index.get(tract, -1) for tract in tracts], dtype=np.int64)
+
+    def get_majority_race(self, vintage, tract):
+        """Returns the race variable prefix (as used by
+        CensusTractRacePopulation) with the highest population in a tract, or
+        None.
+        """
+
+        t = self.get_tract_index(tract)
+        if t < 0:
+            return None
+
+        race = self.majority_races[self.get_vintage_index(vintage), t]
+
+        return self.RACES[race] if race >= 0 else None
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        print('Provide your Census API token as an argument when running this script.')
+        sys.exit()
+
+    api_key = sys.argv[1]
+    if not api_key:
+        print('Provide your Census API token as an argument when running this script.')
+        sys.exit()
+
+    table = TractTable.fetch(
+        api_key,
+        states.MO.fips,
+        CensusTractRacePopulation.COUNTY_CODE_JACKSON_MO,
+    )
+
+    percentages = table.percentages
+    majority_races = table.majority_races
+
+    header_titles = ['Tract', 'Vintage', 'Majority']
+    for race in table.RACES:
+        header_titles.append(CensusTractRacePopulation.get_race_display(race))
+    print(','.join(header_titles))
+
+    for t, tract in enumerate(table.tracts):
+        for v, vintage in enumerate(table.vintages):
+            if np.isnan(table.totals[v, t]):
+                continue
+
+            row_data = [
+                tract,
+                str(vintage),
+                CensusTractRacePopulation.get_race_display(table.RACES[majority_races[v, t]])
+                if majority_races[v, t] >= 0 else '',
+            ]
+            for r in range(len(table.RACES)):
+                row_data.append('%d (%.2f%%)' % (
+                    np.nan_to_num(table.estimates[v, t, r]),
+                    np.nan_to_num(percentages[v, t, r]),
+                ))
+
+            print(','.join(row_data))
@@ -0,0 +1,134 @@
+'''
+python3
+
+One command line entry point for the project's scripts:
+
+    python cli.py violations-per-property [app token]
+    python cli.py census-summary [census api key]
+
+Only the standard library is imported up front. A subcommand's arguments are
+checked before its script (and the dependencies it needs, such as sodapy,
+pandas or census) is loaded, so `--help` and usage errors return quickly.
+Run `python benchmark_cli.py` to check the startup time.
+'''
+import argparse
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class Command:
+    """A subcommand that runs one of the project's scripts.
+
+    `arguments` is a list of (name, help) tuples, passed on to the script as
+    positional arguments. Names ending in '?' are optional. The script is run
+    from its own directory, since the scripts read and write files relative to
+    it (e.g. `example/reo_properties.csv`).
+    """
+
+    def __init__(self, name, script, description, arguments=()):
+        self.name = name
+        self.script = script
+        self.description = description
+        self.arguments = arguments
+
+    def add_parser(self, subparsers):
+        parser = subparsers.add_parser(self.name, help=self.description, description=self.description)
+        for name, help_text in self.arguments:
+            if name.endswith('?'):
+                parser.add_argument(name[:-1], nargs='?', help=help_text)
+            else:
+                parser.add_argument(name, help=help_text)
+
+        parser.set_defaults(command=self)
+
+        return parser
+
+    def get_script_args(self, args):
+        script_args = []
+        for name, _ in self.arguments:
+            value = getattr(args, name.rstrip('?'))
+            if value is not None:
+                script_args.append(value)
+
+        return script_args
+
+    def run(self, args):
+        # Imported here so that runpy (and everything the script imports) is
+        # only loaded once a command is actually run
+        import runpy
+
+        script_path = os.path.join(ROOT_DIR, self.script)
+        script_dir = os.path.dirname(script_path)
+
+        sys.argv = [script_path] + self.get_script_args(args)
+        sys.path.insert(0, script_dir)
+        os.chdir(script_dir)
+
+        runpy.run_path(script_path, run_name='__main__')
+
+COMMANDS = [
+    Command(
+        'violations-per-property',
+        'property_violations/violations_per_property.py',
+        'Score the REO properties in example/reo_properties.csv',
+        [('app_token', 'KCMO Open Data app token')],
+    ),
+    Command(
+        'unique-codes',
+        'property_violations/get_unique_codes.py',
+        'Build the catalog of violation codes and ordinance numbers',
+        [('app_token', 'KCMO Open Data app token')],
+    ),
+    Command(
+        'score-all',
+        'property_violations/score_all.py',
+        'Score every KIVA pin in the city',
+        [
+            ('app_token', 'KCMO Open Data app token'),
+            ('start_date', 'start of the scoring period'),
+            ('end_date?', 'end of the scoring period (defaults to today)'),
+        ],
+    ),
+    Command(
+        'census-summary',
+        'census/census_tract_race_population_summary.py',
+        'Print race population estimates for every census tract in Jackson County, MO',
+        [('api_key', 'Census API key')],
+    ),
+    Command(
+        'census-address',
+        'census/census_tract_race_population_address.py',
+        'Print race population estimates for the census tract of an address',
+        [('api_key', 'Census API key'), ('address', 'street address')],
+    ),
+    Command(
+        '311-look-up',
+        '311 look up',
+        'Look up 311 service requests for a list of addresses',
+    ),
+]
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Fair Foreclosures data utilities')
+    subparsers = parser.add_subparsers(title='commands', metavar='command')
+
+    for command in COMMANDS:
+        command.add_parser(subparsers)
+
+    return parser
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if not hasattr(args, 'command'):
+        parser.print_usage()
+        return 2
+
+    args.command.run(args)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
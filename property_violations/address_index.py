@@ -0,0 +1,321 @@
+from collections import Counter
+import csv
+from dangerous_buildings import DangerousBuilding
+import json
+import os
+from property_violations import PropertyViolation
+import re
+import sys
+
+INDEX_FILENAME = 'data/address_index.json'
+
+# USPS standard abbreviations (Publication 28, appendix C1) for the street
+# suffixes found in Kansas City addresses
+STREET_SUFFIXES = {
+    'ALLEY': 'ALY',
+    'AV': 'AVE',
+    'AVEN': 'AVE',
+    'AVENUE': 'AVE',
+    'BLVD': 'BLVD',
+    'BOULEVARD': 'BLVD',
+    'CIRCLE': 'CIR',
+    'CIRC': 'CIR',
+    'COURT': 'CT',
+    'CRT': 'CT',
+    'CROSSING': 'XING',
+    'DRIVE': 'DR',
+    'DRV': 'DR',
+    'EXPRESSWAY': 'EXPY',
+    'FREEWAY': 'FWY',
+    'HIGHWAY': 'HWY',
+    'HWAY': 'HWY',
+    'LANE': 'LN',
+    'PARKWAY': 'PKWY',
+    'PKY': 'PKWY',
+    'PARK': 'PARK',
+    'PLACE': 'PL',
+    'PLAZA': 'PLZ',
+    'POINT': 'PT',
+    'ROAD': 'RD',
+    'ROUTE': 'RTE',
+    'SQUARE': 'SQ',
+    'STREET': 'ST',
+    'STR': 'ST',
+    'STRT': 'ST',
+    'TERRACE': 'TER',
+    'TERR': 'TER',
+    'TRAFFICWAY': 'TRFY',
+    'TRAIL': 'TRL',
+    'TRL': 'TRL',
+    'WAY': 'WAY',
+}
+
+DIRECTIONS = {
+    'NORTH': 'N',
+    'SOUTH': 'S',
+    'EAST': 'E',
+    'WEST': 'W',
+    'NORTHEAST': 'NE',
+    'NORTHWEST': 'NW',
+    'SOUTHEAST': 'SE',
+    'SOUTHWEST': 'SW',
+}
+
+# Tokens that start a unit designator; they are dropped along with the unit
+# number after them
+UNIT_DESIGNATORS = {'APT', 'APARTMENT', 'UNIT', 'STE', 'SUITE', 'BLDG', 'LOT', '#'}
+
+# Fuzzy matches need at least this trigram similarity (0 to 1)
+MIN_SIMILARITY = 0.5
+
+def normalize_address(address):
+    """Normalizes a street address for matching: upper case, no punctuation
+    or unit numbers, and USPS abbreviations for the directional prefix and
+    street suffix. Anything after the first comma (city, state, zip code) is
+    dropped.
+
+    >>> normalize_address("3412 East 29th Street, Kansas City, MO")
+    '3412 E 29TH ST'
+    """
+
+    if not address:
+        return ''
+
+    address = address.split(',')[0].upper().replace('#', ' # ')
+    tokens = re.sub(r"[^A-Z0-9# ]", ' ', address.replace("'", '')).split()
+
+    # "123 MAIN ST APT 4" and "123 #4 MAIN ST" both become "123 MAIN ST"
+    idx = 1
+    while idx < len(tokens):
+        if tokens[idx] in UNIT_DESIGNATORS:
+            del tokens[idx:idx + 2]
+        else:
+            idx += 1
+
+    if not tokens:
+        return ''
+
+    # Directional prefix (right after the house number) and suffix
+    for idx in (1 if tokens[0].isdigit() else 0, len(tokens) - 1):
+        if idx < len(tokens) and tokens[idx] in DIRECTIONS:
+            tokens[idx] = DIRECTIONS[tokens[idx]]
+
+    # The street suffix is the last token, or the one before a trailing
+    # direction (e.g. "MAIN STREET NORTH"). The first street-name token is
+    # never treated as a suffix, so "COURT ST" stays as it is.
+    first_name_idx = 2 if len(tokens) > 2 and tokens[0].isdigit() and tokens[1] in DIRECTIONS.values() else 1
+    suffix_idx = len(tokens) - 1
+    if tokens[suffix_idx] in DIRECTIONS.values() and suffix_idx > first_name_idx:
+        suffix_idx -= 1
+    if suffix_idx > first_name_idx and tokens[suffix_idx] in STREET_SUFFIXES:
+        tokens[suffix_idx] = STREET_SUFFIXES[tokens[suffix_idx]]
+
+    return ' '.join(tokens)
+
+def get_trigrams(text):
+    padded = '  %s ' % text
+    return set(padded[idx:idx + 3] for idx in range(len(padded) - 2))
+
+def split_house_number(normalized_address):
+    """Returns (house number, street) for a normalized address."""
+
+    number, _, street = normalized_address.partition(' ')
+    if number.isdigit():
+        return number, street
+
+    return None, normalized_address
+
+class AddressIndex:
+    """An in-memory index from normalized street addresses to KIVA pins.
+
+    Exact matches are a dict lookup on the normalized address. Other
+    addresses are matched by trigram similarity of the street name, among the
+    addresses with the same house number (found with a token index), so typos
+    and missing suffixes or directions still resolve without any queries to
+    the KCMO Open Data API.
+    """
+
+    def __init__(self):
+        self.addresses = []
+        self.pins = []
+        self._ids = {}
+        self._house_numbers = {}
+        self._trigrams = {}
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def add(self, address, pin):
+        """Adds an address and its KIVA pin. An address can have several pins."""
+
+        normalized = normalize_address(address)
+        if not normalized or not pin:
+            return
+
+        address_id = self._ids.get(normalized)
+        if address_id is None:
+            address_id = self._ids[normalized] = len(self.addresses)
+            self.addresses.append(normalized)
+            self.pins.append(set())
+
+            number, street = split_house_number(normalized)
+            self._house_numbers.setdefault(number, []).append(address_id)
+            for trigram in get_trigrams(street):
+                self._trigrams.setdefault(trigram, []).append(address_id)
+
+        self.pins[address_id].add(int(pin))
+
+    def add_records(self, records, address_column, pin_column):
+        """Adds raw records (as obtained from the KCMO Open Data API)."""
+
+        for record in records:
+            self.add(record.get(address_column), record.get(pin_column))
+
+    def find(self, address, min_similarity=MIN_SIMILARITY):
+        """Returns (normalized address, pins, similarity) for the best match of
+        an address, or None if nothing is similar enough. If several addresses
+        match equally well (e.g. every house on a street, for an address
+        without a house number), the pins of all of them are returned.
+        """
+
+        normalized = normalize_address(address)
+        if not normalized:
+            return None
+
+        address_id = self._ids.get(normalized)
+        if address_id is not None:
+            return self.addresses[address_id], self.pins[address_id], 1.0
+
+        number, street = split_house_number(normalized)
+        trigrams = get_trigrams(street)
+
+        # Number of trigrams each candidate shares with the street name
+        shared = Counter()
+        if number is not None:
+            for candidate in self._house_numbers.get(number, []):
+                _, candidate_street = split_house_number(self.addresses[candidate])
+                shared[candidate] = len(trigrams.intersection(get_trigrams(candidate_street)))
+        else:
+            for trigram in trigrams:
+                shared.update(self._trigrams.get(trigram, []))
+
+        best = []
+        best_similarity = min_similarity
+        for candidate, n_shared in shared.items():
+            _, candidate_street = split_house_number(self.addresses[candidate])
+            similarity = n_shared / (len(trigrams) + len(get_trigrams(candidate_street)) - n_shared)
+            if similarity > best_similarity or (similarity == best_similarity and not best):
+                best = [candidate]
+                best_similarity = similarity
+            elif similarity == best_similarity:
+                best.append(candidate)
+
+        if not best:
+            return None
+
+        pins = set().union(*(self.pins[candidate] for candidate in best))
+
+        return self.addresses[min(best)], pins, best_similarity
+
+    def resolve(self, address, min_similarity=MIN_SIMILARITY):
+        """Returns the KIVA pin for an address, or None if it can't be
+        resolved to a single pin (including when several addresses match it
+        equally well). An address without a house number is only resolved if
+        it matches exactly, since it could be any house on the street.
+        """
+
+        match = self.find(address, min_similarity)
+        if match is None or len(match[1]) != 1:
+            return None
+
+        normalized = normalize_address(address)
+        if split_house_number(normalized)[0] is None and match[0] != normalized:
+            return None
+
+        return next(iter(match[1]))
+
+    def resolve_all(self, addresses, min_similarity=MIN_SIMILARITY):
+        """Resolves many addresses at once. Returns {address: pin or None}."""
+
+        return dict((address, self.resolve(address, min_similarity)) for address in addresses)
+
+    def save(self, filename):
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(filename, 'w') as f:
+            json.dump([
+                [address, sorted(pins)]
+                for address, pins in zip(self.addresses, self.pins)
+            ], f)
+
+    @staticmethod
+    def load(filename):
+        index = AddressIndex()
+        with open(filename, 'r') as f:
+            for address, pins in json.load(f):
+                for pin in pins:
+                    index.add(address, pin)
+
+        return index
+
+def build_address_index(app_token):
+    """Builds an address index from the distinct address/pin pairs in the
+    property violations and dangerous buildings datasets. The pairs are
+    grouped by the server, so only one row per pair is downloaded.
+    """
+
+    index = AddressIndex()
+    for dataset in (PropertyViolation, DangerousBuilding):
+        index.add_records(
+            dataset.fetch_distinct(app_token, [dataset.ADDRESS_COLUMN, dataset.PIN_COLUMN]),
+            dataset.ADDRESS_COLUMN,
+            dataset.PIN_COLUMN,
+        )
+
+    return index
+
+def load_address_index(app_token, filename=INDEX_FILENAME):
+    """Returns the locally stored address index, building it first if it
+    hasn't been stored yet.
+    """
+
+    if os.path.exists(filename):
+        return AddressIndex.load(filename)
+
+    print('Building the address index ' + filename)
+    index = build_address_index(app_token)
+    index.save(filename)
+
+    return index
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: address_index.py [app token] [addresses file]')
+        sys.exit()
+
+    app_token = sys.argv[1]
+    addresses_filename = sys.argv[2]
+    output_filename = 'results/address_pins.csv'
+
+    index = load_address_index(app_token)
+
+    with open(addresses_filename, 'r') as f:
+        addresses = [row[0] for row in csv.reader(f) if row]
+
+    with open(output_filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow(['Address', 'Matched Address', 'KIVA PIN', 'Similarity'])
+        n_resolved = 0
+        for address in addresses:
+            match = index.find(address)
+            if match is None:
+                writer.writerow([address, '', '', ''])
+                continue
+
+            matched_address, pins, similarity = match
+            writer.writerow([address, matched_address, ' '.join(str(pin) for pin in sorted(pins)), '%.2f' % similarity])
+            n_resolved += 1
+
+    print('Resolved %d of %d addresses; output to %s' % (n_resolved, len(addresses), output_filename))
@@ -0,0 +1,160 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dangerous_buildings import DangerousBuilding
+from local_dataset import read_dataset, write_dataset
+import os
+from property_violations import PropertyViolation
+from service_request_calls import ServiceRequestCall
+import sys
+import tempfile
+import time
+
+DATASETS = {
+    'violations': PropertyViolation,
+    'dangerous_buildings': DangerousBuilding,
+    '311': ServiceRequestCall,
+}
+
+# Requests in flight at once. Each one mostly waits on the network, so
+# threads are enough.
+DEFAULT_WORKERS = 8
+
+# Roughly this many records per id range; each range is fetched in pages of
+# up to SocrataDataset.PAGE_SIZE records
+ROWS_PER_RANGE = 50000
+
+def get_id_range(dataset, app_token):
+    """Returns (lowest id, highest id, number of records) for a dataset, or
+    None if it is empty.
+    """
+
+    id_column = dataset.ID_COLUMN
+    rows = dataset.query(
+        app_token,
+        select='min(%s) as min_id, max(%s) as max_id, count(*) as n_records' % (id_column, id_column),
+    )
+    if not rows or rows[0].get('min_id') is None:
+        return None
+
+    return int(float(rows[0]['min_id'])), int(float(rows[0]['max_id'])), int(rows[0]['n_records'])
+
+def split_id_ranges(min_id, max_id, n_records, rows_per_range=ROWS_PER_RANGE):
+    """Splits the ids from `min_id` to `max_id` into (start, end) ranges (end
+    not included) of equal width, as many as needed for about
+    `rows_per_range` records each if the ids are evenly spread.
+    """
+
+    n_ranges = max(1, -(-n_records // rows_per_range))
+    width = max(1, -(-(max_id - min_id + 1) // n_ranges))
+
+    return [(start, min(start + width, max_id + 1)) for start in range(min_id, max_id + 1, width)]
+
+def fetch_id_range(dataset, app_token, start, end, page_size=None):
+    """Yields the raw records with ids from `start` up to (but not
+    including) `end`, ordered by id.
+    """
+
+    id_column = dataset.ID_COLUMN
+
+    return dataset.query_all(
+        app_token,
+        page_size=page_size,
+        order=id_column,
+        stream=True,
+        where='%s >= %d and %s < %d' % (id_column, start, id_column, end),
+    )
+
+def download_id_range(dataset, app_token, start, end, page_size=None):
+    """Streams the records of an id range into a temporary file (as written
+    by `write_dataset`) and returns its name. The caller deletes it.
+    """
+
+    fd, filename = tempfile.mkstemp(prefix='bulk_download_', suffix='.jsonl')
+    os.close(fd)
+    try:
+        write_dataset(filename, fetch_id_range(dataset, app_token, start, end, page_size))
+    except BaseException:
+        os.remove(filename)
+        raise
+
+    return filename
+
+def download_dataset(dataset, app_token, workers=DEFAULT_WORKERS, rows_per_range=ROWS_PER_RANGE,
+                     page_size=None, journal=None):
+    """Yields every raw record of a dataset, ordered by its ID_COLUMN.
+
+    The id space (from `min(id)` to `max(id)`) is split into ranges that are
+    fetched concurrently by `workers` threads, so a full download is limited
+    by bandwidth rather than by the round trip of each page. Each range is
+    streamed into a temporary file, and the files are replayed in order as
+    soon as they and every range before them are done, so only one record at
+    a time is held in memory; at most twice as many ranges as there are
+    workers are waiting on disk.
+
+    With a FetchJournal, each range is recorded before it is yielded and is
+    reused by a rerun after an interrupted download. Records without an id
+    are not downloaded.
+    """
+
+    id_range = get_id_range(dataset, app_token)
+    if id_range is None:
+        return
+
+    ranges = deque(split_id_ranges(*id_range, rows_per_range=rows_per_range))
+    pending = deque()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while ranges or pending:
+            while ranges and len(pending) < 2 * workers:
+                start, end = ranges.popleft()
+                key = '%d-%d' % (start, end)
+                if journal is not None and key in journal:
+                    future = None
+                else:
+                    future = executor.submit(download_id_range, dataset, app_token, start, end, page_size)
+                pending.append((key, future))
+
+            key, future = pending.popleft()
+            if future is None:
+                yield from journal.iter_records(key)
+                continue
+
+            filename = future.result()
+            try:
+                if journal is not None:
+                    journal.record(key, read_dataset(filename))
+                yield from read_dataset(filename)
+            finally:
+                os.remove(filename)
+    finally:
+        # Don't leave temporary files behind if the download fails or the
+        # caller stops early
+        for _, future in pending:
+            if future is not None and not future.cancel():
+                try:
+                    os.remove(future.result())
+                except Exception:
+                    pass
+        executor.shutdown()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[2] not in DATASETS:
+        print('Usage: bulk_download.py [app token] [%s] [output file] [workers (optional)]' % '|'.join(DATASETS))
+        sys.exit()
+
+    app_token = sys.argv[1]
+    dataset = DATASETS[sys.argv[2]]
+    output_filename = sys.argv[3]
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_WORKERS
+
+    started = time.time()
+    n_records = write_dataset(output_filename, download_dataset(dataset, app_token, workers))
+    elapsed = time.time() - started
+
+    print('Downloaded %d records to %s in %.1f seconds (%.0f records/sec)' % (
+        n_records,
+        output_filename,
+        elapsed,
+        n_records / elapsed if elapsed else 0,
+    ))
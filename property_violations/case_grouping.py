@@ -0,0 +1,160 @@
+from datetime import datetime
+import sys
+from violations_per_property import (
+    get_score_weight,
+    get_violation_open_days,
+    get_violations_per_property,
+    read_legal_brief_violations,
+    read_properties,
+    write_violation_stats,
+)
+
+class ViolationCase:
+    """A code enforcement case.
+
+    A single case (`case_id`) often shows up as many rows in the property
+    violations dataset, one per violation code. This class collapses those
+    rows into the case's overall open interval and set of violation codes. It
+    has the attributes the scoring functions use (`case_opened`,
+    `case_closed`, `is_open`, `days_open`), so cases can be scored the same way
+    as individual violations.
+    """
+
+    def __init__(self, case_id, violations):
+        self.case_id = case_id
+        self.violations = violations
+
+        self.pin = violations[0].pin
+        self.address = violations[0].address
+        self.codes = set(v.code.code for v in violations)
+
+        self.is_open = any(v.is_open for v in violations)
+        self.case_opened = min(v.case_opened for v in violations)
+
+        # A case is only closed once every one of its violations is closed
+        closed_dates = [v.case_closed for v in violations]
+        if self.is_open or None in closed_dates:
+            self.case_closed = None
+        else:
+            self.case_closed = max(closed_dates)
+
+        self.days_open = max(v.days_open for v in violations)
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    @property
+    def row_count(self):
+        return len(self.violations)
+
+def group_violations_by_case(violations):
+    """Groups violation rows into a list of ViolationCase objects. Rows without
+    a case id are kept as cases of their own.
+    """
+
+    rows_by_case = {}
+    for violation in violations:
+        key = violation.case_id or ('row', violation.id_)
+        rows_by_case.setdefault(key, []).append(violation)
+
+    return [
+        ViolationCase(violation_rows[0].case_id, violation_rows)
+        for violation_rows in rows_by_case.values()
+    ]
+
+def group_violations_per_property(violations_per_property):
+    """Replaces each property's violation rows (as returned by
+    `get_violations_per_property`) with its list of cases. Returns the grouped
+    data along with the total number of rows and cases, to show how much the
+    input was reduced.
+    """
+
+    grouped = {}
+    n_rows = 0
+    n_cases = 0
+
+    for kiva_pin, property_data in violations_per_property.items():
+        cases = group_violations_by_case(property_data['violations'])
+        grouped[kiva_pin] = dict(property_data, violations=cases)
+
+        n_rows += len(property_data['violations'])
+        n_cases += len(cases)
+
+    return grouped, n_rows, n_cases
+
+WEIGHTING_PER_CASE = 'per-case'
+WEIGHTING_PER_ROW = 'per-row'
+
+def calculate_case_violation_stats(cases_per_property, legal_brief_violation_codes,
+                                   weighting=WEIGHTING_PER_CASE):
+    """Calculates property scores from grouped cases, using the same scoring
+    algorithm as `calculate_violation_stats`.
+
+    With per-case weighting each case counts once, and is weighted as a legal
+    brief violation if any of its codes is one. With per-row weighting each
+    case's score is multiplied by the number of violation rows it had, which
+    approximates the row-based score while only scoring each case once.
+
+    `violation_count` and `avg_duration` are per case.
+    """
+
+    legal_brief_violation_codes = set(legal_brief_violation_codes)
+    results = {}
+
+    for kiva_pin, property_data in cases_per_property.items():
+        start_date = property_data['start_date']
+        end_date = property_data['end_date'] or datetime.now()
+        days = (end_date - start_date).days
+        cases = property_data['violations']
+
+        if not cases:
+            avg_daily_score = 0.0
+            avg_duration = 0.0
+        else:
+            weighted_open_days = 0
+            for case in cases:
+                weight = get_score_weight(
+                    case.is_open,
+                    not case.codes.isdisjoint(legal_brief_violation_codes),
+                )
+                if weighting == WEIGHTING_PER_ROW:
+                    weight *= case.row_count
+
+                weighted_open_days += weight * get_violation_open_days(case, start_date, days)
+
+            avg_daily_score = weighted_open_days / days
+            avg_duration = sum(case.days_open for case in cases) / len(cases)
+
+        results[kiva_pin] = {
+            'violation_count': len(cases),
+            'score': avg_daily_score,
+            'avg_duration': avg_duration,
+        }
+
+    return results
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        print('Usage: case_grouping.py [app token] [per-case|per-row]')
+        sys.exit()
+
+    app_token = sys.argv[1]
+    weighting = sys.argv[2] if len(sys.argv) > 2 else WEIGHTING_PER_CASE
+    if weighting not in (WEIGHTING_PER_CASE, WEIGHTING_PER_ROW):
+        print('Usage: case_grouping.py [app token] [per-case|per-row]')
+        sys.exit()
+
+    properties = read_properties('example/reo_properties.csv')
+    legal_brief_violation_codes = read_legal_brief_violations('../docs/scoring.md')
+    violations = get_violations_per_property(app_token, properties)
+
+    cases, n_rows, n_cases = group_violations_per_property(violations)
+    print('Grouped %d violation rows into %d cases (%.1f%% fewer)' % (
+        n_rows,
+        n_cases,
+        100.0 * (n_rows - n_cases) / n_rows if n_rows else 0.0,
+    ))
+
+    violation_stats = calculate_case_violation_stats(cases, legal_brief_violation_codes, weighting)
+    write_violation_stats(violation_stats, 'example/results/case_violation_stats.csv')
@@ -0,0 +1,272 @@
+import csv
+from dangerous_buildings import DangerousBuilding
+from datetime import datetime
+import hashlib
+import json
+import os
+import sys
+
+HISTORY_DIRECTORY = 'data/dangerous_buildings'
+OUTPUT_FILENAME = 'results/dangerous_building_time_in_status.csv'
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+CHANGE_ADDED = 'added'
+CHANGE_UPDATED = 'updated'
+CHANGE_REMOVED = 'removed'
+
+def hash_record(record):
+    """Returns a hash of a raw dangerous building record, ignoring Socrata's
+    system fields (which change without the record's data changing).
+    """
+
+    data = dict((key, value) for key, value in record.items() if not key.startswith(':'))
+
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def get_changed_columns(old_record, new_record):
+    """Returns the columns that differ between two raw records, with their new
+    values (None for columns that were removed).
+    """
+
+    changed = {}
+    for key in set(old_record).union(new_record):
+        if key.startswith(':'):
+            continue
+        if old_record.get(key) != new_record.get(key):
+            changed[key] = new_record.get(key)
+
+    return changed
+
+class DangerousBuildingHistory:
+    """A local history of the dangerous buildings dataset, built by saving
+    snapshots of it over time.
+
+    The dataset only has each case's current `statusofcase`. Each new snapshot
+    is compared against the previous one by `casenumber`, using a hash of
+    every row so unchanged rows are skipped without comparing their columns.
+    Only the differences are stored:
+
+        state.json        the latest snapshot's rows and hashes
+        changes.jsonl     added and removed cases, and the changed columns
+                          of updated cases, per snapshot
+        transitions.jsonl status transitions, as
+                          [time, casenumber, old status, new status]
+
+    A case's time in a status is measured from the first snapshot it was seen
+    in with that status, so it is only as precise as the snapshot schedule
+    (and the first snapshot can't know how long cases were already in their
+    status).
+    """
+
+    def __init__(self, directory=HISTORY_DIRECTORY):
+        self.directory = directory
+        self.snapshot_time = None
+        self.records = {}
+        self.hashes = {}
+
+        state_filename = self._get_filename('state.json')
+        if os.path.exists(state_filename):
+            with open(state_filename, 'r') as f:
+                json_data = json.load(f)
+
+            self.snapshot_time = json_data['snapshot_time']
+            self.records = json_data['records']
+            self.hashes = json_data['hashes']
+
+    def _get_filename(self, name):
+        return os.path.join(self.directory, name)
+
+    def _append_lines(self, name, rows):
+        with open(self._get_filename(name), 'a') as f:
+            for row in rows:
+                f.write(json.dumps(row))
+                f.write('\n')
+
+    def _read_lines(self, name):
+        filename = self._get_filename(name)
+        if not os.path.exists(filename):
+            return
+
+        with open(filename, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    def apply_snapshot(self, records, snapshot_time=None):
+        """Compares a full snapshot of raw dangerous building records against
+        the previous one and stores the differences. Returns the number of
+        added, updated and removed cases.
+        """
+
+        snapshot_time = (snapshot_time or datetime.now()).strftime(TIME_FORMAT)
+
+        new_records = {}
+        new_hashes = {}
+        for record in records:
+            casenumber = record.get('casenumber')
+            if not casenumber:
+                continue
+
+            new_records[casenumber] = record
+            new_hashes[casenumber] = hash_record(record)
+
+        changes = []
+        transitions = []
+        n_added = n_updated = n_removed = 0
+
+        for casenumber, record_hash in new_hashes.items():
+            old_hash = self.hashes.get(casenumber)
+            if old_hash == record_hash:
+                continue
+
+            record = new_records[casenumber]
+            if old_hash is None:
+                n_added += 1
+                changes.append([snapshot_time, casenumber, CHANGE_ADDED, record])
+                old_status = None
+            else:
+                n_updated += 1
+                old_record = self.records[casenumber]
+                changes.append([
+                    snapshot_time,
+                    casenumber,
+                    CHANGE_UPDATED,
+                    get_changed_columns(old_record, record),
+                ])
+                old_status = old_record.get('statusofcase')
+
+            if old_hash is None or old_status != record.get('statusofcase'):
+                transitions.append([snapshot_time, casenumber, old_status, record.get('statusofcase')])
+
+        for casenumber in self.hashes:
+            if casenumber not in new_hashes:
+                n_removed += 1
+                changes.append([snapshot_time, casenumber, CHANGE_REMOVED, None])
+                transitions.append([
+                    snapshot_time,
+                    casenumber,
+                    self.records[casenumber].get('statusofcase'),
+                    None,
+                ])
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._append_lines('changes.jsonl', changes)
+        self._append_lines('transitions.jsonl', transitions)
+
+        self.snapshot_time = snapshot_time
+        self.records = new_records
+        self.hashes = new_hashes
+        self.save()
+
+        return n_added, n_updated, n_removed
+
+    def save(self):
+        state_filename = self._get_filename('state.json')
+        temp_filename = state_filename + '.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump({
+                'snapshot_time': self.snapshot_time,
+                'records': self.records,
+                'hashes': self.hashes,
+            }, f)
+
+        os.replace(temp_filename, state_filename)
+
+    def take_snapshot(self, app_token):
+        """Fetches the whole dangerous buildings dataset and applies it as a
+        new snapshot.
+        """
+
+        return self.apply_snapshot(DangerousBuilding.query_all(app_token))
+
+    def get_changes(self, casenumber=None):
+        """Yields [time, casenumber, change, data] rows from the change log."""
+
+        for row in self._read_lines('changes.jsonl'):
+            if casenumber is None or row[1] == casenumber:
+                yield row
+
+    def get_transitions(self, casenumber=None):
+        """Yields [time, casenumber, old status, new status] rows. A new
+        status of None means the case was removed from the dataset.
+        """
+
+        for row in self._read_lines('transitions.jsonl'):
+            if casenumber is None or row[1] == casenumber:
+                yield row
+
+    def get_time_in_status(self):
+        """Returns {casenumber: [(status, start, end), ...]}, the periods each
+        case spent in each status. `end` is None for a case's current status.
+        """
+
+        periods = {}
+
+        for time, casenumber, _, new_status in self.get_transitions():
+            time = datetime.strptime(time, TIME_FORMAT)
+            case_periods = periods.setdefault(casenumber, [])
+
+            if case_periods and case_periods[-1][2] is None:
+                status, start, _ = case_periods[-1]
+                case_periods[-1] = (status, start, time)
+
+            if new_status is not None:
+                case_periods.append((new_status, time, None))
+
+        return periods
+
+    def get_days_in_status(self, as_of=None):
+        """Returns {casenumber: {status: days}}, the total days each case has
+        spent in each status (up to `as_of` for current statuses).
+        """
+
+        as_of = as_of or datetime.now()
+        days_in_status = {}
+
+        for casenumber, case_periods in self.get_time_in_status().items():
+            case_days = days_in_status.setdefault(casenumber, {})
+            for status, start, end in case_periods:
+                case_days[status] = case_days.get(status, 0) + ((end or as_of) - start).days
+
+        return days_in_status
+
+def write_days_in_status(history, filename, as_of=None):
+    with open(filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow(['Case Number', 'KIVA PIN', 'Status', 'Days In Status', 'Current Status'])
+
+        for casenumber, case_days in sorted(history.get_days_in_status(as_of).items()):
+            record = history.records.get(casenumber, {})
+            for status, days in sorted(case_days.items()):
+                writer.writerow([
+                    casenumber,
+                    record.get('kivapin', ''),
+                    status,
+                    days,
+                    'Y' if record.get('statusofcase') == status else 'N',
+                ])
+
+    print('Output time in status to ' + filename)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        print('Provide your app token as an argument when running this script.')
+        sys.exit()
+
+    app_token = sys.argv[1]
+    if not app_token:
+        print('Provide your app token as an argument when running this script.')
+        sys.exit()
+
+    history = DangerousBuildingHistory()
+    n_added, n_updated, n_removed = history.take_snapshot(app_token)
+    print('Snapshot %s: %d added, %d updated, %d removed' % (
+        history.snapshot_time,
+        n_added,
+        n_updated,
+        n_removed,
+    ))
+
+    write_days_in_status(history, OUTPUT_FILENAME)
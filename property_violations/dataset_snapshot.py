@@ -0,0 +1,370 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+import json
+from local_dataset import read_dataset
+import mmap
+import os
+import struct
+import sys
+
+# A snapshot is a read-only, column-oriented copy of a dataset that is opened
+# with mmap. Every process that opens the same snapshot file shares one copy of
+# it in the OS page cache, and reading a column doesn't copy or parse anything.
+#
+# File layout (all values little-endian, every section 8-byte aligned):
+#   magic (8 bytes) | header length (uint64) | JSON header | padding
+#   one fixed-width array per column
+#   string dictionary: offsets (int64, n_strings + 1) | UTF-8 blob
+#
+# Column types:
+#   int    int64, NULL_INT for missing values
+#   float  float64, NaN for missing values
+#   date   int64 seconds since 1970-01-01, NULL_INT for missing values
+#   str    int64 index into the string dictionary, -1 for missing values
+
+SNAPSHOT_MAGIC = b'FFSNAP01'
+NULL_INT = -2 ** 63
+NULL_STRING = -1
+
+_FORMATS = {
+    'int': 'q',
+    'float': 'd',
+    'date': 'q',
+    'str': 'q',
+}
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Columns stored for each dataset, keyed by Socrata resource id
+SCHEMAS = {
+    # Property violations
+    'ha6k-d6qu': [
+        ('id', 'int'),
+        ('case_id', 'int'),
+        ('status', 'str'),
+        ('case_opened', 'date'),
+        ('case_closed', 'date'),
+        ('days_open', 'int'),
+        ('violation_code', 'str'),
+        ('violation_description', 'str'),
+        ('violation_entry_date', 'date'),
+        ('chapter', 'int'),
+        ('ordinance', 'str'),
+        ('address', 'str'),
+        ('county', 'str'),
+        ('state', 'str'),
+        ('zip_code', 'int'),
+        ('latitude', 'float'),
+        ('longitude', 'float'),
+        ('pin', 'int'),
+        ('council_district', 'str'),
+        ('police_district', 'str'),
+        ('inspection_area', 'str'),
+        ('neighborhood', 'str'),
+    ],
+    # Dangerous buildings
+    'rm2v-mbk5': [
+        ('casenumber', 'int'),
+        ('address', 'str'),
+        ('zip_code', 'int'),
+        ('case_opened', 'date'),
+        ('kivapin', 'int'),
+        ('statusofcase', 'str'),
+        ('location_city', 'str'),
+        ('location_address', 'str'),
+        ('location_zip', 'str'),
+        ('location_state', 'str'),
+        ('latitude', 'float'),
+        ('longitude', 'float'),
+    ],
+    # 311 service requests
+    'cyqf-nban': [
+        ('case_id', 'int'),
+        ('source', 'str'),
+        ('department', 'str'),
+        ('work_group', 'str'),
+        ('request_type', 'str'),
+        ('category', 'str'),
+        ('type', 'str'),
+        ('detail', 'str'),
+        ('creation_date', 'date'),
+        ('creation_time', 'str'),
+        ('exceeded_est_timeframe', 'str'),
+        ('closed_date', 'date'),
+        ('days_to_close', 'int'),
+        ('street_address', 'str'),
+        ('zip_code', 'int'),
+        ('neighborhood', 'str'),
+        ('county', 'str'),
+        ('council_district', 'int'),
+        ('police_district', 'str'),
+        ('parcel_id_no', 'int'),
+        ('latitude', 'float'),
+        ('longitude', 'float'),
+        ('days_open', 'int'),
+    ],
+}
+
+class DatasetSnapshotException(Exception):
+    """An exception that may be raised when reading or writing a snapshot."""
+    pass
+
+def _pad(f):
+    padding = -f.tell() % 8
+    if padding:
+        f.write(b'\0' * padding)
+
+def _to_int(value):
+    if value is None or value == '':
+        return NULL_INT
+    return int(float(value))
+
+def _to_float(value):
+    if value is None or value == '':
+        return float('nan')
+    return float(value)
+
+def _to_seconds(value):
+    if not value:
+        return NULL_INT
+    # Socrata timestamps look like 2014-05-19T00:00:00.000
+    parsed = datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S') if 'T' in value \
+        else datetime.strptime(value[:10], '%Y-%m-%d')
+    return int((parsed - _EPOCH).total_seconds())
+
+def write_snapshot(filename, records, schema, sort_by=None):
+    """Writes raw records (as obtained from the KCMO Open Data API) to a
+    snapshot file with the given schema, a list of (column, type) tuples.
+    Sorting by a column (e.g. 'pin') lets readers find all rows with a given
+    value with a binary search. Returns the number of rows written.
+    """
+
+    records = list(records)
+    if sort_by:
+        records.sort(key=lambda record: _to_int(record.get(sort_by)))
+
+    strings = {}
+    columns = []
+    for name, column_type in schema:
+        if column_type == 'int':
+            values = [_to_int(record.get(name)) for record in records]
+        elif column_type == 'float':
+            values = [_to_float(record.get(name)) for record in records]
+        elif column_type == 'date':
+            values = [_to_seconds(record.get(name)) for record in records]
+        elif column_type == 'str':
+            values = []
+            for record in records:
+                value = record.get(name)
+                if value is None:
+                    values.append(NULL_STRING)
+                else:
+                    values.append(strings.setdefault(value, len(strings)))
+        else:
+            raise DatasetSnapshotException('Unknown column type: %s' % column_type)
+
+        columns.append((name, column_type, values))
+
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    encoded_strings = [value.encode('utf-8') for value in strings]
+
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        # The header is written twice: first as a placeholder so the column
+        # offsets are known, then for real with the same length
+        header = {
+            'n_rows': len(records),
+            'sort_by': sort_by,
+            'columns': [[name, column_type, 0] for name, column_type, _ in columns],
+            'n_strings': len(encoded_strings),
+            'strings_offset': 0,
+        }
+        header_bytes = json.dumps(header).encode('utf-8') + b' ' * 256
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        _pad(f)
+
+        for idx, (name, column_type, values) in enumerate(columns):
+            header['columns'][idx][2] = f.tell()
+            f.write(struct.pack('<%d%s' % (len(values), _FORMATS[column_type]), *values))
+            _pad(f)
+
+        header['strings_offset'] = f.tell()
+        offsets = [0]
+        for value in encoded_strings:
+            offsets.append(offsets[-1] + len(value))
+        f.write(struct.pack('<%dq' % len(offsets), *offsets))
+        for value in encoded_strings:
+            f.write(value)
+
+        final_header = json.dumps(header).encode('utf-8')
+        if len(final_header) > len(header_bytes):
+            raise DatasetSnapshotException('Snapshot header grew while writing')
+        f.seek(len(SNAPSHOT_MAGIC) + 8)
+        f.write(final_header.ljust(len(header_bytes)))
+
+    os.replace(temp_filename, filename)
+
+    return len(records)
+
+class DatasetSnapshot:
+    """A read-only dataset snapshot, opened with mmap.
+
+    Opening a snapshot only reads its header; columns are memoryviews directly
+    over the mapped file, so any number of worker processes can open the same
+    file and share a single physical copy of the data.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+
+        if bytes(self._buffer[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise DatasetSnapshotException('%s is not a dataset snapshot' % filename)
+        if sys.byteorder != 'little':
+            raise DatasetSnapshotException('Snapshots can only be read on little-endian machines')
+
+        header_start = len(SNAPSHOT_MAGIC) + 8
+        header_length = struct.unpack_from('<Q', self._buffer, len(SNAPSHOT_MAGIC))[0]
+        header = json.loads(bytes(self._buffer[header_start:header_start + header_length]).decode('utf-8'))
+
+        self.n_rows = header['n_rows']
+        self.sort_by = header['sort_by']
+        self.column_types = {}
+        self._columns = {}
+        for name, column_type, offset in header['columns']:
+            size = self.n_rows * 8
+            self.column_types[name] = column_type
+            self._columns[name] = self._buffer[offset:offset + size].cast(_FORMATS[column_type])
+
+        n_strings = header['n_strings']
+        strings_offset = header['strings_offset']
+        self._string_offsets = self._buffer[strings_offset:strings_offset + (n_strings + 1) * 8].cast('q')
+        self._string_data = strings_offset + (n_strings + 1) * 8
+        self._string_cache = {}
+
+    @property
+    def column_names(self):
+        return list(self._columns)
+
+    def __len__(self):
+        return self.n_rows
+
+    def close(self):
+        for column in self._columns.values():
+            column.release()
+        self._string_offsets.release()
+        self._buffer.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        self.close()
+
+    def column(self, name):
+        """Returns the raw values of a column as a memoryview, without copying.
+        String columns hold indexes into the string dictionary (see
+        `get_string`). `numpy.frombuffer(snapshot.column(name), dtype='<i8')`
+        gives a zero-copy NumPy array.
+        """
+
+        return self._columns[name]
+
+    def get_string(self, index):
+        if index == NULL_STRING:
+            return None
+
+        value = self._string_cache.get(index)
+        if value is None:
+            start = self._string_data + self._string_offsets[index]
+            end = self._string_data + self._string_offsets[index + 1]
+            value = bytes(self._buffer[start:end]).decode('utf-8')
+            self._string_cache[index] = value
+
+        return value
+
+    def get_value(self, name, row):
+        """Returns a column's value for a row, converted back to the type the
+        KCMO Open Data API uses (strings for everything but floats).
+        """
+
+        column_type = self.column_types[name]
+        value = self._columns[name][row]
+
+        if column_type == 'str':
+            return self.get_string(value)
+        if column_type == 'float':
+            return None if value != value else repr(value)
+        if value == NULL_INT:
+            return None
+        if column_type == 'date':
+            return (_EPOCH + timedelta(seconds=value)).strftime('%Y-%m-%dT%H:%M:%S.000')
+
+        return str(value)
+
+    def get_record(self, row):
+        """Returns a row as a raw record dict, which can be passed to the
+        dataset classes' `from_json`.
+        """
+
+        record = {}
+        for name in self._columns:
+            value = self.get_value(name, row)
+            if value is not None:
+                record[name] = value
+
+        return record
+
+    def iter_records(self, start=0, end=None):
+        for row in range(start, self.n_rows if end is None else end):
+            yield self.get_record(row)
+
+    def get_row_range(self, value):
+        """Returns the (start, end) rows holding `value` in the column the
+        snapshot was sorted by.
+        """
+
+        if not self.sort_by:
+            raise DatasetSnapshotException('Snapshot %s is not sorted' % self.filename)
+
+        column = self._columns[self.sort_by]
+        return bisect_left(column, value), bisect_right(column, value)
+
+    def iter_groups(self):
+        """Yields (value, start, end) for each distinct value of the column the
+        snapshot was sorted by.
+        """
+
+        if not self.sort_by:
+            raise DatasetSnapshotException('Snapshot %s is not sorted' % self.filename)
+
+        column = self._columns[self.sort_by]
+        start = 0
+        while start < self.n_rows:
+            value = column[start]
+            end = bisect_right(column, value, start)
+            yield value, start, end
+            start = end
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print('Usage: dataset_snapshot.py [resource id] [JSON lines file] [snapshot file] [sort column (optional)]')
+        sys.exit()
+
+    resource_id, input_filename, snapshot_filename = sys.argv[1:4]
+    sort_by = sys.argv[4] if len(sys.argv) > 4 else None
+    if resource_id not in SCHEMAS:
+        print('Unknown dataset: ' + resource_id)
+        sys.exit()
+
+    n_rows = write_snapshot(snapshot_filename, read_dataset(input_filename), SCHEMAS[resource_id], sort_by)
+    print('Wrote %d rows to %s' % (n_rows, snapshot_filename))
@@ -0,0 +1,195 @@
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import numpy as np
+import os
+import sys
+
+# The per-property statistics written by `write_violation_stats`
+STATISTICS = [
+    ('violation_count', 'Violation Count'),
+    ('score', 'Property Score'),
+    ('avg_duration', 'Average Durations'),
+]
+
+DEFAULT_RESAMPLES = 100000
+DEFAULT_CONFIDENCE = 0.95
+
+# Resamples are drawn in batches of this many, so the (batch x properties)
+# matrices stay small
+BATCH_SIZE = 1000
+
+OUTPUT_FILENAME = 'example/results/disparity_stats.csv'
+
+def read_violation_stats(filename):
+    """Reads a file written by `write_violation_stats` back into a dict of
+    stats keyed by KIVA pin.
+    """
+
+    violation_stats = {}
+    with open(filename, 'r') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            violation_stats[int(row['KIVA PIN'])] = dict(
+                (name, float(row[column])) for name, column in STATISTICS
+            )
+
+    return violation_stats
+
+def read_property_groups(filename):
+    """Reads a CSV file with 'KIVA PIN' and 'Group' columns (e.g. the majority
+    race of each property's census tract) into a dict keyed by KIVA pin.
+    """
+
+    with open(filename, 'r') as f:
+        return dict((int(row['KIVA PIN']), row['Group']) for row in csv.DictReader(f))
+
+def _split_batches(n_resamples):
+    return [BATCH_SIZE] * (n_resamples // BATCH_SIZE) + (
+        [n_resamples % BATCH_SIZE] if n_resamples % BATCH_SIZE else []
+    )
+
+def count_extreme_permutations(values, n_a, observed, n_resamples, seed):
+    """Shuffles the group labels `n_resamples` times and returns how many of
+    the shuffles give a difference of means at least as large (in absolute
+    value) as the observed one.
+    """
+
+    rng = np.random.default_rng(seed)
+    n_b = len(values) - n_a
+    total = values.sum()
+    n_extreme = 0
+
+    for batch_size in _split_batches(n_resamples):
+        # Shuffle each row independently; the first n_a values form group A
+        shuffled = rng.permuted(np.broadcast_to(values, (batch_size, len(values))), axis=1)
+        sums_a = shuffled[:, :n_a].sum(axis=1)
+        differences = sums_a / n_a - (total - sums_a) / n_b
+        n_extreme += int(np.count_nonzero(np.abs(differences) >= abs(observed) - 1e-12))
+
+    return n_extreme
+
+def bootstrap_differences(values_a, values_b, n_resamples, seed):
+    """Returns `n_resamples` bootstrap replicates of the difference of means
+    between two groups, resampling each group with replacement.
+    """
+
+    rng = np.random.default_rng(seed)
+    differences = []
+
+    for batch_size in _split_batches(n_resamples):
+        means_a = values_a[rng.integers(0, len(values_a), (batch_size, len(values_a)))].mean(axis=1)
+        means_b = values_b[rng.integers(0, len(values_b), (batch_size, len(values_b)))].mean(axis=1)
+        differences.append(means_a - means_b)
+
+    return np.concatenate(differences) if differences else np.empty(0)
+
+def _split_resamples(n_resamples, n_parts):
+    return [n_resamples // n_parts + (1 if idx < n_resamples % n_parts else 0) for idx in range(n_parts)]
+
+def compare_groups(violation_stats, property_groups, group_a, group_b,
+                   n_resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE,
+                   workers=None, seed=0):
+    """Tests whether each statistic differs between the properties of two
+    groups. For every statistic, returns the group means, the difference of
+    means, a two-sided permutation test p-value and a bootstrap confidence
+    interval for the difference.
+
+    The resamples are split across `workers` processes, each with its own
+    independent random stream, so results are reproducible for a given seed
+    and number of workers.
+    """
+
+    pins_a = [pin for pin in violation_stats if property_groups.get(pin) == group_a]
+    pins_b = [pin for pin in violation_stats if property_groups.get(pin) == group_b]
+    if not pins_a or not pins_b:
+        raise ValueError('Both groups need at least one property')
+
+    workers = workers or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).spawn(2 * len(STATISTICS) * workers)
+    resamples = _split_resamples(n_resamples, workers)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = []
+        for idx, (name, _) in enumerate(STATISTICS):
+            values_a = np.array([violation_stats[pin][name] for pin in pins_a], dtype=float)
+            values_b = np.array([violation_stats[pin][name] for pin in pins_b], dtype=float)
+            values = np.concatenate([values_a, values_b])
+            observed = values_a.mean() - values_b.mean()
+
+            stat_seeds = seeds[2 * idx * workers:2 * (idx + 1) * workers]
+            permutation_futures = [
+                executor.submit(count_extreme_permutations, values, len(values_a), observed, n, stat_seed)
+                for n, stat_seed in zip(resamples, stat_seeds[:workers])
+            ]
+            bootstrap_futures = [
+                executor.submit(bootstrap_differences, values_a, values_b, n, stat_seed)
+                for n, stat_seed in zip(resamples, stat_seeds[workers:])
+            ]
+            jobs.append((name, values_a, values_b, observed, permutation_futures, bootstrap_futures))
+
+        results = []
+        for name, values_a, values_b, observed, permutation_futures, bootstrap_futures in jobs:
+            n_extreme = sum(future.result() for future in permutation_futures)
+            differences = np.concatenate([future.result() for future in bootstrap_futures])
+            alpha = (1.0 - confidence) / 2
+
+            results.append({
+                'statistic': name,
+                'n_a': len(values_a),
+                'n_b': len(values_b),
+                'mean_a': values_a.mean(),
+                'mean_b': values_b.mean(),
+                'difference': observed,
+                # Counting the observed labelling as one of the permutations
+                # keeps the p-value above zero
+                'p_value': (n_extreme + 1) / (n_resamples + 1),
+                'ci_low': np.quantile(differences, alpha),
+                'ci_high': np.quantile(differences, 1.0 - alpha),
+            })
+
+    return results
+
+def write_disparity_stats(results, group_a, group_b, filename):
+    with open(filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow([
+            'Statistic',
+            '%s Properties' % group_a,
+            '%s Properties' % group_b,
+            '%s Mean' % group_a,
+            '%s Mean' % group_b,
+            'Difference',
+            'P-Value',
+            'CI Low',
+            'CI High',
+        ])
+
+        labels = dict(STATISTICS)
+        for result in results:
+            writer.writerow([
+                labels[result['statistic']],
+                result['n_a'],
+                result['n_b'],
+                '%.4f' % result['mean_a'],
+                '%.4f' % result['mean_b'],
+                '%.4f' % result['difference'],
+                '%.5f' % result['p_value'],
+                '%.4f' % result['ci_low'],
+                '%.4f' % result['ci_high'],
+            ])
+
+    print('Output disparity stats to ' + filename)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        print('Usage: disparity_stats.py [violation stats file] [property groups file] [group a] [group b] [resamples (optional)]')
+        sys.exit()
+
+    violation_stats = read_violation_stats(sys.argv[1])
+    property_groups = read_property_groups(sys.argv[2])
+    group_a = sys.argv[3]
+    group_b = sys.argv[4]
+    n_resamples = int(sys.argv[5]) if len(sys.argv) > 5 else DEFAULT_RESAMPLES
+
+    results = compare_groups(violation_stats, property_groups, group_a, group_b, n_resamples)
+    write_disparity_stats(results, group_a, group_b, OUTPUT_FILENAME)
@@ -0,0 +1,144 @@
+import json
+import os
+from socrata_dataset import iter_json_array
+
+class FetchJournal:
+    """An append-only journal of completed units of work (pages of a dataset,
+    or the records of a single property) for long-running fetch jobs.
+
+    Each completed unit is appended to the journal file as one JSON line and
+    flushed to disk before the job moves on, so if the job crashes a rerun can
+    read back everything that was already fetched and pick up at the first
+    unfinished unit. Keys are stored as JSON, so they should be strings or
+    numbers.
+
+    Only the keys and the position of their line in the file are kept in
+    memory; a unit's records are read back from disk when they are asked for,
+    so memory use doesn't grow with the amount of data journaled. Units that
+    are too large to hold in memory can be written from an iterable and read
+    back one record at a time with `iter_records`.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._offsets = {}
+        self._file = None
+
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            return
+
+        good_length = 0
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # A line cut short by a crash; everything after it is
+                    # dropped and fetched again
+                    break
+
+                self._offsets[entry['key']] = (good_length, len(line))
+                good_length += len(line)
+
+        if good_length < os.path.getsize(self.filename):
+            with open(self.filename, 'r+b') as f:
+                f.truncate(good_length)
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def get(self, key, default=None):
+        location = self._offsets.get(key)
+        if location is None:
+            return default
+
+        offset, length = location
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length).decode('utf-8'))['records']
+
+    def iter_records(self, key):
+        """Yields the records of a unit one at a time, decoding them as they
+        are read from disk instead of loading the whole unit at once.
+        """
+
+        location = self._offsets.get(key)
+        if location is None:
+            return
+
+        offset, length = location
+        prefix = ('{"key": %s, "records": ' % json.dumps(key)).encode('utf-8')
+
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            if f.read(len(prefix)) != prefix:
+                # Not written by `record`; read the whole line instead
+                yield from self.get(key)
+                return
+
+            def chunks():
+                remaining = length - len(prefix)
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 1 << 16))
+                    if not chunk:
+                        return
+                    remaining -= len(chunk)
+                    yield chunk
+
+            yield from iter_json_array(chunks())
+
+    def record(self, key, records):
+        """Durably records the raw records fetched for a unit of work.
+        `records` can be any iterable; it is written out as it is iterated.
+        """
+
+        if self._file is None:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.filename, 'ab')
+            self._file.seek(0, os.SEEK_END)
+
+        # Written the same way as json.dumps({'key': key, 'records': records})
+        offset = self._file.tell()
+        try:
+            self._file.write(('{"key": %s, "records": [' % json.dumps(key)).encode('utf-8'))
+            for idx, record in enumerate(records):
+                if idx:
+                    self._file.write(b', ')
+                self._file.write(json.dumps(record).encode('utf-8'))
+            self._file.write(b']}\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except BaseException:
+            # Drop the partial line, so later units aren't appended after it
+            self._file.seek(offset)
+            self._file.truncate()
+            raise
+
+        self._offsets[key] = (offset, self._file.tell() - offset)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """Deletes the journal, once the job's output has been safely written."""
+
+        self.close()
+        self._offsets = {}
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        self.close()
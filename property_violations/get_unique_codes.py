@@ -1,59 +1,8 @@
-from sodapy import Socrata
+import json
+import os
+from property_violations import PropertyViolation
 import sys
 
-API_DATASET_NAME = 'data.kcmo.org'
-API_RESOURCE_ID = 'ha6k-d6qu'
-
-def get_full_dataset(app_token):
-    n_records = 0
-    offset = 0
-    limit = 1000
-    dataset = []
-
-    with Socrata(API_DATASET_NAME, app_token) as client:
-        while True:
-            violation_records = client.get(
-                API_RESOURCE_ID,
-                order='id',
-                limit=limit,
-                offset=offset,
-            )
-
-            if not violation_records:
-                break
-
-            for record in violation_records:
-                dataset.append(record)
-                n_records += 1
-
-            print('Fetched %d records (offset=%d)' % (
-                limit,
-                offset,
-            ))
-
-            offset += limit
-
-    return dataset
-
-def find_unique_violation_codes(dataset):
-    unique_violation_codes = set()
-
-    for row in dataset:
-        code_description = (
-            row['violation_code'],
-            row['violation_description'],
-        )
-        unique_violation_codes.add(code_description)
-
-    violation_codes = []
-    for item in unique_violation_codes:
-        violation_codes.append({
-            'code': item[0],
-            'description': item[1],
-        })
-
-    return violation_codes
-
 def write_violation_codes_file(filename, dataset):
     with open(filename, 'w') as f:
         for row in dataset:
@@ -62,25 +11,6 @@ def write_violation_codes_file(filename, dataset):
                 row['description'],
             ))
 
-def find_unique_ordinance_numbers(dataset):
-    unique_ordinance_numbers = set()
-
-    for row in dataset:
-        ordinance = (
-            row['chapter'],
-            row['ordinance'],
-        )
-        unique_ordinance_numbers.add(ordinance)
-
-    ordinance_numbers = []
-    for item in unique_ordinance_numbers:
-        ordinance_numbers.append({
-            'chapter': item[0],
-            'ordinance': item[1],
-        })
-
-    return ordinance_numbers
-
 def write_ordinance_numbers_file(filename, dataset):
     with open(filename, 'w') as f:
         for row in dataset:
@@ -89,6 +19,86 @@ def write_ordinance_numbers_file(filename, dataset):
                 row['ordinance'],
             ))
 
+VIOLATION_CODE_COLUMNS = ['violation_code', 'violation_description']
+ORDINANCE_NUMBER_COLUMNS = ['chapter', 'ordinance']
+
+class CodeCatalog:
+    """The distinct violation codes and ordinance numbers in the property
+    violations dataset.
+
+    The catalog is built with `$group` queries, so the server only sends one
+    row per distinct value instead of every violation. It is stored locally
+    along with the dataset's `:updated_at` version, so a refresh only has to
+    look at the records that changed since then.
+    """
+
+    def __init__(self, data_version=None, violation_codes=None, ordinance_numbers=None):
+        self.data_version = data_version
+        self.violation_codes = violation_codes or set()
+        self.ordinance_numbers = ordinance_numbers or set()
+
+    def refresh(self, app_token):
+        """Adds any codes or ordinance numbers from records updated since the
+        last refresh. Returns the number of new entries.
+        """
+
+        data_version = PropertyViolation.fetch_data_version(app_token)
+
+        search_params = []
+        if self.data_version:
+            if data_version == self.data_version:
+                return 0
+
+            search_params.append(":updated_at > '%s'" % self.data_version)
+
+        n_entries = len(self.violation_codes) + len(self.ordinance_numbers)
+
+        for row in PropertyViolation.fetch_distinct(app_token, VIOLATION_CODE_COLUMNS, search_params):
+            self.violation_codes.add((row.get('violation_code'), row.get('violation_description')))
+
+        for row in PropertyViolation.fetch_distinct(app_token, ORDINANCE_NUMBER_COLUMNS, search_params):
+            self.ordinance_numbers.add((row.get('chapter'), row.get('ordinance')))
+
+        self.data_version = data_version
+
+        return len(self.violation_codes) + len(self.ordinance_numbers) - n_entries
+
+    def get_violation_codes(self):
+        return [
+            {'code': code, 'description': description}
+            for code, description in sorted(self.violation_codes, key=_sort_key)
+        ]
+
+    def get_ordinance_numbers(self):
+        return [
+            {'chapter': chapter, 'ordinance': ordinance}
+            for chapter, ordinance in sorted(self.ordinance_numbers, key=_sort_key)
+        ]
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({
+                'data_version': self.data_version,
+                'violation_codes': sorted(self.violation_codes, key=_sort_key),
+                'ordinance_numbers': sorted(self.ordinance_numbers, key=_sort_key),
+            }, f, indent=2)
+
+    @staticmethod
+    def load(filename):
+        if not os.path.exists(filename):
+            return CodeCatalog()
+
+        with open(filename, 'r') as f:
+            json_data = json.load(f)
+
+        return CodeCatalog(
+            json_data['data_version'],
+            set(tuple(row) for row in json_data['violation_codes']),
+            set(tuple(row) for row in json_data['ordinance_numbers']),
+        )
+
+def _sort_key(row):
+    return tuple('' if value is None else value for value in row)
 
 if __name__ == '__main__':
     if len(sys.argv) == 1:
@@ -102,10 +112,17 @@ if __name__ == '__main__':
 
     print('Building violation codes...')
 
-    dataset = get_full_dataset(app_token)
+    catalog_filename = 'results/code_catalog.json'
+    catalog = CodeCatalog.load(catalog_filename)
+    n_new_entries = catalog.refresh(app_token)
+    catalog.save(catalog_filename)
+    print('Catalog: %d new entries (data version %s)' % (
+        n_new_entries,
+        catalog.data_version,
+    ))
 
     violation_codes_filename = 'results/violation_codes.csv'
-    violation_codes = find_unique_violation_codes(dataset)
+    violation_codes = catalog.get_violation_codes()
     write_violation_codes_file(violation_codes_filename, violation_codes)
     print('Violation Codes: output %d records to %s' % (
         len(violation_codes),
@@ -113,7 +130,7 @@ if __name__ == '__main__':
     ))
 
     ordinance_numbers_filename = 'results/ordinance_numbers.csv'
-    ordinance_numbers = find_unique_ordinance_numbers(dataset)
+    ordinance_numbers = catalog.get_ordinance_numbers()
     write_ordinance_numbers_file(ordinance_numbers_filename, ordinance_numbers)
     print('Ordinance Numbers: output %d records to %s' % (
         len(ordinance_numbers),
@@ -0,0 +1,311 @@
+from datetime import datetime
+from dateutil.parser import parse
+import json
+import os
+from property_violations import LazyPropertyViolation, PropertyViolation
+import sys
+from violations_per_property import (
+    filter_relevant_violations,
+    get_violation_last_scored_day,
+    get_violation_weight,
+    read_legal_brief_violations,
+    read_properties,
+    write_violation_stats,
+)
+
+STATE_FILENAME = 'data/score_state.json'
+
+class PropertyScoreState:
+    """The persistent scoring state of a single property.
+
+    For every relevant violation we keep the values `calculate_violation_stats`
+    needs (its daily weight, the last day it counts as open and its duration),
+    along with the running totals for the whole property. Updating a single
+    violation only has to adjust the totals by that violation's contribution.
+    """
+
+    def __init__(self, start_date, end_date):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.violations = {}
+
+        self.weighted_open_days = 0
+        self.total_days_open = 0
+        self._totals_days = self.days
+
+    @property
+    def days(self):
+        end_date = self.end_date or datetime.now()
+        return (end_date - self.start_date).days
+
+    @property
+    def violation_count(self):
+        return len(self.violations)
+
+    def _get_open_days(self, entry, days):
+        weight, last_day, days_open = entry
+        if last_day is None:
+            return 0
+
+        return max(0, min(last_day + 1, days))
+
+    def _add_to_totals(self, entry, sign):
+        weight, last_day, days_open = entry
+        self.weighted_open_days += sign * weight * self._get_open_days(entry, self._totals_days)
+        self.total_days_open += sign * days_open
+
+    def _calculate_weighted_open_days(self, days):
+        return sum(
+            entry[0] * self._get_open_days(entry, days)
+            for entry in self.violations.values()
+        )
+
+    def _refresh_totals(self):
+        # An ongoing period grows every day, so the totals have to be
+        # recalculated for the current length before they can be adjusted
+        days = self.days
+        if days == self._totals_days:
+            return
+
+        self._totals_days = days
+        self.weighted_open_days = self._calculate_weighted_open_days(days)
+
+    def remove_violation(self, violation_id):
+        self._refresh_totals()
+
+        entry = self.violations.pop(violation_id, None)
+        if entry is not None:
+            self._add_to_totals(entry, -1)
+
+        return entry is not None
+
+    def update_violation(self, violation, legal_brief_violation_codes):
+        """Adds, replaces or removes a single violation. Returns True if the
+        property's score changed as a result.
+        """
+
+        removed = self.remove_violation(violation.id_)
+
+        if not filter_relevant_violations([violation], self.start_date, self.end_date):
+            return removed
+
+        entry = (
+            get_violation_weight(violation, legal_brief_violation_codes),
+            get_violation_last_scored_day(violation, self.start_date),
+            violation.days_open,
+        )
+        self.violations[violation.id_] = entry
+        self._add_to_totals(entry, 1)
+
+        return True
+
+    def get_stats(self):
+        """Returns this property's stats in the same format as
+        `calculate_violation_stats`.
+        """
+
+        if not self.violations:
+            return {
+                'violation_count': 0,
+                'score': 0.0,
+                'avg_duration': 0.0,
+            }
+
+        days = self.days
+        weighted_open_days = self.weighted_open_days
+        if days != self._totals_days:
+            # The period is still ongoing, so it has grown since the totals were
+            # last calculated. Violations are only cut off at the end of the
+            # period if they were opened on its last day, so this is rare.
+            weighted_open_days = self._calculate_weighted_open_days(days)
+
+        return {
+            'violation_count': self.violation_count,
+            'score': weighted_open_days / days,
+            'avg_duration': self.total_days_open / self.violation_count,
+        }
+
+    def to_json(self):
+        return {
+            'start_date': self.start_date.isoformat(),
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'totals_days': self._totals_days,
+            'weighted_open_days': self.weighted_open_days,
+            'total_days_open': self.total_days_open,
+            'violations': [[violation_id] + list(entry) for violation_id, entry in self.violations.items()],
+        }
+
+    @staticmethod
+    def from_json(json_data):
+        state = PropertyScoreState(
+            parse(json_data['start_date']),
+            parse(json_data['end_date']) if json_data['end_date'] else None,
+        )
+
+        # Restore the stored totals rather than recalculating them, so loading
+        # the state doesn't depend on the size of each property's history.
+        state.violations = {row[0]: tuple(row[1:]) for row in json_data['violations']}
+        state.weighted_open_days = json_data['weighted_open_days']
+        state.total_days_open = json_data['total_days_open']
+        state._totals_days = json_data['totals_days']
+
+        return state
+
+class ScoreState:
+    """Persistent per-property score state for incremental re-scoring.
+
+    `data_version` is the `:updated_at` timestamp of the newest violation record
+    that has been applied. Only records updated after it need to be fetched on
+    the next refresh.
+    """
+
+    def __init__(self, data_version=None, properties=None):
+        self.data_version = data_version
+        self.properties = properties or {}
+
+    def set_property(self, kiva_pin, start_date, end_date, violations, legal_brief_violation_codes):
+        """(Re)builds the state for a property from its full violation history."""
+
+        state = PropertyScoreState(start_date, end_date)
+        for violation in violations:
+            state.update_violation(violation, legal_brief_violation_codes)
+
+        self.properties[kiva_pin] = state
+
+    def apply_violations(self, violations, legal_brief_violation_codes):
+        """Applies new or updated violation records. Records for properties
+        that aren't tracked are ignored. Returns the set of affected pins.
+        """
+
+        affected_pins = set()
+        for violation in violations:
+            state = self.properties.get(violation.pin)
+            if state and state.update_violation(violation, legal_brief_violation_codes):
+                affected_pins.add(violation.pin)
+
+        return affected_pins
+
+    def get_violation_stats(self):
+        return {kiva_pin: state.get_stats() for kiva_pin, state in self.properties.items()}
+
+    def save(self, filename):
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        json_data = {
+            'data_version': self.data_version,
+            'properties': {str(pin): state.to_json() for pin, state in self.properties.items()},
+        }
+
+        # Write to a temporary file first so a crash can't leave a truncated
+        # state file behind
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump(json_data, f)
+        os.replace(temp_filename, filename)
+
+    @staticmethod
+    def load(filename):
+        if not os.path.exists(filename):
+            return ScoreState()
+
+        with open(filename, 'r') as f:
+            json_data = json.load(f)
+
+        properties = {
+            int(pin): PropertyScoreState.from_json(state)
+            for pin, state in json_data['properties'].items()
+        }
+
+        return ScoreState(json_data['data_version'], properties)
+
+def fetch_updated_violations(app_token, data_version):
+    """Fetches every violation record updated after `data_version` (or every
+    record, if it is None). Returns the violations and the new data version.
+    """
+
+    violations = []
+
+    records = PropertyViolation.query_all(
+        app_token,
+        select=':updated_at, *',
+        where=":updated_at > '%s'" % data_version if data_version else None,
+        order=':updated_at, :id',
+        stream=True,
+    )
+    for record in records:
+        data_version = max(data_version or '', record[':updated_at'])
+        violations.append(LazyPropertyViolation.from_json(record))
+
+    return violations, data_version
+
+def refresh_score_state(app_token, state, properties, legal_brief_violation_codes):
+    """Brings `state` up to date with the violations dataset and the given
+    list of properties. Properties that are new, or whose period changed, are
+    rebuilt from their full history; everything else is only updated with the
+    violation records that changed since the last refresh.
+    """
+
+    if state.data_version is None:
+        # Take the version before fetching anything, so that changes made
+        # while the properties are being built are picked up next time
+        state.data_version = PropertyViolation.fetch_data_version(app_token)
+    else:
+        violations, state.data_version = fetch_updated_violations(app_token, state.data_version)
+        affected_pins = state.apply_violations(violations, legal_brief_violation_codes)
+        print('Applied %d updated violations to %d properties' % (
+            len(violations),
+            len(affected_pins),
+        ))
+
+    kiva_pins = set()
+    for reo_property in properties:
+        kiva_pin = reo_property['kiva_pin']
+        kiva_pins.add(kiva_pin)
+
+        existing = state.properties.get(kiva_pin)
+        if existing and existing.start_date == reo_property['start_date'] \
+                and existing.end_date == reo_property['end_date']:
+            continue
+
+        state.set_property(
+            kiva_pin,
+            reo_property['start_date'],
+            reo_property['end_date'],
+            PropertyViolation.fetch_by_pin(
+                app_token,
+                kiva_pin,
+                lazy=True,
+                search_params=PropertyViolation.get_date_range_search_params(
+                    'case_opened',
+                    reo_property['start_date'],
+                    reo_property['end_date'],
+                ),
+            ),
+            legal_brief_violation_codes,
+        )
+
+    for kiva_pin in set(state.properties) - kiva_pins:
+        del state.properties[kiva_pin]
+
+    return state
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        print('Provide your app token as an argument when running this script.')
+        sys.exit()
+
+    app_token = sys.argv[1]
+    if not app_token:
+        print('Provide your app token as an argument when running this script.')
+        sys.exit()
+
+    properties = read_properties('example/reo_properties.csv')
+    legal_brief_violation_codes = set(read_legal_brief_violations('../docs/scoring.md'))
+
+    state = ScoreState.load(STATE_FILENAME)
+    refresh_score_state(app_token, state, properties, legal_brief_violation_codes)
+    state.save(STATE_FILENAME)
+
+    write_violation_stats(state.get_violation_stats(), 'example/results/violation_stats.csv')
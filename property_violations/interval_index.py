@@ -0,0 +1,190 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+class IntervalIndex:
+    """A static index over closed intervals [start, end].
+
+    Intervals are kept sorted by start, with a segment tree of the latest end
+    point under each node on top. This answers:
+        - how many intervals contain a point, in O(log n), using two sorted
+          arrays of start and end points
+        - which intervals contain a point or overlap a range, in
+          O(log n + k log n) for k results, by only descending into the parts
+          of the tree that can still contain a match
+
+    `end` may be None for intervals that are still open. Intervals that end
+    before they start don't contain any points and are left out.
+    """
+
+    def __init__(self, intervals):
+        intervals = sorted(
+            (interval for interval in intervals if interval[1] is None or interval[1] >= interval[0]),
+            key=lambda interval: interval[0],
+        )
+
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+        self.items = [interval[2] for interval in intervals]
+
+        self.sorted_ends = sorted(end for end in self.ends if end is not None)
+
+        self.size = 1
+        while self.size < len(intervals):
+            self.size *= 2
+
+        # max_ends[node] is the latest end point of the intervals under node, or
+        # _ALWAYS if one of them is still open. Leaves start at index `size`.
+        self.max_ends = [_NEVER] * (2 * self.size)
+        for i, end in enumerate(self.ends):
+            self.max_ends[self.size + i] = _ALWAYS if end is None else end
+        for node in range(self.size - 1, 0, -1):
+            self.max_ends[node] = _max_end(self.max_ends[2 * node], self.max_ends[2 * node + 1])
+
+    def __len__(self):
+        return len(self.items)
+
+    def count_containing(self, point):
+        """Returns the number of intervals that contain `point`."""
+
+        started = bisect_right(self.starts, point)
+        ended = bisect_left(self.sorted_ends, point)
+
+        return started - ended
+
+    def get_overlapping(self, start, end):
+        """Returns the items of all intervals that overlap [start, end]."""
+
+        # Only intervals that start no later than `end` can overlap, and of
+        # those, only ones that end no earlier than `start`
+        limit = bisect_right(self.starts, end)
+        results = []
+        if limit:
+            self._collect(1, 0, self.size, limit, start, results)
+
+        return results
+
+    def get_containing(self, point):
+        """Returns the items of all intervals that contain `point`."""
+
+        return self.get_overlapping(point, point)
+
+    def get_started_between(self, start, end):
+        """Returns the items of all intervals that start within [start, end]."""
+
+        return self.items[bisect_left(self.starts, start):bisect_right(self.starts, end)]
+
+    def _collect(self, node, node_lo, node_hi, limit, start, results):
+        if node_lo >= limit or not _ends_on_or_after(self.max_ends[node], start):
+            return
+
+        if node >= self.size:
+            results.append(self.items[node - self.size])
+            return
+
+        mid = (node_lo + node_hi) // 2
+        self._collect(2 * node, node_lo, mid, limit, start, results)
+        self._collect(2 * node + 1, mid, node_hi, limit, start, results)
+
+# Sentinels for the segment tree: _NEVER for empty leaves, _ALWAYS for
+# intervals that haven't ended
+_NEVER = object()
+_ALWAYS = object()
+
+def _max_end(a, b):
+    if a is _ALWAYS or b is _ALWAYS:
+        return _ALWAYS
+    if a is _NEVER:
+        return b
+    if b is _NEVER:
+        return a
+
+    return max(a, b)
+
+def _ends_on_or_after(end, point):
+    if end is _ALWAYS:
+        return True
+    if end is _NEVER:
+        return False
+
+    return end >= point
+
+def _to_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+class ViolationIndex:
+    """An interval index of property violations, by the days they were open.
+
+    Each violation covers the days from `case_opened` through `case_closed`, or
+    through today if it hasn't been closed. Build one per property with
+    `by_pin`, or one for the whole city from every violation in the dataset
+    for cheap point-in-time snapshots.
+    """
+
+    def __init__(self, violations):
+        violations = [v for v in violations if v.case_opened is not None]
+
+        self.intervals = IntervalIndex(
+            (
+                _to_date(violation.case_opened),
+                _to_date(violation.case_closed) if violation.case_closed else None,
+                violation,
+            )
+            for violation in violations
+        )
+
+        # The exact opening times, for range filters that compare datetimes the
+        # way `filter_relevant_violations` does
+        self.opened = IntervalIndex(
+            (violation.case_opened, violation.case_opened, violation)
+            for violation in violations
+        )
+
+    @staticmethod
+    def by_pin(violations):
+        """Returns a dict of ViolationIndex objects, one per KIVA pin."""
+
+        violations_by_pin = {}
+        for violation in violations:
+            violations_by_pin.setdefault(violation.pin, []).append(violation)
+
+        return {pin: ViolationIndex(pin_violations) for pin, pin_violations in violations_by_pin.items()}
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def get_open_on(self, day):
+        """Returns the violations that were open on the given day."""
+
+        return self.intervals.get_containing(_to_date(day))
+
+    def count_open_on(self, day):
+        """Returns the number of violations that were open on the given day."""
+
+        return self.intervals.count_containing(_to_date(day))
+
+    def get_open_between(self, start, end):
+        """Returns the violations that were open at any time between `start`
+        and `end` (inclusive).
+        """
+
+        return self.intervals.get_overlapping(_to_date(start), _to_date(end))
+
+    def get_opened_between(self, start, end=None):
+        """Returns the violations opened between `start` and `end`, inclusive.
+        This is the same selection as `filter_relevant_violations`.
+        """
+
+        if end is None:
+            end = datetime.max
+
+        return self.opened.get_started_between(start, end)
+
+    def get_daily_open_counts(self, start, end):
+        """Returns a list with the number of violations open on each day from
+        `start` up to (but not including) `end`.
+        """
+
+        start = _to_date(start)
+        days = (_to_date(end) - start).days
+
+        return [self.count_open_on(start + timedelta(days=i)) for i in range(max(0, days))]
@@ -0,0 +1,68 @@
+from dateutil.parser import parse
+
+class LazyField:
+    """A record field that is converted from the raw JSON data on first access.
+
+    `convert` is given the record's raw JSON dict and returns the field value.
+    The value is cached on the instance, so the conversion only ever runs once
+    per record. Because this is a non-data descriptor, the cached value (or any
+    value assigned to the attribute) takes precedence on later lookups.
+    """
+
+    def __init__(self, convert):
+        self.convert = convert
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        value = self.convert(instance.json_data)
+        instance.__dict__[self.name] = value
+
+        return value
+
+class LazyRecord:
+    """Base class for records that keep the raw JSON data obtained from the
+    KCMO Open Data API and only convert the fields that are actually used.
+
+    Subclasses declare their fields as `LazyField` class attributes.
+    """
+
+    def __init__(self, json_data):
+        self.json_data = json_data
+
+    @classmethod
+    def from_json(cls, json_data):
+        return cls(json_data)
+
+    @classmethod
+    def get_field_names(cls):
+        """Returns the names of all lazily converted fields of this record."""
+
+        names = []
+        for klass in reversed(cls.__mro__):
+            for name, value in vars(klass).items():
+                if isinstance(value, LazyField) and name not in names:
+                    names.append(name)
+
+        return names
+
+    def materialize(self):
+        """Converts every field that hasn't been accessed yet. Useful before
+        handing records to code that expects fully parsed objects.
+        """
+
+        for name in self.get_field_names():
+            getattr(self, name)
+
+        return self
+
+def to_date(value):
+    return parse(value) if value else None
+
+def to_int(value):
+    return int(value) if value else 0
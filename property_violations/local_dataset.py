@@ -0,0 +1,31 @@
+import json
+import os
+
+def write_dataset(filename, records):
+    """Write raw records (as obtained from the KCMO Open Data API) to a local
+    file, one JSON object per line. Returns the number of records written.
+    """
+
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    n_records = 0
+    with open(filename, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record))
+            f.write('\n')
+            n_records += 1
+
+    return n_records
+
+def read_dataset(filename):
+    """Read raw records back from a file written by `write_dataset`. This is a
+    generator, so the whole dataset never has to be held in memory.
+    """
+
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
@@ -0,0 +1,420 @@
+from address_index import AddressIndex, normalize_address
+import argparse
+import csv
+from dangerous_buildings import DangerousBuilding
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from incremental_scoring import fetch_updated_violations
+import json
+from local_dataset import read_dataset
+from property_violations import LazyPropertyViolation
+import re
+from score_all import DATASET_FILENAME, load_violations_dataset, read_dataset_version
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+from violations_per_property import (
+    calculate_violation_stats,
+    filter_relevant_violations,
+    parse_property_date,
+    read_legal_brief_violations,
+)
+
+RELOAD_INTERVAL = 15 * 60
+
+class PropertyServiceException(Exception):
+    """An exception for a bad request to the property service. It is returned
+    to the client as a 400 response.
+    """
+    pass
+
+class PropertyStore:
+    """Everything the property service serves, held in memory and indexed by
+    KIVA pin and normalized address:
+
+        violations          LazyPropertyViolation objects by pin, from the
+                            locally stored violations dataset
+        dangerous buildings raw records by pin
+        311 requests        raw records by normalized street address
+                            (optional; the full history is large)
+        census tracts       each property's tract and that tract's row from
+                            census_tract_race_population_summary.py (optional)
+
+    Property scores are cached per pin and period. `reload` applies the
+    violations and dangerous buildings updated since the last load; only the
+    scores of the pins that changed are dropped from the cache. Records
+    deleted from the datasets aren't noticed until the service is restarted.
+    The 311 requests and census data come from local files and are not
+    reloaded.
+    """
+
+    def __init__(self, app_token, legal_brief_violation_codes):
+        self.app_token = app_token
+        self.legal_brief_violation_codes = set(legal_brief_violation_codes)
+
+        self.data_version = None
+        self.dangerous_buildings_version = None
+        self.loaded_at = None
+        self.violations = {}
+        self.dangerous_buildings = {}
+        self._dangerous_building_pins = {}
+        self.service_requests = {}
+        self.property_tracts = {}
+        self.tract_demographics = {}
+        self.address_index = AddressIndex()
+
+        self._score_cache = {}
+        # Bumped whenever a pin's data changes, so a score calculated from
+        # older data isn't cached after the change
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def load(self, dataset_filename=DATASET_FILENAME, service_requests_filename=None,
+             property_tracts_filename=None, tract_demographics_filename=None):
+        violations = {}
+        records = load_violations_dataset(self.app_token, dataset_filename, require_version=True)
+
+        # The stored dataset can be older than the service; the first reload
+        # applies everything updated since it was downloaded (or every record,
+        # if the dataset was empty)
+        self.data_version = read_dataset_version(dataset_filename)
+
+        for record in records:
+            if record.get('pin'):
+                violations.setdefault(int(record['pin']), []).append(LazyPropertyViolation.from_json(record))
+
+            self.address_index.add(record.get('address'), record.get('pin'))
+
+        self.violations = violations
+        self._load_dangerous_buildings()
+
+        if service_requests_filename:
+            service_requests = {}
+            for record in read_dataset(service_requests_filename):
+                address = normalize_address(record.get('street_address'))
+                if address:
+                    service_requests.setdefault(address, []).append(record)
+
+            self.service_requests = service_requests
+
+        if property_tracts_filename:
+            with open(property_tracts_filename, 'r') as f:
+                self.property_tracts = dict(
+                    (int(row['KIVA PIN']), row['Tract']) for row in csv.DictReader(f)
+                )
+
+        if tract_demographics_filename:
+            with open(tract_demographics_filename, 'r') as f:
+                self.tract_demographics = dict((row['Tract'], row) for row in csv.DictReader(f))
+
+        self.loaded_at = datetime.now()
+
+    def _load_dangerous_buildings(self):
+        self.dangerous_buildings_version = DangerousBuilding.fetch_data_version(self.app_token)
+
+        dangerous_buildings = {}
+        dangerous_building_pins = {}
+        for record in DangerousBuilding.query_all(self.app_token):
+            self.address_index.add(record.get('address'), record.get('kivapin'))
+            if record.get('kivapin'):
+                pin = int(record['kivapin'])
+                dangerous_buildings.setdefault(pin, []).append(record)
+                dangerous_building_pins[record.get('casenumber')] = pin
+
+        self.dangerous_buildings = dangerous_buildings
+        self._dangerous_building_pins = dangerous_building_pins
+
+    def _reload_dangerous_buildings(self):
+        """Applies the dangerous building records updated since the last load.
+        Returns the number of updated records.
+        """
+
+        if self.dangerous_buildings_version is None:
+            # The dataset was empty
+            self._load_dangerous_buildings()
+            return sum(len(records) for records in self.dangerous_buildings.values())
+
+        records = list(DangerousBuilding.query_all(
+            self.app_token,
+            select=':updated_at, *',
+            where=":updated_at > '%s'" % self.dangerous_buildings_version,
+            order=':updated_at, :id',
+        ))
+
+        for record in records:
+            self.dangerous_buildings_version = max(self.dangerous_buildings_version, record.pop(':updated_at'))
+            self.address_index.add(record.get('address'), record.get('kivapin'))
+
+            casenumber = record.get('casenumber')
+            old_pin = self._dangerous_building_pins.pop(casenumber, None)
+            if old_pin is not None:
+                self.dangerous_buildings[old_pin] = [
+                    r for r in self.dangerous_buildings.get(old_pin, []) if r.get('casenumber') != casenumber
+                ]
+
+            if record.get('kivapin'):
+                pin = int(record['kivapin'])
+                self.dangerous_buildings[pin] = self.dangerous_buildings.get(pin, []) + [record]
+                self._dangerous_building_pins[casenumber] = pin
+
+        return len(records)
+
+    def _invalidate(self, pin):
+        # Must be called with the lock held
+        self._generations[pin] = self._generations.get(pin, 0) + 1
+        for key in [key for key in self._score_cache if key[0] == pin]:
+            del self._score_cache[key]
+
+    def reload(self):
+        """Applies the violation and dangerous building records updated since
+        the last load. Returns the number of updated violation records.
+        """
+
+        updated_violations, data_version = fetch_updated_violations(self.app_token, self.data_version)
+
+        with self._lock:
+            for violation in updated_violations:
+                pin = violation.pin
+                if not pin:
+                    continue
+
+                # Replace the pin's list rather than changing it in place, so
+                # requests being served keep a consistent view
+                violations = [v for v in self.violations.get(pin, []) if v.id_ != violation.id_]
+                violations.append(violation)
+                self.violations[pin] = violations
+                self.address_index.add(violation.address, pin)
+                self._invalidate(pin)
+
+            self.data_version = data_version
+
+        # Dangerous buildings aren't part of the cached scores; each pin's
+        # list is replaced rather than changed in place
+        self._reload_dangerous_buildings()
+        self.loaded_at = datetime.now()
+
+        return len(updated_violations)
+
+    def get_score(self, pin, start_date, end_date):
+        # A score for an ongoing period changes every day
+        key = (pin, start_date, end_date or date.today())
+        stats = self._score_cache.get(key)
+        if stats is None:
+            with self._lock:
+                generation = self._generations.get(pin, 0)
+
+            violations_per_property = {
+                pin: {
+                    'start_date': start_date,
+                    'end_date': end_date,
+                    'violations': filter_relevant_violations(self.violations.get(pin, []), start_date, end_date),
+                },
+            }
+            stats = calculate_violation_stats(violations_per_property, self.legal_brief_violation_codes)[pin]
+            with self._lock:
+                # Don't cache a score if the pin changed while it was being
+                # calculated
+                if self._generations.get(pin, 0) == generation:
+                    self._score_cache[key] = stats
+
+        return stats
+
+    def get_property(self, pin, start_date, end_date):
+        stats = self.get_score(pin, start_date, end_date)
+        tract = self.property_tracts.get(pin)
+
+        return {
+            'kiva_pin': pin,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d') if end_date else None,
+            'violation_count': stats['violation_count'],
+            'score': stats['score'],
+            'avg_duration': stats['avg_duration'],
+            'dangerous_buildings': self.dangerous_buildings.get(pin, []),
+            'tract': tract,
+            'tract_demographics': self.tract_demographics.get(tract),
+        }
+
+    def get_violations(self, pin):
+        return [violation.json_data for violation in self.violations.get(pin, [])]
+
+    def find_address(self, address):
+        match = self.address_index.find(address)
+        normalized = match[0] if match else normalize_address(address)
+
+        return {
+            'address': address,
+            'matched_address': match[0] if match else None,
+            'kiva_pins': sorted(match[1]) if match else [],
+            'similarity': match[2] if match else None,
+            'service_requests': self.service_requests.get(normalized, []),
+        }
+
+    def get_status(self):
+        return {
+            'data_version': self.data_version,
+            'dangerous_buildings_version': self.dangerous_buildings_version,
+            'loaded_at': self.loaded_at.strftime('%Y-%m-%dT%H:%M:%S') if self.loaded_at else None,
+            'properties': len(self.violations),
+            'dangerous_buildings': len(self.dangerous_buildings),
+            'service_request_addresses': len(self.service_requests),
+            'addresses': len(self.address_index),
+            'cached_scores': len(self._score_cache),
+        }
+
+class PropertyService:
+    """A local HTTP/JSON service answering property lookups from a warm
+    PropertyStore:
+
+        GET /status
+        GET /properties/<pin>?start_date=YYYY-MM-DD[&end_date=YYYY-MM-DD]
+        GET /properties/<pin>/violations
+        GET /addresses?address=...
+
+    A background thread reloads the store every `reload_interval` seconds.
+    """
+
+    def __init__(self, store, host='127.0.0.1', port=0, reload_interval=RELOAD_INTERVAL):
+        self.store = store
+        self.reload_interval = reload_interval
+
+        self._stopped = threading.Event()
+        self._reload_thread = None
+
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        """Starts serving (and reloading) in background threads."""
+
+        self._start_reloading()
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+        return self.url
+
+    def serve_forever(self):
+        self._start_reloading()
+        self.httpd.serve_forever()
+
+    def _start_reloading(self):
+        if self.reload_interval:
+            self._reload_thread = threading.Thread(target=self._reload_forever, daemon=True)
+            self._reload_thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        self.stop()
+
+    def _reload_forever(self):
+        while not self._stopped.wait(self.reload_interval):
+            try:
+                n_updated = self.store.reload()
+                print('Reloaded: %d updated violations (data version %s)' % (n_updated, self.store.data_version))
+            except Exception as e:
+                # Keep serving the data we have; the next reload tries again
+                print('Reload failed: %s' % e)
+
+    def handle(self, path, params):
+        """Returns the JSON response for a request. Raises a
+        PropertyServiceException for bad requests, or a KeyError for unknown
+        paths.
+        """
+
+        if path == '/status':
+            return self.store.get_status()
+
+        if path == '/addresses':
+            if not params.get('address'):
+                raise PropertyServiceException('An address is required')
+            return self.store.find_address(params['address'])
+
+        match = re.match(r'^/properties/(\d+)(/violations)?$', path)
+        if not match:
+            raise KeyError(path)
+
+        pin = int(match.group(1))
+        if match.group(2):
+            return self.store.get_violations(pin)
+
+        try:
+            start_date = parse_property_date(params['start_date'])
+            end_date = parse_property_date(params['end_date']) if params.get('end_date') else None
+        except (KeyError, ValueError, OverflowError):
+            raise PropertyServiceException('A valid start_date is required')
+
+        # Scores are averaged over the days of the period; an ongoing period
+        # ends now
+        if ((end_date or datetime.now()) - start_date).days < 1:
+            raise PropertyServiceException('The period must be at least one day long')
+
+        return self.store.get_property(pin, start_date, end_date)
+
+def _make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+            try:
+                self.send_json(200, service.handle(url.path, params))
+            except PropertyServiceException as e:
+                self.send_json(400, {'message': str(e)})
+            except KeyError:
+                self.send_json(404, {'message': 'Not found'})
+            except Exception as e:
+                print('Request for %s failed: %r' % (self.path, e))
+                self.send_json(500, {'message': 'Internal server error'})
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json;charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve property scores and data from memory.')
+    parser.add_argument('app_token', help='KCMO Open Data app token')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--reload-interval', type=int, default=RELOAD_INTERVAL,
+                        help='seconds between background reloads (0 to disable)')
+    parser.add_argument('--service-requests', metavar='FILE',
+                        help='311 requests, from a JSON lines file written by local_dataset.py')
+    parser.add_argument('--property-tracts', metavar='FILE',
+                        help="CSV file with 'KIVA PIN' and 'Tract' columns")
+    parser.add_argument('--tract-demographics', metavar='FILE',
+                        help='output of census_tract_race_population_summary.py')
+    args = parser.parse_args()
+
+    started = time.time()
+    store = PropertyStore(args.app_token, read_legal_brief_violations('../docs/scoring.md'))
+    store.load(
+        service_requests_filename=args.service_requests,
+        property_tracts_filename=args.property_tracts,
+        tract_demographics_filename=args.tract_demographics,
+    )
+    print('Loaded %d properties in %.1f seconds' % (len(store.violations), time.time() - started))
+
+    service = PropertyService(store, port=args.port, reload_interval=args.reload_interval)
+    print('Serving on ' + service.url)
+    service.serve_forever()
@@ -0,0 +1,204 @@
+from bulk_download import download_dataset
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataset_snapshot import DatasetSnapshot, NULL_INT, SCHEMAS, write_snapshot
+from dateutil.parser import parse
+from fetch_journal import FetchJournal
+import heapq
+from local_dataset import read_dataset, write_dataset
+import os
+from property_violations import LazyPropertyViolation, PropertyViolation
+import sys
+import time
+from violations_per_property import (
+    calculate_violation_stats,
+    filter_relevant_violations,
+    read_legal_brief_violations,
+    write_violation_stats,
+)
+
+DATASET_FILENAME = 'data/violations.jsonl'
+SNAPSHOT_FILENAME = 'data/violations.snapshot'
+OUTPUT_FILENAME = 'results/city_violation_stats.csv'
+
+# Each worker gets several partitions so that one unusually large partition
+# doesn't leave the other processes idle at the end of the run.
+PARTITIONS_PER_WORKER = 4
+
+def score_partition(partition, start_date, end_date, legal_brief_violation_codes):
+    """Scores every (pin, raw records) pair in a partition over the given
+    period using the same algorithm as `calculate_violation_stats`.
+    """
+
+    violations_per_property = {}
+    for pin, records in partition:
+        violations = [LazyPropertyViolation.from_json(rec) for rec in records]
+        violations_per_property[pin] = {
+            'start_date': start_date,
+            'end_date': end_date,
+            'violations': filter_relevant_violations(violations, start_date, end_date),
+        }
+
+    return calculate_violation_stats(violations_per_property, set(legal_brief_violation_codes))
+
+def partition_snapshot(snapshot, n_partitions):
+    """Splits the pins of a snapshot sorted by pin into `n_partitions` lists
+    of (pin, start row, end row) with roughly the same number of violation
+    records in each. Scoring cost grows with the number of violations, so
+    this balances the work rather than the pin count. Only row ranges are
+    handed to the workers, never the records themselves.
+    """
+
+    partitions = [[] for _ in range(n_partitions)]
+    partition_sizes = [(0, idx) for idx in range(n_partitions)]
+
+    groups = [(pin, start, end) for pin, start, end in snapshot.iter_groups() if pin != NULL_INT]
+    groups.sort(key=lambda group: group[2] - group[1], reverse=True)
+    for pin, start, end in groups:
+        size, idx = heapq.heappop(partition_sizes)
+        partitions[idx].append((pin, start, end))
+        heapq.heappush(partition_sizes, (size + end - start, idx))
+
+    return [partition for partition in partitions if partition]
+
+# The snapshot each worker process has opened, keyed by filename. Opening it
+# once per process is enough: every partition reads from the same mapping.
+_snapshots = {}
+
+def _get_snapshot(filename):
+    snapshot = _snapshots.get(filename)
+    if snapshot is None:
+        snapshot = _snapshots[filename] = DatasetSnapshot(filename)
+
+    return snapshot
+
+def score_snapshot_partition(snapshot_filename, partition, start_date, end_date, legal_brief_violation_codes):
+    """Worker entry point for `score_snapshot`: reads each pin's rows from the
+    memory-mapped snapshot and scores them like `score_partition`.
+    """
+
+    snapshot = _get_snapshot(snapshot_filename)
+
+    return score_partition(
+        [(pin, snapshot.iter_records(start, end)) for pin, start, end in partition],
+        start_date,
+        end_date,
+        legal_brief_violation_codes,
+    )
+
+def score_snapshot(snapshot_filename, start_date, end_date, legal_brief_violation_codes, workers=None):
+    """Calculates violation stats for every KIVA pin in a violations snapshot
+    sorted by pin (see dataset_snapshot.py). The workers map the snapshot file
+    instead of receiving pickled records, so they all share one copy of the
+    dataset. Returns the merged stats keyed by pin.
+    """
+
+    workers = workers or os.cpu_count() or 1
+    with DatasetSnapshot(snapshot_filename) as snapshot:
+        partitions = partition_snapshot(snapshot, workers * PARTITIONS_PER_WORKER)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                score_snapshot_partition,
+                snapshot_filename,
+                partition,
+                start_date,
+                end_date,
+                legal_brief_violation_codes,
+            )
+            for partition in partitions
+        ]
+
+        for future in as_completed(futures):
+            results.update(future.result())
+
+    return results
+
+def load_violations_dataset(app_token, filename, require_version=False):
+    """Returns the locally stored violations dataset, downloading it first if
+    it hasn't been stored yet. The dataset's data version at the start of the
+    download is saved next to it (see `read_dataset_version`).
+
+    With `require_version`, a dataset stored without its data version (by an
+    older version of this script) is downloaded again, since there is no
+    telling which records were updated after it was downloaded.
+    """
+
+    if require_version and os.path.exists(filename) and not os.path.exists(filename + '.version'):
+        print('The violations dataset %s has no saved data version' % filename)
+        os.remove(filename)
+
+    if not os.path.exists(filename):
+        print('Downloading the violations dataset to ' + filename)
+
+        # A version saved by an interrupted download is older, so it is kept
+        version_filename = filename + '.version'
+        if not os.path.exists(version_filename):
+            directory = os.path.dirname(version_filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(version_filename, 'w') as f:
+                f.write(PropertyViolation.fetch_data_version(app_token) or '')
+
+        # Id ranges fetched so far are kept in a journal next to the dataset,
+        # so an interrupted download picks up where it left off
+        journal = FetchJournal(filename + '.journal')
+        write_dataset(filename, download_dataset(PropertyViolation, app_token, journal=journal))
+        journal.remove()
+
+    return read_dataset(filename)
+
+def read_dataset_version(filename):
+    """Returns the data version (`:updated_at`) the locally stored violations
+    dataset was downloaded at, so records updated since can be applied to it,
+    or None if the dataset was empty or no version was saved.
+    """
+
+    version_filename = filename + '.version'
+    if not os.path.exists(version_filename):
+        return None
+
+    with open(version_filename, 'r') as f:
+        return f.read().strip() or None
+
+def load_violations_snapshot(app_token, dataset_filename, snapshot_filename):
+    """Returns the filename of the violations snapshot, (re)building it from
+    the locally stored dataset if it is missing or out of date.
+    """
+
+    if not os.path.exists(dataset_filename) or not os.path.exists(snapshot_filename) \
+            or os.path.getmtime(snapshot_filename) < os.path.getmtime(dataset_filename):
+        records = load_violations_dataset(app_token, dataset_filename)
+        print('Building the violations snapshot ' + snapshot_filename)
+        write_snapshot(snapshot_filename, records, SCHEMAS['ha6k-d6qu'], sort_by='pin')
+
+    return snapshot_filename
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: score_all.py [app token] [start date] [end date (optional)]')
+        sys.exit()
+
+    app_token = sys.argv[1]
+    start_date = parse(sys.argv[2])
+    end_date = parse(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    legal_brief_violation_codes = read_legal_brief_violations('../docs/scoring.md')
+    snapshot_filename = load_violations_snapshot(app_token, DATASET_FILENAME, SNAPSHOT_FILENAME)
+
+    started = time.time()
+    violation_stats = score_snapshot(
+        snapshot_filename,
+        start_date,
+        end_date,
+        legal_brief_violation_codes,
+    )
+    elapsed = time.time() - started
+
+    write_violation_stats(dict(sorted(violation_stats.items())), OUTPUT_FILENAME)
+    print('Scored %d properties in %.1f seconds (%.1f properties/sec)' % (
+        len(violation_stats),
+        elapsed,
+        len(violation_stats) / elapsed if elapsed else 0.0,
+    ))
@@ -0,0 +1,193 @@
+import csv
+from datetime import date, datetime
+from itertools import accumulate
+import sys
+from violations_per_property import (
+    get_violation_last_scored_day,
+    get_violation_weight,
+    get_violations_per_property,
+    read_legal_brief_violations,
+    read_properties,
+)
+
+class ScoreTimeline:
+    """The daily score of a single property over its scoring period.
+
+    The daily scores are the same ones `calculate_violation_stats` averages
+    over the whole period. They are stored as a prefix-sum array, so the
+    average score over any window is answered in O(1), and with a sparse table
+    of maximums, so the peak score over any window is answered in O(1) as well.
+
+    Windows are given as dates and include the start date but not the end
+    date, the same way the whole period is measured. Dates outside the period
+    are clamped to it.
+    """
+
+    def __init__(self, start_date, daily_scores):
+        self.start_date = start_date
+        self.daily_scores = list(daily_scores)
+        self.prefix_sums = [0] + list(accumulate(self.daily_scores))
+
+        # max_tables[k][i] is the peak score of the 2^k days starting at day i
+        self.max_tables = [self.daily_scores]
+        width = 1
+        while width * 2 <= len(self.daily_scores):
+            previous = self.max_tables[-1]
+            self.max_tables.append([
+                max(previous[i], previous[i + width])
+                for i in range(len(previous) - width)
+            ])
+            width *= 2
+
+    @staticmethod
+    def from_violations(start_date, end_date, violations, legal_brief_violation_codes):
+        """Builds the timeline for a property without testing every violation
+        on every day: each violation adds its weight to a contiguous range of
+        days, so it is recorded as two entries in a difference array.
+        """
+
+        end_date = end_date or datetime.now()
+        days = max(0, (end_date - start_date).days)
+
+        differences = [0] * (days + 1)
+        for violation in violations:
+            last_day = get_violation_last_scored_day(violation, start_date)
+            if last_day is None or last_day < 0:
+                continue
+
+            weight = get_violation_weight(violation, legal_brief_violation_codes)
+            differences[0] += weight
+            differences[min(last_day + 1, days)] -= weight
+
+        return ScoreTimeline(start_date, accumulate(differences[:days]))
+
+    @property
+    def days(self):
+        return len(self.daily_scores)
+
+    def get_day_index(self, day):
+        """Converts a date to an index into the daily scores, clamped to the
+        scoring period.
+        """
+
+        if day is None:
+            return self.days
+
+        if not isinstance(day, datetime):
+            day = datetime.combine(day, datetime.min.time())
+
+        index = (day - self.start_date).days
+        return max(0, min(index, self.days))
+
+    def _get_window(self, start=None, end=None):
+        start_idx = self.get_day_index(start) if start is not None else 0
+        end_idx = self.get_day_index(end)
+
+        return start_idx, max(start_idx, end_idx)
+
+    def get_total_score(self, start=None, end=None):
+        start_idx, end_idx = self._get_window(start, end)
+        return self.prefix_sums[end_idx] - self.prefix_sums[start_idx]
+
+    def get_average_score(self, start=None, end=None):
+        """Returns the average daily score between `start` and `end`. Over the
+        whole period this is the property score from `calculate_violation_stats`.
+        """
+
+        start_idx, end_idx = self._get_window(start, end)
+        if start_idx == end_idx:
+            return 0.0
+
+        return (self.prefix_sums[end_idx] - self.prefix_sums[start_idx]) / (end_idx - start_idx)
+
+    def get_peak_score(self, start=None, end=None):
+        """Returns the highest daily score between `start` and `end`."""
+
+        start_idx, end_idx = self._get_window(start, end)
+        if start_idx == end_idx:
+            return 0
+
+        # Two (possibly overlapping) power-of-two ranges cover the window
+        level = (end_idx - start_idx).bit_length() - 1
+        table = self.max_tables[level]
+
+        return max(table[start_idx], table[end_idx - (1 << level)])
+
+    def get_monthly_series(self):
+        """Returns (month, average score, peak score) for each calendar month
+        in the scoring period. The first and last months may be partial.
+        """
+
+        series = []
+        month = date(self.start_date.year, self.start_date.month, 1)
+        end_date = self.start_date.date().toordinal() + self.days
+
+        while month.toordinal() < end_date:
+            if month.month == 12:
+                next_month = date(month.year + 1, 1, 1)
+            else:
+                next_month = date(month.year, month.month + 1, 1)
+
+            series.append((
+                month,
+                self.get_average_score(month, next_month),
+                self.get_peak_score(month, next_month),
+            ))
+            month = next_month
+
+        return series
+
+def build_score_timelines(violations_per_property, legal_brief_violation_codes):
+    """Builds a ScoreTimeline for each property in the output of
+    `get_violations_per_property`.
+    """
+
+    return {
+        kiva_pin: ScoreTimeline.from_violations(
+            property_data['start_date'],
+            property_data['end_date'],
+            property_data['violations'],
+            legal_brief_violation_codes,
+        )
+        for kiva_pin, property_data in violations_per_property.items()
+    }
+
+def write_monthly_scores(timelines, filename):
+    file_output = []
+    file_output.append([
+        'KIVA PIN',
+        'Month',
+        'Average Score',
+        'Peak Score',
+    ])
+
+    for kiva_pin, timeline in timelines.items():
+        for month, average_score, peak_score in timeline.get_monthly_series():
+            file_output.append([
+                kiva_pin,
+                month.strftime('%Y-%m'),
+                average_score,
+                peak_score,
+            ])
+
+    with open(filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerows(file_output)
+
+    print('Output monthly scores to ' + filename)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        print('Provide your app token as an argument when running this script.')
+        sys.exit()
+
+    app_token = sys.argv[1]
+    if not app_token:
+        print('Provide your app token as an argument when running this script.')
+        sys.exit()
+
+    properties = read_properties('example/reo_properties.csv')
+    legal_brief_violation_codes = read_legal_brief_violations('../docs/scoring.md')
+    violations = get_violations_per_property(app_token, properties)
+    timelines = build_score_timelines(violations, legal_brief_violation_codes)
+    write_monthly_scores(timelines, 'example/results/monthly_scores.csv')
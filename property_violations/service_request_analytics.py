@@ -0,0 +1,289 @@
+from bulk_download import download_dataset
+import csv
+from dataset_snapshot import DatasetSnapshot, NULL_INT, SCHEMAS, write_snapshot
+from datetime import date, datetime, timedelta
+from local_dataset import read_dataset, write_dataset
+import numpy as np
+import os
+from service_request_calls import ServiceRequestCall
+import sys
+
+DATASET_FILENAME = 'data/311.jsonl'
+SNAPSHOT_FILENAME = 'data/311.snapshot'
+
+GROUP_COLUMNS = ['neighborhood', 'council_district', 'category', 'department', 'zip_code']
+
+# Lower bounds of the days-open buckets: 0-30, 31-60, 61-90 and 90+ days
+DAYS_OPEN_BUCKETS = [
+    ServiceRequestCall.DAYS_OPEN_0_TO_30,
+    ServiceRequestCall.DAYS_OPEN_31_TO_60,
+    ServiceRequestCall.DAYS_OPEN_61_TO_90,
+    ServiceRequestCall.DAYS_OPEN_90_PLUS,
+]
+DAYS_OPEN_BUCKET_LABELS = ['0-30', '31-60', '61-90', '90+']
+
+_EPOCH = date(1970, 1, 1)
+_SECONDS_PER_DAY = 86400
+
+# Day number used for requests that are still open
+_STILL_OPEN = np.iinfo(np.int64).max
+
+def to_day(value):
+    """Converts a date or datetime to a day number (days since 1970-01-01)."""
+
+    if isinstance(value, datetime):
+        value = value.date()
+
+    return (value - _EPOCH).days
+
+def from_day(day):
+    return _EPOCH + timedelta(days=int(day))
+
+class ServiceRequestTable:
+    """311 service requests as NumPy arrays, for aggregating millions of
+    requests at once instead of looping over record objects.
+
+    Each request is a position in the arrays: its creation day, closed day
+    (`_STILL_OPEN` for open requests) and whether it exceeded the estimated
+    timeframe. Requests without a creation date are left out.
+
+    Grouping columns are kept as integer codes (indexes into the snapshot's
+    string dictionary, or the column's own integer values), so grouping is a
+    single `np.unique` over an integer array.
+    """
+
+    def __init__(self, created, closed, exceeded, columns=None):
+        self.created = created
+        self.closed = closed
+        self.exceeded = exceeded
+
+        # Column name -> (integer codes, function converting a code to a label)
+        self.columns = columns or {}
+
+    def __len__(self):
+        return len(self.created)
+
+    @property
+    def is_open(self):
+        return self.closed == _STILL_OPEN
+
+    @staticmethod
+    def from_snapshot(snapshot):
+        """Builds a table from a 311 DatasetSnapshot. The arrays are computed
+        from zero-copy views of the snapshot's columns.
+        """
+
+        created_seconds = np.frombuffer(snapshot.column('creation_date'), dtype=np.int64)
+        closed_seconds = np.frombuffer(snapshot.column('closed_date'), dtype=np.int64)
+        keep = created_seconds != NULL_INT
+
+        created = created_seconds[keep] // _SECONDS_PER_DAY
+        closed = np.where(
+            closed_seconds[keep] == NULL_INT,
+            _STILL_OPEN,
+            closed_seconds[keep] // _SECONDS_PER_DAY,
+        )
+
+        # Only a handful of distinct strings, so look up which of them is 'Y'
+        exceeded_codes = np.frombuffer(snapshot.column('exceeded_est_timeframe'), dtype=np.int64)[keep]
+        yes_codes = [code for code in np.unique(exceeded_codes) if snapshot.get_string(code) == 'Y']
+        exceeded = np.isin(exceeded_codes, yes_codes)
+
+        columns = {}
+        for name in snapshot.column_names:
+            column_type = snapshot.column_types[name]
+            if column_type == 'str':
+                columns[name] = (
+                    np.frombuffer(snapshot.column(name), dtype=np.int64)[keep],
+                    snapshot.get_string,
+                )
+            elif column_type == 'int':
+                columns[name] = (
+                    np.frombuffer(snapshot.column(name), dtype=np.int64)[keep],
+                    lambda code: None if code == NULL_INT else int(code),
+                )
+
+        return ServiceRequestTable(created, closed, exceeded, columns)
+
+    @staticmethod
+    def from_records(records, group_columns=GROUP_COLUMNS):
+        """Builds a table from ServiceRequestCall objects (eager or lazy)."""
+
+        records = [record for record in records if record.creation_date_time is not None]
+
+        created = np.array([to_day(record.creation_date_time) for record in records], dtype=np.int64)
+        closed = np.array([
+            _STILL_OPEN if record.closed_date is None else to_day(record.closed_date)
+            for record in records
+        ], dtype=np.int64)
+        exceeded = np.array([record.exceeded_est_timeframe for record in records], dtype=bool)
+
+        columns = {}
+        for name in group_columns:
+            labels = {}
+            codes = np.array(
+                [labels.setdefault(getattr(record, name), len(labels)) for record in records],
+                dtype=np.int64,
+            )
+            label_list = list(labels)
+            columns[name] = (codes, label_list.__getitem__)
+
+        return ServiceRequestTable(created, closed, exceeded, columns)
+
+    def get_groups(self, by):
+        """Returns (group index per request, group labels). `by` is a column
+        name, or an array with one key per request (for groupings that aren't
+        in the dataset, such as census tracts).
+        """
+
+        if isinstance(by, str):
+            codes, get_label = self.columns[by]
+            unique_codes, group_idx = np.unique(codes, return_inverse=True)
+            return group_idx, [get_label(code) for code in unique_codes]
+
+        labels, group_idx = np.unique(np.asarray(by), return_inverse=True)
+        return group_idx, list(labels)
+
+    def get_days_open(self, as_of=None):
+        """Days each request was (or has been, as of `as_of`) open."""
+
+        as_of_day = to_day(as_of or datetime.now())
+        end = np.where(self.is_open, as_of_day, self.closed)
+
+        return np.maximum(end - self.created, 0)
+
+    def get_days_open_histogram(self, by, as_of=None):
+        """Returns (labels, counts): the number of requests in each days-open
+        bucket, as a (groups x buckets) array.
+        """
+
+        group_idx, labels = self.get_groups(by)
+        buckets = np.searchsorted(DAYS_OPEN_BUCKETS[1:], self.get_days_open(as_of), side='left')
+
+        n_buckets = len(DAYS_OPEN_BUCKETS)
+        counts = np.bincount(
+            group_idx * n_buckets + buckets,
+            minlength=len(labels) * n_buckets,
+        ).reshape(len(labels), n_buckets)
+
+        return labels, counts
+
+    def get_exceeded_timeframe_rates(self, by):
+        """Returns (labels, requests, exceeded, rates), with the number of
+        requests, the number that exceeded their estimated timeframe and the
+        share that did, per group.
+        """
+
+        group_idx, labels = self.get_groups(by)
+        requests = np.bincount(group_idx, minlength=len(labels))
+        exceeded = np.bincount(group_idx, weights=self.exceeded, minlength=len(labels)).astype(np.int64)
+
+        rates = exceeded / np.maximum(requests, 1)
+
+        return labels, requests, exceeded, rates
+
+    def get_backlog(self, by, start_date, end_date):
+        """Returns (labels, days, backlog), where backlog[g, d] is the number
+        of group g's requests that were open on days[d]. A request is open
+        from its creation day up to (but not including) its closed day.
+        """
+
+        group_idx, labels = self.get_groups(by)
+        start = to_day(start_date)
+        n_days = to_day(end_date) - start + 1
+
+        # Difference array: +1 on the day a request opens (or the start of the
+        # window), -1 on the day it closes, then a running sum per group
+        opened = np.clip(self.created - start, 0, None)
+        in_window = (opened < n_days) & (self.closed > self.created) & (self.closed - start > 0)
+        closed = self.closed - start
+
+        size = len(labels) * (n_days + 1)
+        closes = in_window & (closed <= n_days)
+        diff = np.bincount(
+            group_idx[in_window] * (n_days + 1) + opened[in_window],
+            minlength=size,
+        ) - np.bincount(
+            group_idx[closes] * (n_days + 1) + closed[closes],
+            minlength=size,
+        )
+        diff = diff.reshape(len(labels), n_days + 1)
+
+        backlog = np.cumsum(diff[:, :n_days], axis=1)
+        days = [from_day(start + offset) for offset in range(n_days)]
+
+        return labels, days, backlog
+
+def write_days_open_report(table, by, filename, as_of=None):
+    labels, counts = table.get_days_open_histogram(by, as_of)
+    _, requests, exceeded, rates = table.get_exceeded_timeframe_rates(by)
+
+    with open(filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow([by.replace('_', ' ').title()] + DAYS_OPEN_BUCKET_LABELS + [
+            'Requests',
+            'Exceeded Est. Timeframe',
+            'Exceeded Rate',
+        ])
+
+        for idx, label in enumerate(labels):
+            writer.writerow([label] + list(counts[idx]) + [
+                requests[idx],
+                exceeded[idx],
+                '%.4f' % rates[idx],
+            ])
+
+    print('Output days open report to ' + filename)
+
+def write_backlog_report(table, by, filename, start_date, end_date):
+    """Writes each group's open backlog on the first day of every month."""
+
+    labels, days, backlog = table.get_backlog(by, start_date, end_date)
+    month_starts = [idx for idx, day in enumerate(days) if day.day == 1]
+
+    with open(filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow([by.replace('_', ' ').title(), 'Date', 'Open Requests'])
+
+        for group, label in enumerate(labels):
+            for idx in month_starts:
+                writer.writerow([label, days[idx].strftime('%Y-%m-%d'), backlog[group, idx]])
+
+    print('Output backlog report to ' + filename)
+
+def load_service_requests_snapshot(app_token, dataset_filename, snapshot_filename):
+    """Returns the filename of the 311 snapshot, downloading the dataset and
+    building the snapshot first if needed.
+    """
+
+    if not os.path.exists(dataset_filename):
+        print('Downloading the 311 dataset to ' + dataset_filename)
+        write_dataset(dataset_filename, download_dataset(ServiceRequestCall, app_token))
+
+    if not os.path.exists(snapshot_filename) \
+            or os.path.getmtime(snapshot_filename) < os.path.getmtime(dataset_filename):
+        print('Building the 311 snapshot ' + snapshot_filename)
+        write_snapshot(snapshot_filename, read_dataset(dataset_filename), SCHEMAS[ServiceRequestCall.API_RESOURCE_ID])
+
+    return snapshot_filename
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: service_request_analytics.py [app token] [group by (optional): %s]' % '|'.join(GROUP_COLUMNS))
+        sys.exit()
+
+    app_token = sys.argv[1]
+    group_by = sys.argv[2] if len(sys.argv) > 2 else 'neighborhood'
+    if group_by not in GROUP_COLUMNS:
+        print('Usage: service_request_analytics.py [app token] [group by (optional): %s]' % '|'.join(GROUP_COLUMNS))
+        sys.exit()
+
+    snapshot_filename = load_service_requests_snapshot(app_token, DATASET_FILENAME, SNAPSHOT_FILENAME)
+    with DatasetSnapshot(snapshot_filename) as snapshot:
+        table = ServiceRequestTable.from_snapshot(snapshot)
+
+        start_date = from_day(table.created.min())
+        end_date = datetime.now().date()
+
+        write_days_open_report(table, group_by, 'results/311_days_open_by_%s.csv' % group_by)
+        write_backlog_report(table, group_by, 'results/311_backlog_by_%s.csv' % group_by, start_date, end_date)
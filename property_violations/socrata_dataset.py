@@ -0,0 +1,505 @@
+import atexit
+import codecs
+import json
+from lazy_record import LazyField, LazyRecord
+import re
+import requests
+from sodapy import Socrata
+import time
+
+class Coordinates:
+    """A pair of latitude/longitude coordinates."""
+
+    def __init__(self, lat, lon):
+        self.lat = lat
+        self.lon = lon
+
+    def __str__(self):
+        return 'Coordintes: (%s, %s)' % (str(self.lat), str(self.lon))
+
+class Field:
+    """A field in a dataset record's schema.
+
+    `source` is the name of the column in the KCMO Open Data API response, or
+    a tuple of column names for fields built from several columns. Without a
+    `convert` function the raw value is used as is, or `default` if the column
+    is missing. With one, it is called with the raw value of each source
+    column (None for missing columns).
+    """
+
+    def __init__(self, name, source, convert=None, default=None):
+        self.name = name
+        self.source = source
+        self.convert = convert
+        self.default = default
+
+    @property
+    def columns(self):
+        return self.source if isinstance(self.source, tuple) else (self.source,)
+
+    def get_value(self, json_data):
+        if self.convert is None:
+            return json_data.get(self.source, self.default)
+
+        return self.convert(*[json_data.get(column) for column in self.columns])
+
+class SocrataDatasetException(Exception):
+    """An exception that may be raised while fetching records from the KCMO Open
+    Data API.
+    """
+    pass
+
+class SocrataDataset:
+    """Base class for records from a Socrata dataset on the KCMO Open Data API.
+
+    Subclasses declare their `API_RESOURCE_ID` and a `FIELDS` schema, which is
+    used to build records from the API's JSON data. Everything else (the
+    shared client, pagination, column projection, retries and parsing) lives
+    here, so all datasets are fetched the same way.
+
+    A subclass that also inherits from LazyRecord gets a LazyField for every
+    field in the schema, and is used by `fetch(..., lazy=True)`.
+    """
+
+    API_DATASET_NAME = 'data.kcmo.org'
+    API_RESOURCE_ID = None
+
+    FIELDS = []
+
+    # The column used by `fetch_by_address` / `fetch_by_pin`
+    ADDRESS_COLUMN = 'address'
+    UPPERCASE_ADDRESSES = True
+    PIN_COLUMN = None
+
+    # A numeric column that uniquely identifies records, used to split the
+    # dataset into ranges for bulk downloads (see bulk_download.py)
+    ID_COLUMN = None
+
+    # Socrata allows up to 50000 rows per request
+    PAGE_SIZE = 50000
+
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 1.0
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    # Bytes of (decompressed) response read at a time by `query_stream`
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    # Socrata clients (and their HTTP connection pools) shared by every
+    # dataset, keyed by (domain, app token)
+    _clients = {}
+
+    _lazy_class = None
+
+    def __init__(self, *args, **kwargs):
+        for field, value in zip(self.FIELDS, args):
+            kwargs[field.name] = value
+
+        for field in self.FIELDS:
+            setattr(self, field.name, kwargs.pop(field.name, field.default))
+
+        if kwargs:
+            raise TypeError('Unexpected fields for %s: %s' % (
+                type(self).__name__,
+                ', '.join(sorted(kwargs)),
+            ))
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        if issubclass(cls, LazyRecord):
+            for field in cls.FIELDS:
+                lazy_field = LazyField(field.get_value)
+                lazy_field.__set_name__(cls, field.name)
+                setattr(cls, field.name, lazy_field)
+
+            for base in cls.__bases__:
+                if issubclass(base, SocrataDataset) and not issubclass(base, LazyRecord):
+                    base._lazy_class = cls
+
+    @classmethod
+    def from_json(cls, json_data):
+        """Convert JSON data (obtained from the KCMO Open Data API) to a record
+        object.
+        """
+
+        record = cls.__new__(cls)
+        for field in cls.FIELDS:
+            setattr(record, field.name, field.get_value(json_data))
+
+        return record
+
+    @classmethod
+    def get_columns(cls, field_names=None):
+        """Returns the API columns needed for the given fields (all fields by
+        default), for use as a `$select` projection.
+        """
+
+        columns = []
+        for field in cls.FIELDS:
+            if field_names is not None and field.name not in field_names:
+                continue
+
+            for column in field.columns:
+                if column not in columns:
+                    columns.append(column)
+
+        return columns
+
+    @staticmethod
+    def get_client(domain, app_token):
+        """Returns the long-lived Socrata client for a domain, creating it on
+        first use. Reusing one client keeps its HTTP connections alive across
+        requests. Domains starting with 'http://' are requested over plain HTTP.
+        """
+
+        key = (domain, app_token)
+        client = SocrataDataset._clients.get(key)
+        if client is None:
+            if domain.startswith('http://'):
+                # A plain HTTP domain, such as a local stand-in server from
+                # soql_server.py
+                client = Socrata(domain[len('http://'):], app_token, session_adapter={
+                    'prefix': 'http://',
+                    'adapter': requests.adapters.HTTPAdapter(),
+                })
+            else:
+                client = Socrata(domain, app_token)
+            SocrataDataset._clients[key] = client
+
+        return client
+
+    @staticmethod
+    def close_clients():
+        for client in SocrataDataset._clients.values():
+            client.close()
+
+        SocrataDataset._clients.clear()
+
+    @classmethod
+    def query(cls, app_token, **params):
+        """Performs a single request against this dataset and returns the raw
+        JSON records. Throttled requests, server errors and connection problems
+        are retried with an exponential backoff.
+        """
+
+        client = cls.get_client(cls.API_DATASET_NAME, app_token)
+
+        for attempt in range(cls.MAX_RETRIES + 1):
+            try:
+                # Raises a requests.exceptions.HTTPError if bad criteria is given
+                return client.get(cls.API_RESOURCE_ID, **params)
+            except requests.exceptions.HTTPError as e:
+                status_code = e.response.status_code if e.response is not None else None
+                if status_code not in cls.RETRY_STATUS_CODES or attempt == cls.MAX_RETRIES:
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == cls.MAX_RETRIES:
+                    raise
+
+            time.sleep(cls.RETRY_BACKOFF * 2 ** attempt)
+
+    @classmethod
+    def query_stream(cls, app_token, **params):
+        """Like `query`, but yields the raw JSON records one at a time as the
+        (gzip compressed) response is downloaded, so the whole response is
+        never held in memory and records can be processed while the rest is
+        still arriving.
+
+        Failed requests are retried as in `query`. If the connection drops
+        partway through the response, the request is repeated and the records
+        that were already yielded are skipped, so `params` should include an
+        order.
+        """
+
+        client = cls.get_client(cls.API_DATASET_NAME, app_token)
+        url = '%s%s/resource/%s.json' % (client.uri_prefix, client.domain, cls.API_RESOURCE_ID)
+        soql_params = dict(
+            ('$' + name if name in SOQL_PARAMETERS else name, value)
+            for name, value in params.items()
+            if value is not None
+        )
+
+        n_yielded = 0
+        for attempt in range(cls.MAX_RETRIES + 1):
+            try:
+                with client.session.get(url, params=soql_params, headers={'Accept-Encoding': 'gzip'},
+                                        stream=True, timeout=client.timeout) as response:
+                    response.raise_for_status()
+
+                    chunks = response.iter_content(cls.STREAM_CHUNK_SIZE)
+                    for idx, record in enumerate(iter_json_array(chunks)):
+                        if idx >= n_yielded:
+                            n_yielded += 1
+                            yield record
+
+                return
+            except requests.exceptions.HTTPError as e:
+                status_code = e.response.status_code if e.response is not None else None
+                if status_code not in cls.RETRY_STATUS_CODES or attempt == cls.MAX_RETRIES:
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                if attempt == cls.MAX_RETRIES:
+                    raise
+
+            time.sleep(cls.RETRY_BACKOFF * 2 ** attempt)
+
+    @classmethod
+    def query_all(cls, app_token, limit=None, page_size=None, order=':id', stream=False, **params):
+        """Yields raw JSON records, paging through the results until they run
+        out or `limit` records have been returned. The results are ordered
+        (by `:id` unless another order is given) so pages don't overlap.
+        With `stream`, each page is decoded as it is downloaded (see
+        `query_stream`), so memory use doesn't grow with the page size.
+        """
+
+        page_size = page_size or cls.PAGE_SIZE
+        offset = 0
+
+        while limit is None or offset < limit:
+            page_limit = page_size if limit is None else min(page_size, limit - offset)
+            records = (cls.query_stream if stream else cls.query)(
+                app_token,
+                order=order,
+                limit=page_limit,
+                offset=offset,
+                **params
+            )
+
+            n_records = 0
+            for record in records:
+                n_records += 1
+                yield record
+
+            if n_records < page_limit:
+                break
+
+            offset += page_limit
+
+    @classmethod
+    def fetch_data_version(cls, app_token):
+        """Returns the `:updated_at` timestamp of the most recently updated
+        record in this dataset. Comparing it against a stored version shows
+        whether (and which) records need to be fetched again.
+        """
+
+        rows = cls.query(app_token, select='max(:updated_at) as data_version')
+
+        return rows[0].get('data_version') if rows else None
+
+    @classmethod
+    def fetch_distinct(cls, app_token, columns, search_params=None):
+        """Returns the distinct combinations of values of the given columns,
+        as a list of dicts. The grouping is done by the server, so only one
+        row per combination is transferred.
+        """
+
+        params = {}
+        if search_params:
+            params['where'] = ' and '.join(search_params)
+
+        column_list = ', '.join(columns)
+
+        return list(cls.query_all(
+            app_token,
+            limit=None,
+            select=column_list,
+            group=column_list,
+            order=column_list,
+            **params
+        ))
+
+    @classmethod
+    def fetch(cls, app_token, search_params, limit=5000, lazy=False, fields=None, stream=False):
+        """Fetch a list of record objects from the KCMO Open Data API.
+        `search_params` is a list of search critera as allowed by the Socrata
+        SoQL query language (https://dev.socrata.com/docs/queries/). All given
+        parameters will be combined using 'AND' in the query.
+        By default, we limit the results to 5000 records but you can specify
+        a different limit with the `limit` parameter, or None for no limit.
+        If `lazy` is True, the dataset's lazy record class is used instead,
+        which only converts a field when it is first accessed.
+        `fields` can be a list of field names to request only the columns
+        those fields need; the other fields get their default values.
+        With `stream`, records are converted one at a time as the response is
+        downloaded, rather than after the whole response has been decoded.
+        """
+
+        record_class = cls._lazy_class if lazy and cls._lazy_class else cls
+
+        return [
+            record_class.from_json(rec)
+            for rec in cls.fetch_raw(app_token, search_params, limit=limit, fields=fields, stream=stream)
+        ]
+
+    @classmethod
+    def fetch_raw(cls, app_token, search_params, limit=5000, fields=None, stream=False):
+        """Like `fetch`, but yields the raw JSON records instead of record
+        objects, e.g. to store them locally before converting them.
+        """
+
+        params = {}
+        if search_params:
+            params['where'] = ' and '.join(search_params)
+        if fields is not None:
+            params['select'] = ', '.join(cls.get_columns(fields))
+
+        return cls.query_all(app_token, limit=limit, stream=stream, **params)
+
+    @classmethod
+    def fetch_by_address(cls, app_token, address, lazy=False):
+        """Fetch a list of record objects from the KCMO Open Data API for a
+        single address. Partial addresses can be given, but must match the
+        beginning of the street address.
+        """
+
+        if cls.UPPERCASE_ADDRESSES:
+            address = address.upper()
+
+        return cls.fetch(
+            app_token,
+            ["%s like '%s%%'" % (cls.ADDRESS_COLUMN, escape_string(address))],
+            limit=None,
+            lazy=lazy,
+        )
+
+    @classmethod
+    def fetch_by_pin(cls, app_token, pin, lazy=False, search_params=None):
+        """Fetch a list of record objects from the KCMO Open Data API for a
+        single KIVA pin. Extra `search_params` (such as a date range) narrow
+        the results down on the server. Every matching record is returned,
+        however many pages it takes.
+        """
+
+        return cls.fetch(
+            app_token,
+            cls.get_pin_search_params(pin) + (search_params or []),
+            limit=None,
+            lazy=lazy,
+        )
+
+    @classmethod
+    def get_pin_search_params(cls, pin):
+        """Returns the search criteria matching the records for a single KIVA
+        pin, for use with `fetch` or `fetch_raw`.
+        """
+
+        return cls.get_pins_search_params([pin])
+
+    @classmethod
+    def get_pins_search_params(cls, pins):
+        """Returns the search criteria matching the records for any of several
+        KIVA pins, so they can be fetched with a single query.
+        """
+
+        if cls.PIN_COLUMN is None:
+            raise SocrataDatasetException('%s records have no KIVA pin' % cls.__name__)
+
+        pins = sorted(set(pins))
+        if len(pins) == 1:
+            return ["%s = %d" % (cls.PIN_COLUMN, pins[0])]
+
+        return ["%s in (%s)" % (cls.PIN_COLUMN, ', '.join('%d' % pin for pin in pins))]
+
+    @staticmethod
+    def get_date_range_search_params(column, start_date=None, end_date=None):
+        """Returns the search criteria matching the records with a date column
+        between `start_date` and `end_date` (both inclusive; None leaves that
+        side open). Records without a date never match.
+        """
+
+        search_params = []
+        if start_date is not None:
+            search_params.append("%s >= '%s'" % (column, format_timestamp(start_date)))
+        if end_date is not None:
+            search_params.append("%s <= '%s'" % (column, format_timestamp(end_date)))
+
+        return search_params
+
+atexit.register(SocrataDataset.close_clients)
+
+# The query parameters that `query_stream` sends with a `$` prefix, as
+# sodapy does
+SOQL_PARAMETERS = set(['select', 'where', 'order', 'group', 'limit', 'offset', 'q', 'query'])
+
+_WHITESPACE = re.compile(r'\s*')
+_WHITESPACE_AND_COMMAS = re.compile(r'[\s,]*')
+
+def iter_json_array(chunks):
+    """Yields the elements of a JSON array that arrives as an iterable of
+    byte chunks, decoding each element as soon as all of it has arrived.
+    Only the part of the array that hasn't been decoded yet is kept.
+    """
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+
+    def read_more():
+        nonlocal buffer, pos
+        for chunk in chunks:
+            text = text_decoder.decode(chunk)
+            if text:
+                buffer = buffer[pos:] + text
+                pos = 0
+                return True
+
+        text = text_decoder.decode(b'', final=True)
+        if text:
+            buffer = buffer[pos:] + text
+            pos = 0
+            return True
+
+        return False
+
+    def skip_separators():
+        nonlocal pos
+        pos = _WHITESPACE_AND_COMMAS.match(buffer, pos).end()
+        while pos == len(buffer):
+            if not read_more():
+                raise SocrataDatasetException('The response ended before the end of the JSON array')
+            pos = _WHITESPACE_AND_COMMAS.match(buffer, pos).end()
+
+    skip_separators()
+    if buffer[pos] != '[':
+        raise SocrataDatasetException('The response is not a JSON array')
+    pos += 1
+
+    while True:
+        skip_separators()
+        if buffer[pos] == ']':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The element hasn't fully arrived yet
+            if not read_more():
+                raise
+            continue
+
+        # A number or other bare value cut off by the end of a chunk can look
+        # complete ("12" of "123", "0" of "0.5"), so it only counts once the
+        # next separator has arrived
+        if not isinstance(value, (dict, list, str)):
+            next_pos = _WHITESPACE.match(buffer, end).end()
+            if (next_pos == len(buffer) or buffer[next_pos] not in ',]') and read_more():
+                continue
+
+        pos = end
+        yield value
+
+def format_timestamp(value):
+    """Formats a date or datetime as a SoQL floating timestamp, in the same
+    format the KCMO Open Data API returns.
+    """
+
+    return value.strftime('%Y-%m-%dT%H:%M:%S.000')
+
+def escape_string(value):
+    """Escapes a value for use inside a quoted SoQL string."""
+
+    return value.replace("'", "''")
@@ -0,0 +1,619 @@
+import argparse
+from datetime import datetime, timedelta
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from local_dataset import read_dataset
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+class SoqlException(Exception):
+    """An exception raised for SoQL the stand-in server can't handle. It is
+    returned to the client as a 400 response, like Socrata does.
+    """
+    pass
+
+# SoQL parsing
+#
+# Only the subset of SoQL that this project uses is supported:
+#   $where   comparisons (=, !=, <>, <, <=, >, >=), like, in (...), between,
+#            is [not] null, and/or/not, parentheses, upper()/lower()
+#   $select  columns, *, :*, `expr as alias`, count/min/max/sum/avg
+#   $group   columns
+#   $order   expressions with asc/desc
+#   $limit, $offset
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<op><>|!=|<=|>=|=|<|>|\(|\)|,|\*)
+      | (?P<name>:?\*|:?[A-Za-z_][A-Za-z0-9_]*)
+    )""", re.VERBOSE)
+
+_KEYWORDS = set(['and', 'or', 'not', 'like', 'in', 'between', 'is', 'null', 'as', 'asc', 'desc'])
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise SoqlException('Could not parse SoQL near: %s' % text[pos:pos + 20])
+
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1].replace("''", "'")
+        elif kind == 'name' and value.lower() in _KEYWORDS:
+            kind, value = 'keyword', value.lower()
+
+        tokens.append((kind, value))
+        pos = match.end()
+
+    return tokens
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self, kind=None, value=None):
+        if self.pos >= len(self.tokens):
+            return None
+
+        token = self.tokens[self.pos]
+        if (kind and token[0] != kind) or (value and token[1] != value):
+            return None
+
+        return token
+
+    def accept(self, kind=None, value=None):
+        token = self.peek(kind, value)
+        if token:
+            self.pos += 1
+
+        return token
+
+    def expect(self, kind=None, value=None):
+        token = self.accept(kind, value)
+        if not token:
+            raise SoqlException('Expected %s in SoQL' % (value or kind))
+
+        return token
+
+    def done(self):
+        return self.pos >= len(self.tokens)
+
+    # Expressions are parsed into nested tuples: ('col', name), ('lit', value),
+    # ('call', name, args), or (operator, operands...)
+
+    def parse_expression(self):
+        node = self.parse_and()
+        while self.accept('keyword', 'or'):
+            node = ('or', node, self.parse_and())
+
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.accept('keyword', 'and'):
+            node = ('and', node, self.parse_not())
+
+        return node
+
+    def parse_not(self):
+        if self.accept('keyword', 'not'):
+            return ('not', self.parse_not())
+
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_operand()
+
+        negate = bool(self.accept('keyword', 'not'))
+        if self.accept('keyword', 'like'):
+            node = ('like', left, self.parse_operand())
+        elif self.accept('keyword', 'in'):
+            self.expect('op', '(')
+            values = [self.parse_operand()]
+            while self.accept('op', ','):
+                values.append(self.parse_operand())
+            self.expect('op', ')')
+            node = ('in', left, values)
+        elif self.accept('keyword', 'between'):
+            low = self.parse_operand()
+            self.expect('keyword', 'and')
+            node = ('between', left, low, self.parse_operand())
+        elif negate:
+            raise SoqlException('Unexpected NOT in SoQL')
+        elif self.accept('keyword', 'is'):
+            is_not = bool(self.accept('keyword', 'not'))
+            self.expect('keyword', 'null')
+            return ('notnull' if is_not else 'isnull', left)
+        else:
+            token = self.peek('op')
+            if token and token[1] in ('=', '!=', '<>', '<', '<=', '>', '>='):
+                self.pos += 1
+                return (token[1], left, self.parse_operand())
+
+            return left
+
+        return ('not', node) if negate else node
+
+    def parse_operand(self):
+        if self.accept('op', '('):
+            node = self.parse_expression()
+            self.expect('op', ')')
+            return node
+
+        token = self.accept('string') or self.accept('number')
+        if token:
+            return ('lit', token[1])
+
+        if self.accept('keyword', 'null'):
+            return ('lit', None)
+
+        token = self.accept('name') or self.accept('op', '*')
+        if not token:
+            raise SoqlException('Unexpected end of SoQL expression')
+
+        if self.accept('op', '('):
+            args = []
+            if not self.accept('op', ')'):
+                args.append(self.parse_expression())
+                while self.accept('op', ','):
+                    args.append(self.parse_expression())
+                self.expect('op', ')')
+            return ('call', token[1].lower(), args)
+
+        return ('col', token[1])
+
+def parse_where(text):
+    parser = _Parser(text)
+    node = parser.parse_expression()
+    if not parser.done():
+        raise SoqlException('Unexpected trailing SoQL: %s' % text)
+
+    return node
+
+def parse_list(text, allow_alias=False, allow_direction=False):
+    """Parses a comma separated $select / $group / $order list into
+    (expression, alias, descending) tuples.
+    """
+
+    parser = _Parser(text)
+    items = []
+    while not parser.done():
+        node = parser.parse_expression()
+        alias = None
+        descending = False
+
+        if allow_alias and parser.accept('keyword', 'as'):
+            alias = parser.expect('name')[1]
+        if allow_direction:
+            if parser.accept('keyword', 'desc'):
+                descending = True
+            else:
+                parser.accept('keyword', 'asc')
+
+        items.append((node, alias, descending))
+        if not parser.accept('op', ','):
+            break
+
+    if not parser.done():
+        raise SoqlException('Could not parse SoQL list: %s' % text)
+
+    return items
+
+# Evaluation
+
+_AGGREGATES = set(['count', 'min', 'max', 'sum', 'avg'])
+
+def _to_number(value):
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _compare_key(value):
+    # Socrata returns numbers as strings, so compare numerically whenever both
+    # sides look like numbers, and as strings otherwise. Nulls sort first.
+    if value is None:
+        return (0, 0)
+    number = _to_number(value)
+    if number is not None:
+        return (1, number)
+    return (2, str(value))
+
+def _like_to_regex(pattern):
+    return re.compile('^' + ''.join(
+        '.*' if char == '%' else '.' if char == '_' else re.escape(char)
+        for char in pattern
+    ) + '$', re.DOTALL)
+
+def evaluate(node, row):
+    kind = node[0]
+
+    if kind == 'lit':
+        return node[1]
+    if kind == 'col':
+        return row.get(node[1])
+    if kind == 'call':
+        name, args = node[1], node[2]
+        if name in ('upper', 'lower'):
+            value = evaluate(args[0], row)
+            if value is None:
+                return None
+            return str(value).upper() if name == 'upper' else str(value).lower()
+        if name in _AGGREGATES:
+            # Aggregates have already been calculated for grouped rows
+            return row.get(_expression_name(node))
+        raise SoqlException('Unsupported SoQL function: %s' % name)
+    if kind == 'and':
+        return bool(evaluate(node[1], row)) and bool(evaluate(node[2], row))
+    if kind == 'or':
+        return bool(evaluate(node[1], row)) or bool(evaluate(node[2], row))
+    if kind == 'not':
+        return not evaluate(node[1], row)
+    if kind == 'isnull':
+        return evaluate(node[1], row) is None
+    if kind == 'notnull':
+        return evaluate(node[1], row) is not None
+    if kind == 'like':
+        value = evaluate(node[1], row)
+        return value is not None and bool(_like_to_regex(evaluate(node[2], row)).match(str(value)))
+    if kind == 'in':
+        key = _compare_key(evaluate(node[1], row))
+        return any(key == _compare_key(evaluate(value, row)) for value in node[2])
+    if kind == 'between':
+        value = evaluate(node[1], row)
+        if value is None:
+            return False
+        key = _compare_key(value)
+        return _compare_key(evaluate(node[2], row)) <= key <= _compare_key(evaluate(node[3], row))
+
+    left = evaluate(node[1], row)
+    right = evaluate(node[2], row)
+    if left is None or right is None:
+        return False
+
+    left, right = _compare_key(left), _compare_key(right)
+    if kind == '=':
+        return left == right
+    if kind in ('!=', '<>'):
+        return left != right
+    if kind == '<':
+        return left < right
+    if kind == '<=':
+        return left <= right
+    if kind == '>':
+        return left > right
+    if kind == '>=':
+        return left >= right
+
+    raise SoqlException('Unsupported SoQL operator: %s' % kind)
+
+def _expression_name(node):
+    """The default output column name for a $select expression, following
+    Socrata's naming (e.g. `max(id)` becomes `max_id`).
+    """
+
+    if node[0] == 'col':
+        return node[1]
+    if node[0] == 'call':
+        if not node[2] or node[2][0] == ('col', '*'):
+            return node[1]
+
+        args = '_'.join(_expression_name(arg) for arg in node[2])
+        return ('%s_%s' % (node[1], args)).replace(':', '')
+
+    raise SoqlException('Unsupported $select expression')
+
+def _is_aggregate(node):
+    return node[0] == 'call' and node[1] in _AGGREGATES
+
+def _aggregate(name, node, rows):
+    if name == 'count':
+        arg = node[2][0] if node[2] else ('col', '*')
+        if arg == ('col', '*'):
+            return str(len(rows))
+        return str(sum(1 for row in rows if evaluate(arg, row) is not None))
+
+    values = [evaluate(node[2][0], row) for row in rows]
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+
+    if name == 'min':
+        return min(values, key=_compare_key)
+    if name == 'max':
+        return max(values, key=_compare_key)
+
+    numbers = [_to_number(value) for value in values]
+    total = sum(number for number in numbers if number is not None)
+    if name == 'sum':
+        return str(total)
+
+    return str(total / len(numbers))
+
+def run_query(records, params):
+    """Runs a SoQL query (a dict of $-parameters) against a list of records and
+    returns the resulting rows.
+    """
+
+    rows = records
+
+    if params.get('$where'):
+        where = parse_where(params['$where'])
+        rows = [row for row in rows if evaluate(where, row)]
+
+    select = parse_list(params['$select'], allow_alias=True) if params.get('$select') else None
+    group = parse_list(params['$group']) if params.get('$group') else None
+    aggregates = [item for item in (select or []) if _is_aggregate(item[0])]
+
+    if group or aggregates:
+        groups = {}
+        for row in rows:
+            key = tuple(evaluate(node, row) for node, _, _ in (group or []))
+            groups.setdefault(key, []).append(row)
+        if not group and not groups:
+            groups[()] = []
+
+        grouped_rows = []
+        for key, group_rows in groups.items():
+            grouped_row = {}
+            for (node, _, _), value in zip(group or [], key):
+                grouped_row[_expression_name(node)] = value
+            for node, alias, _ in aggregates:
+                grouped_row[_expression_name(node)] = _aggregate(node[1], node, group_rows)
+                if alias:
+                    # So the alias can be used in $order
+                    grouped_row[alias] = grouped_row[_expression_name(node)]
+            grouped_rows.append(grouped_row)
+        rows = grouped_rows
+
+    if params.get('$order'):
+        # Sort by the least significant expression first, so the sort is
+        # stable for the more significant ones
+        for node, _, descending in reversed(parse_list(params['$order'], allow_direction=True)):
+            rows = sorted(rows, key=lambda row: _compare_key(evaluate(node, row)), reverse=descending)
+
+    offset = int(params.get('$offset') or 0)
+    limit = int(params.get('$limit') or 1000)
+    rows = rows[offset:offset + limit]
+
+    return [_project(row, select) for row in rows]
+
+def _project(row, select):
+    if select is None:
+        return {column: value for column, value in row.items() if not column.startswith(':')}
+
+    projected = {}
+    for node, alias, _ in select:
+        if node == ('col', '*'):
+            projected.update({c: v for c, v in row.items() if not c.startswith(':')})
+        elif node == ('col', ':*'):
+            projected.update({c: v for c, v in row.items() if c.startswith(':')})
+        else:
+            value = evaluate(node, row)
+            if value is not None:
+                projected[alias or _expression_name(node)] = value
+
+    return projected
+
+# Synthetic data
+
+def generate_violations(n_records, n_pins=None, seed=0):
+    """Generates synthetic property violation records with the same columns as
+    the KCMO property violations dataset.
+    """
+
+    rng = random.Random(seed)
+    n_pins = n_pins or max(1, n_records // 5)
+    codes = [
+        ('NSWLWEED', 'WEEDS', 48, '48-30 C.O.'),
+        ('NSWLTRASH', 'TRASH AND DEBRIS', 48, '48-31 C.O.'),
+        ('NSFENCE01', 'ALL FENCES AND RET. WALLS KEPT IN REPAIR', 56, '56-114 C.O.'),
+        ('NSROOF01', 'ROOF IN DISREPAIR', 56, '56-113 C.O.'),
+        ('NSGUTTER01', 'GUTTERS MISSING', 56, '56-113 C.O.'),
+        ('NSELECT06', 'ELECTRICAL HAZARD', 56, '56-132 C.O.'),
+        ('NSINDOOR02', 'DISREPAIR INTERIOR DOOR', 56, '56-213 C.O.'),
+    ]
+    first_day = datetime(2009, 1, 1)
+
+    records = []
+    for i in range(n_records):
+        pin = rng.randint(1, n_pins)
+        code, description, chapter, ordinance = rng.choice(codes)
+        case_opened = first_day + timedelta(days=rng.randint(0, 3500))
+        is_open = rng.random() < 0.2
+        days_open = rng.randint(0, 900)
+
+        record = {
+            'id': str(i + 1),
+            'case_id': str(2009000000 + pin * 10 + rng.randint(0, 2)),
+            'status': 'Open' if is_open else 'Closed',
+            'case_opened': case_opened.strftime('%Y-%m-%dT00:00:00.000'),
+            'days_open': str(days_open),
+            'violation_code': code,
+            'violation_description': description,
+            'chapter': str(chapter),
+            'ordinance': ordinance,
+            'violation_entry_date': case_opened.strftime('%Y-%m-%dT00:00:00.000'),
+            'address': '%d MAIN ST' % pin,
+            'county': 'Jackson',
+            'state': 'MO',
+            'zip_code': str(64100 + pin % 60),
+            'latitude': '%.6f' % (39.0 + rng.random() * 0.3),
+            'longitude': '%.6f' % (-94.7 + rng.random() * 0.3),
+            'pin': str(pin),
+            'council_district': str(pin % 6 + 1),
+            'police_district': 'Central',
+            'inspection_area': 'Area %d' % (pin % 10),
+            'neighborhood': 'Neighborhood %d' % (pin % 40),
+        }
+        if not is_open:
+            case_closed = case_opened + timedelta(days=days_open)
+            record['case_closed'] = case_closed.strftime('%Y-%m-%dT00:00:00.000')
+
+        records.append(record)
+
+    return records
+
+def _add_system_fields(records):
+    for idx, record in enumerate(records):
+        record.setdefault(':id', 'row-%08d' % idx)
+        record.setdefault(':updated_at', '2018-01-01T00:00:00.000Z')
+
+    return records
+
+# HTTP server
+
+class SoqlServer:
+    """A local stand-in for the Socrata API that serves datasets from memory.
+
+    `datasets` maps resource ids to lists of records. Latency, throttling and
+    server errors can be injected to see how the client copes with them:
+        latency     seconds added to every response
+        throttle    maximum requests per second; requests over the limit get
+                    a 429 response, like Socrata's throttling
+        error_rate  fraction of requests that fail with a 500 response
+    """
+
+    def __init__(self, datasets, host='127.0.0.1', port=0, latency=0.0, throttle=None, error_rate=0.0):
+        self.datasets = {
+            resource_id: _add_system_fields(records)
+            for resource_id, records in datasets.items()
+        }
+        self.latency = latency
+        self.throttle = throttle
+        self.error_rate = error_rate
+
+        self.request_count = 0
+        self._request_times = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+
+    @property
+    def domain(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        """Starts serving in a background thread. Returns the domain to use in
+        place of `data.kcmo.org`.
+        """
+
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self.domain
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        self.stop()
+
+    def is_throttled(self):
+        if not self.throttle:
+            return False
+
+        with self._lock:
+            now = time.time()
+            self._request_times = [t for t in self._request_times if now - t < 1.0]
+            if len(self._request_times) >= self.throttle:
+                return True
+
+            self._request_times.append(now)
+
+        return False
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with server._lock:
+                server.request_count += 1
+
+            if server.latency:
+                time.sleep(server.latency)
+
+            if server.is_throttled():
+                return self.send_json(429, {'message': 'Too Many Requests'})
+
+            if server.error_rate and random.random() < server.error_rate:
+                return self.send_json(500, {'message': 'Injected server error'})
+
+            url = urlparse(self.path)
+            match = re.match(r'^/resource/([a-z0-9]{4}-[a-z0-9]{4})\.json$', url.path)
+            if not match or match.group(1) not in server.datasets:
+                return self.send_json(404, {'message': 'Dataset not found'})
+
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                rows = run_query(server.datasets[match.group(1)], params)
+            except (SoqlException, ValueError) as e:
+                return self.send_json(400, {'message': str(e)})
+
+            self.send_json(200, rows)
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json;charset=utf-8')
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body, compresslevel=1)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve local datasets through a Socrata-like SoQL API.')
+    parser.add_argument('datasets', nargs='*', metavar='RESOURCE_ID=FILE',
+                        help='a dataset to serve, from a JSON lines file written by local_dataset.py')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--synthetic', type=int, default=0, metavar='N',
+                        help='serve N synthetic property violations as ha6k-d6qu')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--throttle', type=int, default=None, help='maximum requests per second')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    args = parser.parse_args()
+
+    datasets = {}
+    if args.synthetic:
+        datasets['ha6k-d6qu'] = generate_violations(args.synthetic)
+    for dataset in args.datasets:
+        resource_id, filename = dataset.split('=', 1)
+        datasets[resource_id] = list(read_dataset(filename))
+
+    server = SoqlServer(
+        datasets,
+        port=args.port,
+        latency=args.latency,
+        throttle=args.throttle,
+        error_rate=args.error_rate,
+    )
+    print('Serving %d datasets on %s' % (len(datasets), server.domain))
+    server.httpd.serve_forever()
@@ -0,0 +1,352 @@
+from bulk_download import download_dataset
+import csv
+from dangerous_buildings import DangerousBuilding
+from local_dataset import read_dataset, write_dataset
+import numpy as np
+import os
+from score_all import DATASET_FILENAME, load_violations_dataset
+from service_request_analytics import DATASET_FILENAME as SERVICE_REQUESTS_FILENAME
+from service_request_calls import ServiceRequestCall
+import sys
+from weight_sweep import read_legal_brief_categories
+
+TILES_FILENAME = 'data/spatial_tiles.npz'
+
+# (south, west, north, east) of the tiled area, which covers Kansas City. At
+# the deepest zoom level it is split into 4096 x 4096 cells of roughly
+# 17 x 14 metres.
+BOUNDS = (38.80, -94.80, 39.44, -94.16)
+MAX_ZOOM = 12
+
+# Category for records of datasets that have no categories
+NO_CATEGORY = 'All'
+# Category for violation codes that aren't in the legal brief
+OTHER_CATEGORY = 'Other'
+
+def _spread_bits(values):
+    """Puts a zero bit between each of the lowest 16 bits of `values`."""
+
+    values = values.astype(np.uint64) & np.uint64(0xffff)
+    for shift, mask in ((8, 0x00ff00ff), (4, 0x0f0f0f0f), (2, 0x33333333), (1, 0x55555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+
+    return values
+
+def _compact_bits(values):
+    """The inverse of `_spread_bits`."""
+
+    values = values.astype(np.uint64) & np.uint64(0x55555555)
+    for shift, mask in ((1, 0x33333333), (2, 0x0f0f0f0f), (4, 0x00ff00ff), (8, 0x0000ffff)):
+        values = (values | (values >> np.uint64(shift))) & np.uint64(mask)
+
+    return values.astype(np.int64)
+
+def encode_cells(x, y):
+    """Interleaves cell columns and rows into Z-order (Morton) cell ids, like
+    geohashes: the id of a cell's parent one zoom level up is the id shifted
+    right by two bits.
+    """
+
+    return (_spread_bits(x) | (_spread_bits(y) << np.uint64(1))).astype(np.int64)
+
+def decode_cells(cells):
+    """Returns the (x, y) cell columns and rows of Z-order cell ids."""
+
+    cells = np.asarray(cells, dtype=np.int64).astype(np.uint64)
+    return _compact_bits(cells), _compact_bits(cells >> np.uint64(1))
+
+def get_cell_xy(latitudes, longitudes, zoom, bounds=BOUNDS):
+    """Returns the cell column (west to east) and row (south to north) of each
+    point at a zoom level, or -1 for points outside `bounds`.
+    """
+
+    south, west, north, east = bounds
+    n_cells = 1 << zoom
+
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    with np.errstate(invalid='ignore'):
+        inside = (latitudes >= south) & (latitudes < north) & (longitudes >= west) & (longitudes < east)
+
+    x = np.full(len(latitudes), -1, dtype=np.int64)
+    y = np.full(len(latitudes), -1, dtype=np.int64)
+    x[inside] = np.minimum(((longitudes[inside] - west) / (east - west) * n_cells).astype(np.int64), n_cells - 1)
+    y[inside] = np.minimum(((latitudes[inside] - south) / (north - south) * n_cells).astype(np.int64), n_cells - 1)
+
+    return x, y
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+class SpatialTiles:
+    """Counts of records per map cell, precomputed at every zoom level from 0
+    (one cell covering `bounds`) to `max_zoom`.
+
+    Each count is for a key: a (layer, category, status) triple such as
+    ('violations', 'Curb appeal', 'Open'). Every zoom level is stored as three
+    parallel arrays sorted by cell and key:
+
+        cells   Z-order cell ids (see `encode_cells`)
+        keys    indexes into `keys`
+        counts  number of records
+
+    Only cells with records are stored, so a level takes 20 bytes per
+    non-empty (cell, key) pair. Area queries and heatmaps read these arrays
+    instead of the records.
+    """
+
+    def __init__(self, keys, levels, bounds=BOUNDS, max_zoom=MAX_ZOOM):
+        self.keys = [tuple(key) for key in keys]
+        self.levels = levels
+        self.bounds = tuple(bounds)
+        self.max_zoom = max_zoom
+
+        self._key_index = dict((key, idx) for idx, key in enumerate(self.keys))
+        self._cell_xy = {}
+
+    @staticmethod
+    def from_points(layers, bounds=BOUNDS, max_zoom=MAX_ZOOM):
+        """Builds the tiles from {layer: (latitudes, longitudes, categories,
+        statuses)}. Points outside `bounds` (or without coordinates) are left
+        out.
+        """
+
+        keys = []
+        key_index = {}
+        all_cells = []
+        all_keys = []
+
+        for layer, (latitudes, longitudes, categories, statuses) in layers.items():
+            x, y = get_cell_xy(latitudes, longitudes, max_zoom, bounds)
+            inside = x >= 0
+
+            point_keys = []
+            for category, status in zip(categories, statuses):
+                key = (layer, category or '', status or '')
+                idx = key_index.get(key)
+                if idx is None:
+                    idx = key_index[key] = len(keys)
+                    keys.append(key)
+                point_keys.append(idx)
+
+            all_cells.append(encode_cells(x[inside], y[inside]))
+            all_keys.append(np.array(point_keys, dtype=np.int64)[inside])
+
+        cells = np.concatenate(all_cells) if all_cells else np.empty(0, dtype=np.int64)
+        point_keys = np.concatenate(all_keys) if all_keys else np.empty(0, dtype=np.int64)
+        counts = np.ones(len(cells), dtype=np.int64)
+
+        levels = {}
+        n_keys = max(len(keys), 1)
+        for zoom in range(max_zoom, -1, -1):
+            # A cell's parent is its id without the lowest two bits
+            if zoom < max_zoom:
+                cells = cells >> 2
+            combined, inverse = np.unique(cells * n_keys + point_keys, return_inverse=True)
+            counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(combined)).astype(np.int64)
+            cells = combined // n_keys
+            point_keys = combined % n_keys
+            levels[zoom] = (cells, point_keys, counts)
+
+        return SpatialTiles(keys, levels, bounds, max_zoom)
+
+    def save(self, filename):
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        arrays = {
+            'bounds': np.array(self.bounds, dtype=float),
+            'max_zoom': np.array(self.max_zoom),
+            'key_layers': np.array([key[0] for key in self.keys], dtype=str),
+            'key_categories': np.array([key[1] for key in self.keys], dtype=str),
+            'key_statuses': np.array([key[2] for key in self.keys], dtype=str),
+        }
+        for zoom, (cells, keys, counts) in self.levels.items():
+            arrays['cells_%d' % zoom] = cells
+            arrays['keys_%d' % zoom] = keys.astype(np.int32)
+            arrays['counts_%d' % zoom] = counts.astype(np.int64)
+
+        # np.savez adds the extension if it is missing
+        with open(filename, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    @staticmethod
+    def load(filename):
+        with np.load(filename) as data:
+            max_zoom = int(data['max_zoom'])
+            keys = list(zip(data['key_layers'].tolist(), data['key_categories'].tolist(), data['key_statuses'].tolist()))
+            levels = dict(
+                (zoom, (data['cells_%d' % zoom], data['keys_%d' % zoom].astype(np.int64), data['counts_%d' % zoom]))
+                for zoom in range(max_zoom + 1)
+            )
+
+            return SpatialTiles(keys, levels, tuple(data['bounds'].tolist()), max_zoom)
+
+    def get_key_mask(self, layer=None, category=None, status=None):
+        """Returns a boolean array over `keys` selecting the keys that match
+        the given layer, category and status (None matches anything).
+        """
+
+        return np.array([
+            (layer is None or key[0] == layer)
+            and (category is None or key[1] == category)
+            and (status is None or key[2] == status)
+            for key in self.keys
+        ], dtype=bool)
+
+    def get_cell_xy(self, zoom):
+        """Returns the (x, y) columns and rows of a level's stored cells."""
+
+        if zoom not in self._cell_xy:
+            self._cell_xy[zoom] = decode_cells(self.levels[zoom][0])
+
+        return self._cell_xy[zoom]
+
+    def get_cell_bounds(self, zoom, x, y):
+        """Returns the (south, west, north, east) of a cell."""
+
+        south, west, north, east = self.bounds
+        height = (north - south) / (1 << zoom)
+        width = (east - west) / (1 << zoom)
+
+        return (south + y * height, west + x * width, south + (y + 1) * height, west + (x + 1) * width)
+
+    def get_area_counts(self, south, west, north, east, zoom=None, layer=None, category=None, status=None):
+        """Returns {key: count} for the records in the cells that overlap an
+        area. The area is matched to whole cells at `zoom` (the deepest level
+        by default), so coarser levels are faster but less exact.
+        """
+
+        zoom = self.max_zoom if zoom is None else zoom
+        n_cells = 1 << zoom
+        bounds_south, bounds_west, bounds_north, bounds_east = self.bounds
+
+        def to_cell(value, low, high):
+            return int(np.clip(np.floor((value - low) / (high - low) * n_cells), 0, n_cells - 1))
+
+        min_x, max_x = to_cell(west, bounds_west, bounds_east), to_cell(east, bounds_west, bounds_east)
+        min_y, max_y = to_cell(south, bounds_south, bounds_north), to_cell(north, bounds_south, bounds_north)
+
+        _, keys, counts = self.levels[zoom]
+        x, y = self.get_cell_xy(zoom)
+        selected = (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+        selected &= self.get_key_mask(layer, category, status)[keys]
+
+        totals = np.bincount(keys[selected], weights=counts[selected], minlength=len(self.keys))
+
+        return dict((self.keys[idx], int(totals[idx])) for idx in np.flatnonzero(totals))
+
+    def get_heatmap(self, zoom, layer=None, category=None, status=None):
+        """Returns a (2^zoom x 2^zoom) array of record counts, with north at
+        the top (row 0) and west on the left.
+        """
+
+        n_cells = 1 << zoom
+        _, keys, counts = self.levels[zoom]
+        x, y = self.get_cell_xy(zoom)
+        selected = self.get_key_mask(layer, category, status)[keys]
+
+        heatmap = np.bincount(
+            (n_cells - 1 - y[selected]) * n_cells + x[selected],
+            weights=counts[selected],
+            minlength=n_cells * n_cells,
+        )
+
+        return heatmap.astype(np.int64).reshape(n_cells, n_cells)
+
+def get_violation_points(records, code_categories):
+    """Returns (latitudes, longitudes, categories, statuses) for raw property
+    violation records. Violation codes are categorized as in the legal brief.
+    """
+
+    latitudes, longitudes, categories, statuses = [], [], [], []
+    for record in records:
+        latitudes.append(_to_float(record.get('latitude')))
+        longitudes.append(_to_float(record.get('longitude')))
+        categories.append(code_categories.get(record.get('violation_code'), OTHER_CATEGORY))
+        statuses.append(record.get('status'))
+
+    return latitudes, longitudes, categories, statuses
+
+def get_dangerous_building_points(records):
+    latitudes, longitudes, categories, statuses = [], [], [], []
+    for record in records:
+        latitudes.append(_to_float(record.get('latitude')))
+        longitudes.append(_to_float(record.get('longitude')))
+        categories.append(NO_CATEGORY)
+        statuses.append(record.get('statusofcase'))
+
+    return latitudes, longitudes, categories, statuses
+
+def get_service_request_points(records):
+    latitudes, longitudes, categories, statuses = [], [], [], []
+    for record in records:
+        latitudes.append(_to_float(record.get('latitude')))
+        longitudes.append(_to_float(record.get('longitude')))
+        categories.append(record.get('category'))
+        statuses.append('Closed' if record.get('closed_date') else 'Open')
+
+    return latitudes, longitudes, categories, statuses
+
+def build_spatial_tiles(app_token, code_categories):
+    """Builds tiles for the property violations, dangerous buildings and 311
+    requests. The violations and 311 requests are read from (and first
+    downloaded to) their local dataset files.
+    """
+
+    if not os.path.exists(SERVICE_REQUESTS_FILENAME):
+        print('Downloading the 311 dataset to ' + SERVICE_REQUESTS_FILENAME)
+        write_dataset(SERVICE_REQUESTS_FILENAME, download_dataset(ServiceRequestCall, app_token))
+
+    return SpatialTiles.from_points({
+        'violations': get_violation_points(load_violations_dataset(app_token, DATASET_FILENAME), code_categories),
+        'dangerous_buildings': get_dangerous_building_points(DangerousBuilding.query_all(app_token)),
+        '311': get_service_request_points(read_dataset(SERVICE_REQUESTS_FILENAME)),
+    })
+
+def write_tile_counts(tiles, zoom, filename):
+    """Writes the counts of every non-empty cell at a zoom level."""
+
+    cells, keys, counts = tiles.levels[zoom]
+    x, y = tiles.get_cell_xy(zoom)
+
+    with open(filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow(['Cell', 'South', 'West', 'North', 'East', 'Layer', 'Category', 'Status', 'Count'])
+        for idx in range(len(cells)):
+            south, west, north, east = tiles.get_cell_bounds(zoom, x[idx], y[idx])
+            layer, category, status = tiles.keys[keys[idx]]
+            writer.writerow([
+                cells[idx],
+                '%.6f' % south,
+                '%.6f' % west,
+                '%.6f' % north,
+                '%.6f' % east,
+                layer,
+                category,
+                status,
+                counts[idx],
+            ])
+
+    print('Output zoom level %d tile counts to %s' % (zoom, filename))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: spatial_tiles.py [app token] [zoom level (optional)]')
+        sys.exit()
+
+    app_token = sys.argv[1]
+    zoom = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    if os.path.exists(TILES_FILENAME):
+        tiles = SpatialTiles.load(TILES_FILENAME)
+    else:
+        tiles = build_spatial_tiles(app_token, read_legal_brief_categories('../docs/scoring.md'))
+        tiles.save(TILES_FILENAME)
+        print('Saved spatial tiles to ' + TILES_FILENAME)
+
+    write_tile_counts(tiles, zoom, 'results/spatial_tiles_zoom_%d.csv' % zoom)
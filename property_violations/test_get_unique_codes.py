@@ -0,0 +1,62 @@
+from get_unique_codes import CodeCatalog
+from socrata_dataset import SocrataDataset
+from soql_server import SoqlServer, generate_violations
+import pytest
+
+RESOURCE_ID = 'ha6k-d6qu'
+
+@pytest.fixture
+def violations_server(monkeypatch):
+    records = generate_violations(500, seed=1)
+    with SoqlServer({RESOURCE_ID: records}) as server:
+        monkeypatch.setattr(SocrataDataset, 'API_DATASET_NAME', server.domain)
+        yield server
+
+def get_distinct(records, columns):
+    return set(tuple(record.get(column) for column in columns) for record in records)
+
+def add_violation(server, violation_code, chapter, updated_at):
+    records = server.datasets[RESOURCE_ID]
+    record = dict(records[0])
+    record.update({
+        'id': str(len(records) + 1),
+        ':id': 'row-%08d' % len(records),
+        ':updated_at': updated_at,
+        'violation_code': violation_code,
+        'violation_description': violation_code + ' DESCRIPTION',
+        'chapter': chapter,
+        'ordinance': chapter + '-1 C.O.',
+    })
+    records.append(record)
+
+def test_refresh_finds_distinct_codes(violations_server):
+    records = violations_server.datasets[RESOURCE_ID]
+    catalog = CodeCatalog()
+
+    n_entries = catalog.refresh('app token')
+
+    assert catalog.violation_codes == get_distinct(records, ['violation_code', 'violation_description'])
+    assert catalog.ordinance_numbers == get_distinct(records, ['chapter', 'ordinance'])
+    assert n_entries == len(catalog.violation_codes) + len(catalog.ordinance_numbers)
+    assert catalog.data_version == '2018-01-01T00:00:00.000Z'
+
+def test_second_refresh_is_incremental(violations_server):
+    catalog = CodeCatalog()
+    catalog.refresh('app token')
+    violation_codes = set(catalog.violation_codes)
+    ordinance_numbers = set(catalog.ordinance_numbers)
+
+    # Nothing changed: only the data version is requested
+    n_requests = violations_server.request_count
+    assert catalog.refresh('app token') == 0
+    assert violations_server.request_count == n_requests + 1
+
+    # A record that isn't newer than the catalog is skipped, which shows only
+    # the updated records are looked at
+    add_violation(violations_server, 'NSOLD01', '10', '2018-01-01T00:00:00.000Z')
+    add_violation(violations_server, 'NSNEW01', '20', '2018-02-01T00:00:00.000Z')
+
+    assert catalog.refresh('app token') == 2
+    assert catalog.violation_codes == violation_codes | {('NSNEW01', 'NSNEW01 DESCRIPTION')}
+    assert catalog.ordinance_numbers == ordinance_numbers | {('20', '20-1 C.O.')}
+    assert catalog.data_version == '2018-02-01T00:00:00.000Z'
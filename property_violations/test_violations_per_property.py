@@ -0,0 +1,40 @@
+from datetime import datetime
+from fetch_journal import FetchJournal
+from socrata_dataset import SocrataDataset
+from soql_server import SoqlServer, generate_violations
+import pytest
+from violations_per_property import get_violations_per_property
+
+@pytest.fixture
+def violations_server(monkeypatch):
+    records = generate_violations(2000, n_pins=5, seed=1)
+    with SoqlServer({'ha6k-d6qu': records}) as server:
+        monkeypatch.setattr(SocrataDataset, 'API_DATASET_NAME', server.domain)
+        yield server
+
+def get_violation_ids(violations_per_property, pin):
+    return sorted(violation.id_ for violation in violations_per_property[pin]['violations'])
+
+def test_journal_keeps_each_period_separate(violations_server, tmp_path):
+    periods = [
+        {'kiva_pin': 1, 'start_date': datetime(2010, 1, 1), 'end_date': datetime(2012, 1, 1)},
+        {'kiva_pin': 1, 'start_date': datetime(2015, 1, 1), 'end_date': datetime(2017, 1, 1)},
+    ]
+    expected = [get_violation_ids(get_violations_per_property('app token', [p]), 1) for p in periods]
+    assert all(expected)
+
+    # Scored one period at a time, like the chunks of stream_violation_stats
+    journal = FetchJournal(str(tmp_path / 'violations.journal'))
+    for reo_property, violation_ids in zip(periods, expected):
+        violations = get_violations_per_property('app token', [reo_property], journal=journal)
+        assert get_violation_ids(violations, 1) == violation_ids
+    journal.close()
+
+    # A resumed run reads both periods back without fetching them again
+    journal = FetchJournal(str(tmp_path / 'violations.journal'))
+    n_requests = violations_server.request_count
+    for reo_property, violation_ids in zip(periods, expected):
+        violations = get_violations_per_property('app token', [reo_property], journal=journal)
+        assert get_violation_ids(violations, 1) == violation_ids
+    assert violations_server.request_count == n_requests
+    journal.close()
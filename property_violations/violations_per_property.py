@@ -1,27 +1,92 @@
 import csv
-from datetime import datetime, timedelta
+from datetime import datetime
 from dateutil.parser import parse
+from fetch_journal import FetchJournal
 from property_violations import PropertyViolation
 import sys
 
-def read_properties(filename):
-    file_rows = []
+PROPERTIES_HEADER = ['KIVA PIN', 'Start Date', 'End Date']
+
+JOURNAL_FILENAME = 'data/violations_per_property.journal'
+
+# Properties with overlapping periods are fetched together, this many pins
+# per query at most (the pins are part of the query URL)
+MAX_PINS_PER_QUERY = 50
+
+def parse_property_date(value):
+    # Nearly every date in the input files is an ISO date, which strptime
+    # parses much faster than dateutil
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return parse(value)
+
+def parse_property_row(row):
+    """Validates a row of a properties input file and converts it to a
+    property dict. Raises a ValueError if the row is invalid.
+    """
+
+    if len(row) != len(PROPERTIES_HEADER):
+        raise ValueError('Expected %d columns, found %d' % (len(PROPERTIES_HEADER), len(row)))
+
+    kiva_pin = int(row[0])
+    if kiva_pin <= 0:
+        raise ValueError('Invalid KIVA pin: %s' % row[0])
+
+    start_date = parse_property_date(row[1])
+    end_date = parse_property_date(row[2]) if row[2] else None
+    if end_date and end_date < start_date:
+        raise ValueError('End date is before start date')
+
+    return {
+        'kiva_pin': kiva_pin,
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+def iter_properties(filename, chunk_size=1000, bad_rows=None):
+    """Reads a properties input file as a stream, yielding lists of at most
+    `chunk_size` property dicts. Only one chunk is held in memory at a time.
+
+    Rows that can't be parsed don't stop the stream. They are appended to the
+    `bad_rows` list (if given) as (line number, row, error message) tuples.
+    """
+
     with open(filename, 'r') as f:
         reader = csv.reader(f, delimiter=',', quotechar='"')
-        file_rows = [row for row in reader]
 
-    first_row = file_rows.pop(0)
-    if first_row != ['KIVA PIN', 'Start Date', 'End Date']:
-        raise ValueError('Unexpected input file format')
+        first_row = next(reader, None)
+        if first_row != PROPERTIES_HEADER:
+            raise ValueError('Unexpected input file format')
+
+        chunk = []
+        for row in reader:
+            if not row:
+                continue
+
+            try:
+                chunk.append(parse_property_row(row))
+            except ValueError as e:
+                if bad_rows is not None:
+                    bad_rows.append((reader.line_num, row, str(e)))
+                continue
+
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
 
+def read_properties(filename):
+    bad_rows = []
     processed_rows = []
-    for row in file_rows:
-        processed_row = {
-            'kiva_pin': int(row[0]),
-            'start_date': parse(row[1]),
-            'end_date': parse(row[2]) if row[2] else None,
-        }
-        processed_rows.append(processed_row)
+    for chunk in iter_properties(filename, bad_rows=bad_rows):
+        processed_rows.extend(chunk)
+
+    if bad_rows:
+        line_num, row, message = bad_rows[0]
+        raise ValueError('Invalid row on line %d: %s' % (line_num, message))
 
     return processed_rows
 
@@ -50,27 +115,135 @@ def read_legal_brief_violations(filename):
 
     return list(violation_codes)
 
-def get_violations_per_property(app_token, properties, debug=False):
-    results = {}
+def filter_relevant_violations(violations, start_date, end_date):
+    """Returns the violations that were opened during the given period. An
+    `end_date` of None means the period is still ongoing.
+    """
+
+    relevant_violations = []
+    for violation in violations:
+        if violation.case_opened is None:
+            continue
+
+        # TODO: violations will only be included here if the violation was
+        # opened *after* the given start date. Is this correct? Are there
+        # cases where the lender took over a property with open violations
+        # that should still be counted here?
+        if violation.case_opened >= start_date:
+            if end_date:
+                if violation.case_opened <= end_date:
+                    relevant_violations.append(violation)
+            else:
+                relevant_violations.append(violation)
+
+    return relevant_violations
+
+def get_property_search_params(kiva_pins, start_date, end_date):
+    """Returns the search criteria for the violations of one or more
+    properties that were opened during a period (see
+    `filter_relevant_violations`), so that only those rows are fetched.
+    """
 
+    return PropertyViolation.get_pins_search_params(kiva_pins) + \
+        PropertyViolation.get_date_range_search_params('case_opened', start_date, end_date)
+
+def group_overlapping_properties(properties, max_pins=MAX_PINS_PER_QUERY):
+    """Groups properties whose periods overlap, so each group's violations
+    can be fetched with one query. Returns a list of (properties, start date,
+    end date) with the earliest start and latest end date of each group (an
+    end date of None means the period is still ongoing). Groups have at most
+    `max_pins` distinct pins.
+    """
+
+    groups = []
+    group = None
+    pins = set()
+    for reo_property in sorted(properties, key=lambda p: p['start_date']):
+        if group is None \
+                or (group[2] is not None and reo_property['start_date'] > group[2]) \
+                or (reo_property['kiva_pin'] not in pins and len(pins) >= max_pins):
+            group = [[], reo_property['start_date'], reo_property['end_date']]
+            groups.append(group)
+            pins = set()
+
+        group[0].append(reo_property)
+        pins.add(reo_property['kiva_pin'])
+        if group[2] is not None:
+            group[2] = None if reo_property['end_date'] is None else max(group[2], reo_property['end_date'])
+
+    return [tuple(group) for group in groups]
+
+def get_journal_key(reo_property):
+    """Returns the FetchJournal key of a property's records. The period is
+    part of the key, since only the rows opened during it are fetched.
+    """
+
+    return '%d %s %s' % (
+        reo_property['kiva_pin'],
+        reo_property['start_date'].isoformat(),
+        reo_property['end_date'].isoformat() if reo_property['end_date'] else '',
+    )
+
+def add_pin_records(records_per_pin, pin, records):
+    # A pin listed more than once can have records from several periods
+    pin_records = records_per_pin.setdefault(pin, [])
+    ids = set(record.get('id') for record in pin_records)
+    pin_records.extend(record for record in records if record.get('id') not in ids)
+
+def get_violations_per_property(app_token, properties, debug=False, journal=None):
+    """Fetches the violations of each property that were opened during its
+    period. The period is part of the query, and properties with
+    overlapping periods share a query, paged until every row is fetched.
+
+    With a FetchJournal, each property's raw records are recorded as soon as
+    they are fetched, keyed by its pin and period, and properties already in
+    the journal (from an earlier, interrupted run) are not fetched again.
+    """
+
+    records_per_pin = {}
+    to_fetch = []
     for reo_property in properties:
-        violations = PropertyViolation.fetch_by_pin(
+        records = journal.get(get_journal_key(reo_property)) if journal is not None else None
+        if records is None:
+            to_fetch.append(reo_property)
+        else:
+            add_pin_records(records_per_pin, reo_property['kiva_pin'], records)
+
+    for group, start_date, end_date in group_overlapping_properties(to_fetch):
+        group_records = dict((p['kiva_pin'], []) for p in group)
+
+        records = PropertyViolation.fetch_raw(
             app_token,
-            reo_property['kiva_pin'],
+            get_property_search_params(list(group_records), start_date, end_date),
+            limit=None,
+            stream=True,
         )
+        for record in records:
+            group_records[int(record['pin'])].append(record)
 
-        relevant_violations = []
-        for violation in violations:
-            # TODO: violations will only be included here if the violation was
-            # opened *after* the given start date. Is this correct? Are there
-            # cases where the lender took over a property with open violations
-            # that should still be counted here?
-            if violation.case_opened >= reo_property['start_date']:
-                if reo_property['end_date']:
-                    if violation.case_opened <= reo_property['end_date']:
-                        relevant_violations.append(violation)
-                else:
-                    relevant_violations.append(violation)
+        for pin, pin_records in group_records.items():
+            add_pin_records(records_per_pin, pin, pin_records)
+
+        # The group's period covers each of its properties' periods
+        if journal is not None:
+            for reo_property in group:
+                journal.record(get_journal_key(reo_property), group_records[reo_property['kiva_pin']])
+
+    results = {}
+
+    for reo_property in properties:
+        violations = [
+            PropertyViolation.from_json(rec)
+            for rec in records_per_pin[reo_property['kiva_pin']]
+        ]
+
+        # Properties that share a query can get rows from outside their own
+        # period
+        relevant_violations = filter_relevant_violations(
+            violations,
+            reo_property['start_date'],
+            reo_property['end_date'],
+        )
 
         results[reo_property['kiva_pin']] = {
             'start_date': reo_property['start_date'],
@@ -91,6 +264,61 @@ def get_violations_per_property(app_token, properties, debug=False):
 
     return results
 
+def get_score_weight(is_open, is_legal_brief_violation):
+    """Returns the score a violation adds for each day that it is open."""
+
+    score = 0
+
+    # Violations that are still open are weighted more heavily
+    if is_open:
+        score += 2
+
+    # Violations that are relevant (based on the criteria extracted
+    # from the Chicago legal brief) are weighted more heavily
+    if is_legal_brief_violation:
+        score += 2
+
+    score += 1
+
+    return score
+
+def get_violation_weight(violation, legal_brief_violation_codes):
+    return get_score_weight(
+        violation.is_open,
+        violation.code.code in legal_brief_violation_codes,
+    )
+
+def get_violation_last_scored_day(violation, start_date):
+    """Returns the last day (as an offset in days from `start_date`) on which
+    a violation counts as open for scoring, or None if it never does. The
+    violation counts as open on every day of the period up to and including
+    that day.
+    """
+
+    # TODO: this is the open-on-day test the scoring has always used: a
+    # violation counts on a given day if it was opened on or *after* that day
+    # (and is still open, or was closed on or after that day). Should this be
+    # case_opened <= day instead?
+    if violation.is_open:
+        last_date = violation.case_opened
+    elif violation.case_closed:
+        last_date = min(violation.case_opened, violation.case_closed)
+    else:
+        return None
+
+    return (last_date - start_date).days
+
+def get_violation_open_days(violation, start_date, days):
+    """Returns the number of days, out of the `days` days starting at
+    `start_date`, on which a violation counts as open for scoring.
+    """
+
+    last_day = get_violation_last_scored_day(violation, start_date)
+    if last_day is None:
+        return 0
+
+    return max(0, min(last_day + 1, days))
+
 def calculate_violation_stats(violations_per_property, legal_brief_violation_codes):
     """Calculates a score for a given property based on its violations.
 
@@ -118,41 +346,17 @@ def calculate_violation_stats(violations_per_property, legal_brief_violation_cod
             avg_duration = 0.0
         else:
             # Calculate an estimated score for the violations that were open during
-            # the given period
-            daily_scores = []
-            for i in range(0, days):
-                day = start_date + timedelta(days=i)
-                day_violation_scores = []
-
-                for violation in property_data['violations']:
-                    violation_open_on_day = False
-                    if violation.case_opened >= day:
-                        if violation.is_open:
-                            violation_open_on_day = True
-                        elif violation.case_closed and violation.case_closed >= day:
-                            violation_open_on_day = True
-
-                    if not violation_open_on_day:
-                        continue
-
-                    score = 0
-
-                    # Violations that are still open are weighted more heavily
-                    if violation.is_open:
-                        score += 2
-
-                    # Violations that are relevant (based on the criteria extracted
-                    # from the Chicago legal brief) are weighted more heavily
-                    if violation.code.code in legal_brief_violation_codes:
-                        score += 2
-
-                    score += 1
-
-                    day_violation_scores.append(score)
-
-                daily_scores.append(sum(day_violation_scores))
-
-            avg_daily_score = sum(daily_scores) / days
+            # the given period. Each violation adds the same score on every day it
+            # is open, so the sum of the daily scores is the sum of each
+            # violation's score multiplied by the number of days it was open.
+            weighted_open_days = 0
+            for violation in property_data['violations']:
+                weighted_open_days += (
+                    get_violation_weight(violation, legal_brief_violation_codes) *
+                    get_violation_open_days(violation, start_date, days)
+                )
+
+            avg_daily_score = weighted_open_days / days
 
             # Find the average duration of violations open during the given period
             durations = [v.days_open for v in property_data['violations']]
@@ -164,25 +368,27 @@ def calculate_violation_stats(violations_per_property, legal_brief_violation_cod
             'avg_duration': avg_duration,
         }
 
-
     return results
 
-def write_violation_stats(violation_stats, filename):
-    file_output = []
-    file_output.append([
-        'KIVA PIN',
-        'Violation Count',
-        'Property Score',
-        'Average Durations',
-    ])
+VIOLATION_STATS_HEADER = [
+    'KIVA PIN',
+    'Violation Count',
+    'Property Score',
+    'Average Durations',
+]
 
+def get_violation_stats_rows(violation_stats):
     for kiva_pin, stats in violation_stats.items():
-        file_output.append([
+        yield [
             kiva_pin,
             stats['violation_count'],
             stats['score'],
             stats['avg_duration'],
-        ])
+        ]
+
+def write_violation_stats(violation_stats, filename):
+    file_output = [VIOLATION_STATS_HEADER]
+    file_output.extend(get_violation_stats_rows(violation_stats))
 
     with open(filename, 'w') as f:
         writer = csv.writer(f, delimiter=',', quotechar='"')
@@ -190,6 +396,36 @@ def write_violation_stats(violation_stats, filename):
 
     print('Output violation stats to ' + filename)
 
+def stream_violation_stats(app_token, filename, output_filename, legal_brief_violation_codes,
+                           chunk_size=100, journal=None):
+    """Runs the whole pipeline (read, fetch, score, write) one chunk of
+    properties at a time, so memory use doesn't grow with the size of the
+    input file and results are written as soon as each chunk is scored.
+    Fetched violations are recorded in `journal` (a FetchJournal) if given,
+    so an interrupted run can be resumed without fetching them again.
+    Returns the list of input rows that couldn't be parsed.
+    """
+
+    bad_rows = []
+    n_properties = 0
+
+    with open(output_filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow(VIOLATION_STATS_HEADER)
+
+        for properties in iter_properties(filename, chunk_size, bad_rows):
+            violations = get_violations_per_property(app_token, properties, journal=journal)
+            violation_stats = calculate_violation_stats(violations, legal_brief_violation_codes)
+            writer.writerows(get_violation_stats_rows(violation_stats))
+            f.flush()
+
+            n_properties += len(properties)
+            print('Scored %d properties' % n_properties)
+
+    print('Output violation stats to ' + output_filename)
+
+    return bad_rows
+
 if __name__ == '__main__':
     if len(sys.argv) == 1:
         print('Provide your app token as an argument when running this script.')
@@ -200,8 +436,22 @@ if __name__ == '__main__':
         print('Provide your app token as an argument when running this script.')
         sys.exit()
 
-    properties = read_properties('example/reo_properties.csv')
     legal_brief_violation_codes = read_legal_brief_violations('../docs/scoring.md')
-    violations = get_violations_per_property(app_token, properties)
-    violation_stats = calculate_violation_stats(violations, legal_brief_violation_codes)
-    write_violation_stats(violation_stats, 'example/results/violation_stats.csv')
+
+    # Violations fetched so far are kept here until the run finishes, so a
+    # rerun after a crash only fetches the properties that weren't done yet
+    journal = FetchJournal(JOURNAL_FILENAME)
+    if len(journal):
+        print('Resuming: %d properties already fetched' % len(journal))
+
+    bad_rows = stream_violation_stats(
+        app_token,
+        'example/reo_properties.csv',
+        'example/results/violation_stats.csv',
+        legal_brief_violation_codes,
+        journal=journal,
+    )
+    journal.remove()
+
+    for line_num, row, message in bad_rows:
+        print('Skipped line %d (%s): %s' % (line_num, ','.join(row), message))
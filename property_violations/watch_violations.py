@@ -0,0 +1,206 @@
+from incremental_scoring import STATE_FILENAME, ScoreState, refresh_score_state
+import json
+import os
+from property_violations import LazyPropertyViolation, PropertyViolation
+import sys
+import time
+from violations_per_property import read_legal_brief_violations, read_properties
+
+CURSOR_FILENAME = 'data/watch_cursor.json'
+POLL_INTERVAL = 60
+
+class ViolationWatcher:
+    """Polls the violations dataset for newly filed violations and updates
+    the scores of the watched properties (the properties in a ScoreState).
+
+    The cursor is the highest violation `id` seen so far (violation ids
+    increase as violations are filed), along with the newest
+    `violation_entry_date`. Each poll only asks for the rows with a higher
+    id, so its cost depends on the number of new rows rather than the size
+    of the dataset. New rows are routed to properties with a set of the
+    watched KIVA pins before any record objects are built.
+
+    Only new filings are picked up; changes to existing violations (such as
+    closings) are applied by `refresh_score_state`.
+    """
+
+    def __init__(self, app_token, state, legal_brief_violation_codes, cursor=None):
+        self.app_token = app_token
+        self.state = state
+        self.legal_brief_violation_codes = set(legal_brief_violation_codes)
+        self.watched_pins = set(state.properties)
+
+        cursor = cursor or {}
+        self.last_id = cursor.get('id')
+        self.last_entry_date = cursor.get('violation_entry_date')
+
+    @property
+    def cursor(self):
+        return {
+            'id': self.last_id,
+            'violation_entry_date': self.last_entry_date,
+        }
+
+    def watch_pins(self, kiva_pins):
+        """Updates the set of watched pins, e.g. after properties were added
+        to or removed from the score state.
+        """
+
+        self.watched_pins = set(kiva_pins)
+
+    def start(self):
+        """Moves the cursor to the newest violation, if it hasn't been set, so
+        that only violations filed from now on are reported.
+        """
+
+        if self.last_id is not None:
+            return
+
+        rows = PropertyViolation.query(
+            self.app_token,
+            select='max(id) as last_id, max(violation_entry_date) as last_entry_date',
+        )
+        if rows and rows[0].get('last_id') is not None:
+            self.last_id = int(float(rows[0]['last_id']))
+            self.last_entry_date = rows[0].get('last_entry_date')
+        else:
+            self.last_id = 0
+
+    def poll(self):
+        """Fetches the violations filed since the last poll and applies those
+        for watched properties. Returns a list of score change events:
+
+            {
+                'kiva_pin': ...,
+                'violation_ids': [...],
+                'previous': stats before the new violations,
+                'current': stats after the new violations,
+            }
+
+        with stats in the same format as `calculate_violation_stats`.
+        """
+
+        self.start()
+
+        # The cursor only moves once every new row has been fetched and
+        # applied, so a failed poll is retried from the same place
+        last_id = self.last_id
+        last_entry_date = self.last_entry_date
+
+        new_violations = {}
+        records = PropertyViolation.fetch_raw(self.app_token, ['id > %d' % self.last_id], limit=None, stream=True)
+        for record in records:
+            last_id = max(last_id, int(record['id']))
+            entry_date = record.get('violation_entry_date')
+            if entry_date and (last_entry_date is None or entry_date > last_entry_date):
+                last_entry_date = entry_date
+
+            pin = record.get('pin')
+            if pin and int(pin) in self.watched_pins:
+                new_violations.setdefault(int(pin), []).append(LazyPropertyViolation.from_json(record))
+
+        events = []
+        for pin, violations in new_violations.items():
+            property_state = self.state.properties.get(pin)
+            if property_state is None:
+                continue
+
+            previous = property_state.get_stats()
+            changed = False
+            for violation in violations:
+                if property_state.update_violation(violation, self.legal_brief_violation_codes):
+                    changed = True
+
+            current = property_state.get_stats()
+            if changed and current != previous:
+                events.append({
+                    'kiva_pin': pin,
+                    'violation_ids': [violation.id_ for violation in violations],
+                    'previous': previous,
+                    'current': current,
+                })
+
+        self.last_id = last_id
+        self.last_entry_date = last_entry_date
+
+        return events
+
+    def watch(self, on_events, interval=POLL_INTERVAL, max_polls=None):
+        """Polls every `interval` seconds, calling `on_events` with each
+        poll's events (if there are any). Poll errors are printed and the
+        next poll tries again from the same cursor.
+        """
+
+        n_polls = 0
+        while max_polls is None or n_polls < max_polls:
+            if n_polls:
+                time.sleep(interval)
+            n_polls += 1
+
+            try:
+                events = self.poll()
+            except Exception as e:
+                print('Poll failed: %s' % e)
+                continue
+
+            if events:
+                on_events(events)
+
+def format_event(event):
+    previous = event['previous']
+    current = event['current']
+
+    return 'KIVA PIN %d: %d new violation(s), score %.4f -> %.4f, %d -> %d violations' % (
+        event['kiva_pin'],
+        len(event['violation_ids']),
+        previous['score'],
+        current['score'],
+        previous['violation_count'],
+        current['violation_count'],
+    )
+
+def load_cursor(filename):
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+def save_cursor(cursor, filename):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as f:
+        json.dump(cursor, f)
+    os.replace(temp_filename, filename)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: watch_violations.py [app token] [poll interval in seconds (optional)]')
+        sys.exit()
+
+    app_token = sys.argv[1]
+    interval = int(sys.argv[2]) if len(sys.argv) > 2 else POLL_INTERVAL
+
+    properties = read_properties('example/reo_properties.csv')
+    legal_brief_violation_codes = set(read_legal_brief_violations('../docs/scoring.md'))
+
+    state = ScoreState.load(STATE_FILENAME)
+    refresh_score_state(app_token, state, properties, legal_brief_violation_codes)
+    state.save(STATE_FILENAME)
+
+    watcher = ViolationWatcher(app_token, state, legal_brief_violation_codes, load_cursor(CURSOR_FILENAME))
+    watcher.start()
+    save_cursor(watcher.cursor, CURSOR_FILENAME)
+    print('Watching %d properties for violations after id %d' % (len(watcher.watched_pins), watcher.last_id))
+
+    def on_events(events):
+        for event in events:
+            print(format_event(event))
+
+        state.save(STATE_FILENAME)
+        save_cursor(watcher.cursor, CURSOR_FILENAME)
+
+    watcher.watch(on_events, interval)
@@ -0,0 +1,201 @@
+import csv
+from datetime import datetime
+import itertools
+import numpy as np
+import sys
+from violations_per_property import (
+    get_violation_open_days,
+    get_violations_per_property,
+    read_legal_brief_violations,
+    read_properties,
+)
+
+# Features every property gets, before the per-category ones. The weights
+# `calculate_violation_stats` uses are 1 for each day a violation is open,
+# plus 2 if it is still open and 2 if it is a legal brief violation.
+BASE_FEATURES = ['base', 'open', 'legal_brief']
+DEFAULT_WEIGHTS = {'base': 1, 'open': 2, 'legal_brief': 2}
+
+# The weights tried for each feature by `get_weight_grid`
+OPEN_WEIGHTS = [0, 1, 2, 3, 4]
+LEGAL_BRIEF_WEIGHTS = [0, 1, 2, 3, 4]
+CATEGORY_WEIGHTS = [0, 1]
+
+TOP_N = 25
+
+def read_legal_brief_categories(filename):
+    """Reads the category of each violation code from the legal brief scoring
+    file (a Markdown table with 'Category' and 'Violation Codes' columns).
+    Codes listed under more than one category keep the first one.
+    """
+
+    with open(filename, 'r') as f:
+        rows = [
+            [cell.strip() for cell in line.strip().strip('|').split('|')]
+            for line in f
+            if line.strip().startswith('|')
+        ]
+
+    header = rows[0]
+    category_idx = header.index('Category')
+    codes_idx = header.index('Violation Codes')
+
+    code_categories = {}
+    for row in rows[2:]:
+        for code in row[codes_idx].split(','):
+            code = code.strip()
+            if code and code not in code_categories:
+                code_categories[code] = row[category_idx]
+
+    return code_categories
+
+def build_feature_matrix(violations_per_property, legal_brief_violation_codes, code_categories):
+    """Turns each property's violations into a row of features: the number of
+    days its violations were open during the period (divided by the length of
+    the period), split by whether they are still open, legal brief violations
+    and their category. A property's score for a set of weights is then the
+    dot product of its row with the weight vector.
+
+    Returns (pins, feature names, matrix).
+    """
+
+    legal_brief_violation_codes = set(legal_brief_violation_codes)
+    categories = sorted(set(code_categories.values()))
+    feature_names = BASE_FEATURES + ['category: ' + category for category in categories]
+    category_features = dict(
+        (category, len(BASE_FEATURES) + idx) for idx, category in enumerate(categories)
+    )
+
+    pins = list(violations_per_property)
+    features = np.zeros((len(pins), len(feature_names)))
+
+    for row, pin in enumerate(pins):
+        property_data = violations_per_property[pin]
+        start_date = property_data['start_date']
+        end_date = property_data['end_date'] or datetime.now()
+        days = (end_date - start_date).days
+
+        for violation in property_data['violations']:
+            open_days = get_violation_open_days(violation, start_date, days)
+            if not open_days:
+                continue
+
+            features[row, 0] += open_days
+            if violation.is_open:
+                features[row, 1] += open_days
+            if violation.code.code in legal_brief_violation_codes:
+                features[row, 2] += open_days
+
+            category = code_categories.get(violation.code.code)
+            if category is not None:
+                features[row, category_features[category]] += open_days
+
+        if days:
+            features[row] /= days
+
+    return pins, feature_names, features
+
+def get_weight_vector(feature_names, weights):
+    """Builds a weight vector from a dict of feature name -> weight."""
+
+    return np.array([weights.get(name, 0) for name in feature_names], dtype=float)
+
+def get_weight_grid(feature_names):
+    """Returns every combination of the weights in OPEN_WEIGHTS,
+    LEGAL_BRIEF_WEIGHTS and CATEGORY_WEIGHTS (with a base weight of 1), as a
+    (features x configurations) matrix. The first column is the current
+    scoring.
+    """
+
+    n_categories = len(feature_names) - len(BASE_FEATURES)
+    columns = [get_weight_vector(feature_names, DEFAULT_WEIGHTS)]
+
+    for open_weight, legal_brief_weight in itertools.product(OPEN_WEIGHTS, LEGAL_BRIEF_WEIGHTS):
+        for category_weights in itertools.product(CATEGORY_WEIGHTS, repeat=n_categories):
+            columns.append(np.array([1, open_weight, legal_brief_weight] + list(category_weights), dtype=float))
+
+    return np.column_stack(columns)
+
+def rank_scores(scores):
+    """Ranks properties by score (1 is the highest) for each configuration.
+    Tied properties share the best rank of the tie.
+    """
+
+    ranks = np.empty(scores.shape, dtype=np.int64)
+    for column in range(scores.shape[1]):
+        sorted_scores = np.sort(-scores[:, column])
+        ranks[:, column] = np.searchsorted(sorted_scores, -scores[:, column], side='left') + 1
+
+    return ranks
+
+def sweep_weights(features, weight_grid, top_n=TOP_N):
+    """Scores every property for every weight configuration with a single
+    matrix product. Returns the (properties x configurations) scores and
+    ranks, and for each configuration how many of the top `top_n` properties
+    under the first configuration are still in its top `top_n`.
+    """
+
+    scores = features @ weight_grid
+    ranks = rank_scores(scores)
+
+    reference_top = ranks[:, 0] <= top_n
+    top_overlap = np.count_nonzero((ranks <= top_n) & reference_top[:, np.newaxis], axis=0)
+
+    return scores, ranks, top_overlap
+
+def write_sweep_results(pins, feature_names, weight_grid, scores, ranks, top_overlap,
+                        configurations_filename, ranks_filename):
+    with open(configurations_filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow(['Configuration'] + feature_names + ['Top %d Overlap' % TOP_N])
+        for column in np.argsort(-top_overlap, kind='stable'):
+            writer.writerow(
+                [column] + ['%g' % weight for weight in weight_grid[:, column]] + [top_overlap[column]]
+            )
+
+    print('Output %d weight configurations to %s' % (weight_grid.shape[1], configurations_filename))
+
+    with open(ranks_filename, 'w') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow(['KIVA PIN', 'Property Score', 'Rank', 'Best Rank', 'Worst Rank', 'Median Rank'])
+        for row in np.argsort(ranks[:, 0], kind='stable'):
+            writer.writerow([
+                pins[row],
+                scores[row, 0],
+                ranks[row, 0],
+                ranks[row].min(),
+                ranks[row].max(),
+                '%g' % np.median(ranks[row]),
+            ])
+
+    print('Output property ranks to ' + ranks_filename)
+
+if __name__ == '__main__':
+    if len(sys.argv) == 1:
+        print('Provide your app token as an argument when running this script.')
+        sys.exit()
+
+    app_token = sys.argv[1]
+    if not app_token:
+        print('Provide your app token as an argument when running this script.')
+        sys.exit()
+
+    properties = read_properties('example/reo_properties.csv')
+    legal_brief_violation_codes = read_legal_brief_violations('../docs/scoring.md')
+    code_categories = read_legal_brief_categories('../docs/scoring.md')
+    violations = get_violations_per_property(app_token, properties)
+
+    pins, feature_names, features = build_feature_matrix(violations, legal_brief_violation_codes, code_categories)
+    weight_grid = get_weight_grid(feature_names)
+    scores, ranks, top_overlap = sweep_weights(features, weight_grid)
+
+    write_sweep_results(
+        pins,
+        feature_names,
+        weight_grid,
+        scores,
+        ranks,
+        top_overlap,
+        'example/results/weight_sweep_configurations.csv',
+        'example/results/weight_sweep_ranks.csv',
+    )